@@ -0,0 +1,176 @@
+# Async_http.py
+"""
+Async keep-alive HTTP clients (httpx), the event-loop counterpart of Http_pool.
+
+One AsyncPooledClient per upstream (e.g. "dhan"). It mirrors PooledClient's
+behaviour so the async and sync paths agree:
+
+  - per-endpoint timeouts: explicit > table > default ((connect, read) tuples
+    map to httpx.Timeout)
+  - failed connects are retried for every method (nothing was sent); GETs are
+    also retried on read errors and 502/503/504 with backoff
+  - endpoints mapped in rate_classes go through Rate_limit.call_async, so
+    sync and async calls share the same per-account buckets
+
+httpx connection pools belong to the event loop that opened them, so the
+underlying AsyncClient is created lazily per running loop (normally just the
+server's one).
+"""
+import asyncio, hashlib, threading
+from typing import Any, Dict, Optional
+
+import httpx
+
+from Http_pool import Timeout
+from Rate_limit import rate_limiter
+
+_clients: Dict[str, "AsyncPooledClient"] = {}
+_clients_lock = threading.Lock()
+
+_RETRY_STATUS = (502, 503, 504)
+
+
+def _httpx_timeout(t: Timeout) -> httpx.Timeout:
+    if isinstance(t, tuple):
+        return httpx.Timeout(t[1], connect=t[0])
+    return httpx.Timeout(t)
+
+
+class AsyncPooledClient:
+    def __init__(self, name: str,
+                 pool_maxsize: int = 32,
+                 keepalive: int = 16,
+                 get_retries: int = 2,
+                 backoff: float = 0.25,
+                 default_timeout: Timeout = (3.05, 15),
+                 timeouts: Optional[Dict[str, Timeout]] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 rate_classes: Optional[Dict[str, str]] = None,
+                 account_header: Optional[str] = None):
+        self.name = name
+        self.pool_maxsize = pool_maxsize
+        self.keepalive = min(keepalive, pool_maxsize)
+        self.get_retries = get_retries
+        self.backoff = backoff
+        self.default_timeout = default_timeout
+        self.timeouts: Dict[str, Timeout] = dict(timeouts or {})
+        self.headers = dict(headers or {})
+        self.rate_classes: Dict[str, str] = dict(rate_classes or {})
+        self.account_header = account_header
+
+        self._lock = threading.Lock()
+        self._loops: Dict[int, httpx.AsyncClient] = {}        # id(loop) -> client
+        self._requests = 0
+        self._errors = 0
+        self._retries = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            cli = self._loops.get(id(loop))
+            if cli is None or cli.is_closed:
+                cli = httpx.AsyncClient(
+                    headers=self.headers,
+                    transport=httpx.AsyncHTTPTransport(
+                        retries=self.get_retries,        # connect failures only
+                        limits=httpx.Limits(max_connections=self.pool_maxsize,
+                                            max_keepalive_connections=self.keepalive)),
+                )
+                self._loops[id(loop)] = cli
+            return cli
+
+    def timeout_for(self, endpoint: Optional[str]) -> Timeout:
+        if endpoint and endpoint in self.timeouts:
+            return self.timeouts[endpoint]
+        return self.default_timeout
+
+    def rate_class_for(self, endpoint: Optional[str]) -> Optional[str]:
+        return self.rate_classes.get(endpoint or "", self.rate_classes.get("*"))
+
+    async def request(self, method: str, url: str, endpoint: Optional[str] = None,
+                      timeout: Optional[Timeout] = None, account: Optional[str] = None,
+                      **kw: Any) -> httpx.Response:
+        """Same contract as PooledClient.request, awaited."""
+        method = method.upper()
+        t = _httpx_timeout(timeout if timeout is not None else self.timeout_for(endpoint))
+        cli = self._client()
+
+        async def _send() -> httpx.Response:
+            attempt = 0
+            while True:
+                with self._lock:
+                    self._requests += 1
+                try:
+                    resp = await cli.request(method, url, timeout=t, **kw)
+                    if method != "GET" or resp.status_code not in _RETRY_STATUS or attempt >= self.get_retries:
+                        return resp
+                except httpx.TransportError:
+                    with self._lock:
+                        self._errors += 1
+                    if method != "GET" or attempt >= self.get_retries:
+                        raise
+                attempt += 1
+                with self._lock:
+                    self._retries += 1
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)))
+
+        cls = self.rate_class_for(endpoint)
+        if cls is None:
+            return await _send()
+        if account is None and self.account_header:
+            val = str((kw.get("headers") or {}).get(self.account_header) or "")
+            account = hashlib.sha1(val.encode()).hexdigest()[:12] if val else None
+        return await rate_limiter.call_async(self.name, cls, account, _send)
+
+    async def get(self, url: str, **kw: Any) -> httpx.Response:
+        return await self.request("GET", url, **kw)
+
+    async def post(self, url: str, **kw: Any) -> httpx.Response:
+        return await self.request("POST", url, **kw)
+
+    async def aclose(self) -> None:
+        """Close the running loop's client (call from shutdown)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            cli = self._loops.pop(id(loop), None)
+        if cli is not None:
+            await cli.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "async": True,
+                "pool_maxsize": self.pool_maxsize,
+                "keepalive": self.keepalive,
+                "loops": len(self._loops),
+                "calls": self._requests,
+                "errors": self._errors,
+                "retries": self._retries,
+            }
+
+
+def get_async_client(name: str, **cfg: Any) -> AsyncPooledClient:
+    """Process-wide async client for <name>; cfg only applies on first creation."""
+    with _clients_lock:
+        cli = _clients.get(name)
+        if cli is None:
+            cli = AsyncPooledClient(name, **cfg)
+            _clients[name] = cli
+        return cli
+
+
+def all_stats() -> Dict[str, Any]:
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {c.name: c.stats() for c in clients}
+
+
+async def close_all() -> None:
+    with _clients_lock:
+        clients = list(_clients.values())
+    for c in clients:
+        try:
+            await c.aclose()
+        except Exception:
+            pass
@@ -1,8 +1,18 @@
 # Broker_dhan.py
 
-import os, json, threading
-from typing import Dict, Any, List, Optional
-import requests
+import asyncio, os, json, threading, time
+from typing import Dict, Any, List, Optional, Tuple
+
+from Client_registry import client_registry
+from Dhan_order_feed import order_store
+from Ltp_service import ltp_service
+from Market_data import market_data, inst as md_inst
+from Async_http import get_async_client
+from Http_pool import get_client, env_num, env_timeout
+from Instrument_cache import instrument_cache
+from Order_dispatch import order_dispatcher
+from Rate_limit import ORDER, NONTRADING
+import Square_off as square_off
 
 STAT_KEYS = ["pending", "traded", "rejected", "cancelled", "others"]
 
@@ -10,6 +20,39 @@ STAT_KEYS = ["pending", "traded", "rejected", "cancelled", "others"]
 BASE_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
 CLIENTS_DIR = os.path.join(BASE_DIR, "clients", "dhan")
 
+# shared keep-alive pool for all Dhan REST calls; timeouts are (connect, read)
+# and each can be overridden with DHAN_TIMEOUT_<ENDPOINT>="connect,read"
+_DHAN_TIMEOUTS = {
+    "auth":      (3.05, 15),
+    "profile":   (3.05, 10),
+    "orders":    (3.05, 10),
+    "positions": (3.05, 10),
+    "holdings":  (3.05, 10),
+    "fundlimit": (3.05, 10),
+    "place":     (3.05, 15),
+    "cancel":    (3.05, 15),
+    "modify":    (3.05, 20),
+}
+# Rate_limit class per endpoint; buckets are per access token (= per account)
+_DHAN_RATE_CLASSES = {
+    "place":  ORDER,
+    "cancel": ORDER,
+    "modify": ORDER,
+    "*":      NONTRADING,
+}
+_DHAN_HTTP = dict(
+    pool_maxsize=int(env_num("DHAN_HTTP_POOL_MAXSIZE", 32)),
+    get_retries=int(env_num("DHAN_HTTP_GET_RETRIES", 2)),
+    backoff=env_num("DHAN_HTTP_BACKOFF", 0.25),
+    default_timeout=env_timeout("DHAN_TIMEOUT_DEFAULT", (3.05, 15)),
+    timeouts={ep: env_timeout(f"DHAN_TIMEOUT_{ep.upper()}", t) for ep, t in _DHAN_TIMEOUTS.items()},
+    rate_classes=_DHAN_RATE_CLASSES,
+    account_header="access-token",
+)
+_http = get_client("dhan", **_DHAN_HTTP)
+# same settings on httpx for the async read path (get_*_for_client_async)
+_ahttp = get_async_client("dhan", **_DHAN_HTTP)
+
 def _dlog(step: str, msg: str = ""):
     print(f"[DHAN][{step}] {msg}", flush=True)
 
@@ -18,19 +61,7 @@ def _dlog(step: str, msg: str = ""):
 # helpers
 # ---------------------------
 def _read_clients() -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
-    try:
-        for fn in os.listdir(CLIENTS_DIR):
-            if not fn.endswith(".json"):
-                continue
-            try:
-                with open(os.path.join(CLIENTS_DIR, fn), "r", encoding="utf-8") as f:
-                    items.append(json.load(f))
-            except Exception:
-                pass
-    except FileNotFoundError:
-        pass
-    return items
+    return client_registry.clients("dhan")
 
 from datetime import datetime, timedelta
 
@@ -59,7 +90,6 @@ def _is_token_expired(c: dict) -> bool:
 #############################################
 # 🔥 DHAN AUTO LOGIN INTEGRATION
 #############################################
-import time
 import pyotp
 from urllib.parse import urlparse, parse_qs
 from playwright.sync_api import sync_playwright
@@ -99,6 +129,7 @@ def _save_access_token(client: Dict[str, Any], new_token: str):
     try:
         with open(path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2)
+        client_registry.upsert_path(path, data)
 
         safe_tok = f"{new_token[:6]}...{new_token[-4:]}"
         dlog(f"✅ access_token saved: {safe_tok}")
@@ -144,7 +175,7 @@ def _generate_consent(client: Dict[str, Any]) -> str:
     dlog(f"POST {url}")
 
     try:
-        r = requests.post(url, headers=headers, timeout=15)
+        r = _http.post(url, headers=headers, endpoint="auth")
     except Exception as e:
         dlog(f"❌ HTTP request failed: {e}")
         raise
@@ -339,7 +370,7 @@ def _exchange_access_token(client: dict, token_id: str) -> dict:
     print(f"[DHAN][EXCHANGE] POST {url}", flush=True)
     print(f"[DHAN][EXCHANGE] app_id={api_key[:4]}****", flush=True)
 
-    resp = requests.post(url, headers=headers, timeout=15)
+    resp = _http.post(url, headers=headers, endpoint="auth")
 
     print(f"[DHAN][EXCHANGE] HTTP status={resp.status_code}", flush=True)
 
@@ -372,10 +403,10 @@ def _exchange_access_token(client: dict, token_id: str) -> dict:
 
 def _check_token_validity(token: str) -> Dict[str, Any]:
     try:
-        r = requests.get(
+        r = _http.get(
             "https://api.dhan.co/v2/profile",
             headers={"access-token": token},
-            timeout=10
+            endpoint="profile",
         )
         if r.status_code != 200:
             return {"ok": False}
@@ -505,62 +536,128 @@ def login(client: Dict[str, Any]):
 
 
 
-def get_orders() -> Dict[str, List[Dict[str, Any]]]:
+def list_clients() -> List[Dict[str, Any]]:
+    """Client docs served by this adapter (used by the router fan-out)."""
+    return _read_clients()
+
+
+_API = "https://api.dhan.co/v2"
+
+
+def _headers(token: str) -> Dict[str, str]:
+    return {"Content-Type": "application/json", "access-token": token}
+
+
+def _json_list(resp) -> List[Dict[str, Any]]:
+    """Body of a list endpoint. Raises on HTTP failure."""
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+    rows = resp.json()
+    return rows if isinstance(rows, list) else []
+
+
+def _fetch_order_book(token: str) -> List[Dict[str, Any]]:
+    """GET /v2/orders for one access token. Raises on HTTP failure."""
+    return _json_list(_http.get(f"{_API}/orders", headers=_headers(token), endpoint="orders"))
+
+
+async def _fetch_order_book_async(token: str) -> List[Dict[str, Any]]:
+    return _json_list(await _ahttp.get(f"{_API}/orders", headers=_headers(token), endpoint="orders"))
+
+
+def _client_name(c: Dict[str, Any]) -> str:
+    return c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+
+
+def get_orders_for_client(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Order book for one client, bucketed like get_orders(). Raises on fetch failure.
+    Served from the live order-update store when the client's feed is up and
+    seeded; otherwise fetched over REST (which also seeds the store).
+    """
+    if not (c.get("access_token") or "").strip():
+        return {k: [] for k in STAT_KEYS}
+    return _order_buckets(_client_name(c), _raw_orders(c))
+
+
+def _raw_orders(c: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Raw /v2/orders rows: the live store, else REST (which seeds the store)."""
+    token = (c.get("access_token") or "").strip()
+    uid = str(c.get("userid") or c.get("client_id") or "").strip()
+    if not token:
+        return []
+    if uid and order_store.live(uid):
+        return order_store.orders(uid)
+    orders = _fetch_order_book(token)
+    if uid:
+        order_store.apply_rest(uid, orders)
+    return orders
+
+
+def reseed_orders(c: Dict[str, Any]) -> None:
+    """Re-read one client's REST order book into the order-update store (feed reseed)."""
+    token = (c.get("access_token") or "").strip()
+    uid = str(c.get("userid") or c.get("client_id") or "").strip()
+    if token and uid:
+        order_store.apply_rest(uid, _fetch_order_book(token))
+
+
+async def get_orders_for_client_async(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """get_orders_for_client() on the async client."""
+    token = (c.get("access_token") or "").strip()
+    uid = str(c.get("userid") or c.get("client_id") or "").strip()
+    if not token:
+        return {k: [] for k in STAT_KEYS}
+
+    if uid and order_store.live(uid):
+        orders = order_store.orders(uid)
+    else:
+        orders = await _fetch_order_book_async(token)
+        if uid:
+            order_store.apply_rest(uid, orders)
+    return _order_buckets(_client_name(c), orders)
+
+
+def _order_buckets(name: str, orders: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
     buckets: Dict[str, List[Dict[str, Any]]] = {k: [] for k in STAT_KEYS}
+    for o in orders:
+        row = {
+            "name": name,
+            "symbol": o.get("tradingSymbol", ""),
+            "transaction_type": o.get("transactionType", ""),
+            "quantity": o.get("quantity", ""),
+            "price": o.get("price", ""),
+            "status": o.get("orderStatus", ""),
+            "order_id": o.get("orderId", ""),
+        }
 
-    for c in _read_clients():
-        token = (c.get("access_token") or "").strip()
-        if not token:
-            continue
+        s = str(row["status"]).lower()
+        if "pend" in s:
+            buckets["pending"].append(row)
+        elif "trade" in s or s == "executed":
+            buckets["traded"].append(row)
+        elif "reject" in s or "error" in s:
+            buckets["rejected"].append(row)
+        elif "cancel" in s:
+            buckets["cancelled"].append(row)
+        else:
+            buckets["others"].append(row)
 
-        name = (
-            c.get("name")
-            or c.get("display_name")
-            or c.get("userid")
-            or c.get("client_id")
-            or ""
-        )
+    return buckets
 
-        try:
-            resp = requests.get(
-                "https://api.dhan.co/v2/orders",
-                headers={
-                    "Content-Type": "application/json",
-                    "access-token": token,
-                },
-                timeout=10,
-            )
 
-            orders = resp.json() if resp.status_code == 200 else []
-            if not isinstance(orders, list):
-                orders = []
+def get_orders() -> Dict[str, List[Dict[str, Any]]]:
+    buckets: Dict[str, List[Dict[str, Any]]] = {k: [] for k in STAT_KEYS}
 
+    for c in _read_clients():
+        try:
+            part = get_orders_for_client(c)
         except Exception as e:
+            name = c.get("name") or c.get("display_name") or c.get("userid") or ""
             print(f"[DHAN] get_orders error for {name}: {e}", flush=True)
-            orders = []
-
-        for o in orders:
-            row = {
-                "name": name,
-                "symbol": o.get("tradingSymbol", ""),
-                "transaction_type": o.get("transactionType", ""),
-                "quantity": o.get("quantity", ""),
-                "price": o.get("price", ""),
-                "status": o.get("orderStatus", ""),
-                "order_id": o.get("orderId", ""),
-            }
-
-            s = str(row["status"]).lower()
-            if "pend" in s:
-                buckets["pending"].append(row)
-            elif "trade" in s or s == "executed":
-                buckets["traded"].append(row)
-            elif "reject" in s or "error" in s:
-                buckets["rejected"].append(row)
-            elif "cancel" in s:
-                buckets["cancelled"].append(row)
-            else:
-                buckets["others"].append(row)
+            continue
+        for k in STAT_KEYS:
+            buckets[k].extend(part.get(k, []))
 
     return buckets
 
@@ -568,23 +665,21 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
 
 
 # ---------------------------
-# cancel single order (used by router fallback)
+# cancel single order (used by cancel_orders)
 # ---------------------------
-def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, Any]:
+DHAN_CANCEL_CONFIRM_S = env_num("DHAN_CANCEL_CONFIRM_S", 2.0)
+
+
+def cancel_order_dhan(client_json: Dict[str, Any], order_id: str,
+                      confirm_s: Optional[float] = None) -> Dict[str, Any]:
+    """DELETE one order; with a live feed, waits up to confirm_s (default DHAN_CANCEL_CONFIRM_S) for the exchange."""
     # ✅ FIX: use client_json, not cj
     token = (client_json.get("access_token") or "").strip()
     if not token:
         return {"status": "error", "message": "Missing access token", "raw": {}}
 
     try:
-        r = requests.delete(
-            f"https://api.dhan.co/v2/orders/{order_id}",
-            headers={
-                "Content-Type": "application/json",
-                "access-token": token
-            },
-            timeout=15,
-        )
+        r = _http.delete(f"{_API}/orders/{order_id}", headers=_headers(token), endpoint="cancel")
 
         try:
             body = r.json() if r.content else {}
@@ -607,12 +702,24 @@ def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, A
         )
 
         if ok:
-            return {
+            out = {
                 "status": "success",
                 "orderId": body.get("orderId") or order_id,
                 "orderStatus": order_status or "CANCELLED",
                 "raw": body,
             }
+            # live feed: wait briefly for the exchange to confirm instead of trusting the ack
+            uid = str(client_json.get("userid") or client_json.get("client_id") or "").strip()
+            confirm_s = DHAN_CANCEL_CONFIRM_S if confirm_s is None else confirm_s
+            if uid and order_store.live(uid) and confirm_s > 0:
+                final = order_store.wait_status(str(order_id), ("CANCELLED", "TRADED", "REJECTED"), confirm_s)
+                out["confirmed"] = final == "CANCELLED"
+                if final:
+                    out["orderStatus"] = final
+                if final in ("TRADED", "REJECTED"):
+                    out["status"] = "error"
+                    out["message"] = f"order {final.lower()} before cancel"
+            return out
 
         return {
             "status": "error",
@@ -625,249 +732,498 @@ def cancel_order_dhan(client_json: Dict[str, Any], order_id: str) -> Dict[str, A
 
 
 
+def _client_key(name: str) -> str:
+    """Dispatch lane for a display name: the userid when known."""
+    hit = client_registry.by_name(name or "", "dhan")
+    return str(hit[1].get("userid") or hit[1].get("client_id") or name) if hit else (name or "")
+
+
+def _cancel_confirm(acked: List[Tuple[str, str]],
+                    confirm_s: float = DHAN_CANCEL_CONFIRM_S) -> Dict[str, Optional[str]]:
+    """
+    After all cancels are out: final status of each acknowledged (client id,
+    order id) from the order-update feed, sharing one confirm_s deadline.
+    Only clients with a live feed get an entry; None = not confirmed in time.
+    """
+    deadline = time.monotonic() + confirm_s
+    final: Dict[str, Optional[str]] = {}
+    for uid, oid in acked:
+        if confirm_s > 0 and uid and order_store.live(uid):
+            final[oid] = order_store.wait_status(oid, ("CANCELLED", "TRADED", "REJECTED"),
+                                                 max(0.0, deadline - time.monotonic()))
+    return final
+
+
+def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
+    """
+    Cancel Dhan orders through the order dispatcher. The lane jobs only send
+    the DELETEs; the feed confirmations are awaited afterwards, all together.
+    Input:  [{ "name": "<client display name>", "order_id": "<id>" }, ...]
+    Output: list of user-facing status messages.
+    """
+    if not isinstance(orders, list) or not orders:
+        return ["❌ No orders received for cancellation."]
+
+    def cancel_single(order: Dict[str, Any]) -> Any:
+        name = (order or {}).get("name", "")
+        oid  = str((order or {}).get("order_id", "") or "")
+        hit  = client_registry.by_name(name, "dhan")
+        cj   = hit[1] if hit else None
+        if not cj or not oid:
+            return f"❌ Missing client JSON or order_id for {name}"
+        try:
+            resp = cancel_order_dhan(cj, oid, confirm_s=0)
+            if str(resp.get("status", "")).lower() == "success":
+                return str(cj.get("userid") or cj.get("client_id") or "").strip(), oid
+            return f"❌ Failed to cancel Order {oid} for {name}: {resp.get('message')}"
+        except Exception as e:
+            return f"❌ dhan cancel failed for {name}: {e}"
+
+    results = order_dispatcher("dhan").run_all(
+        orders, lambda od: _client_key((od or {}).get("name", "")), cancel_single)
+    final = _cancel_confirm([r for r in results if isinstance(r, tuple)])
+
+    messages = []
+    for od, r in zip(orders, results):
+        name = (od or {}).get("name", "")
+        if not isinstance(r, tuple):
+            messages.append(r or f"❌ dhan cancel failed for {name}")
+            continue
+        oid = r[1]
+        st = final.get(oid, "CANCELLED")           # no live feed: the broker's ack is all we have
+        if st is None:
+            messages.append(f"✅ Cancel sent for Order {oid} for {name} (not yet confirmed by exchange)")
+        elif st == "CANCELLED":
+            messages.append(f"✅ Cancelled Order {oid} for {name}")
+        else:
+            messages.append(f"❌ Failed to cancel Order {oid} for {name}: order {st.lower()} before cancel")
+    return messages
+
+
 # ---------------------------
 # positions / square-off
 # ---------------------------
+def get_positions_for_client(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Positions for one client as {open, closed}. Raises on fetch failure."""
+    token = (c.get("access_token") or "").strip()
+    if not token:
+        return {"open": [], "closed": []}
+    rows = _json_list(_http.get(f"{_API}/positions", headers=_headers(token), endpoint="positions"))
+    return _position_rows(_client_name(c), rows)
+
+
+async def get_positions_for_client_async(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """get_positions_for_client() on the async client."""
+    token = (c.get("access_token") or "").strip()
+    if not token:
+        return {"open": [], "closed": []}
+    rows = _json_list(await _ahttp.get(f"{_API}/positions", headers=_headers(token), endpoint="positions"))
+    return _position_rows(_client_name(c), rows)
+
+
+def _position_rows(name: str, rows: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    positions_data: Dict[str, List[Dict[str, Any]]] = {"open": [], "closed": []}
+    for pos in rows:
+        net_qty   = pos.get("netQty", 0) or 0
+        buy_avg   = pos.get("buyAvg", 0) or 0
+        sell_avg  = pos.get("sellAvg", 0) or 0
+        symbol    = pos.get("tradingSymbol", "") or ""
+        realized  = pos.get("realizedProfit", 0) or 0
+        unreal    = pos.get("unrealizedProfit", 0) or 0
+        if net_qty and pos.get("securityId"):
+            # live MTM from the market-data hub / LTP cache when it has a fresh price
+            key = md_inst(pos.get("exchangeSegment"), pos.get("securityId"))
+            market_data.lease([key])
+            ltp = ltp_service.peek(*key)
+            if ltp:
+                cost = pos.get("costPrice") or (buy_avg if net_qty > 0 else sell_avg)
+                # MCX / currency quantities are in lots: price moves scale by the contract multiplier
+                unreal = (ltp - cost) * net_qty * float(pos.get("multiplier") or 1)
+        net_pnl   = (realized + unreal)
+
+        row = {
+            "name": name,
+            "symbol": symbol,
+            "quantity": net_qty,
+            "buy_avg": round(buy_avg, 2),
+            "sell_avg": round(sell_avg, 2),
+            "net_profit": round(net_pnl, 2),
+        }
+        if net_qty == 0:
+            positions_data["closed"].append(row)
+        else:
+            positions_data["open"].append(row)
+
+    return positions_data
+
+
 def get_positions() -> Dict[str, List[Dict[str, Any]]]:
     positions_data: Dict[str, List[Dict[str, Any]]] = {"open": [], "closed": []}
 
     for c in _read_clients():
-        token = (c.get("access_token") or "").strip()
-        if not token:
-            continue
-        name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
         try:
-            resp = requests.get(
-                "https://api.dhan.co/v2/positions",
-                headers={"Content-Type": "application/json", "access-token": token},
-                timeout=10
-            )
-            rows = resp.json() if resp.status_code == 200 else []
-            if not isinstance(rows, list):
-                rows = []
+            part = get_positions_for_client(c)
         except Exception as e:
+            name = c.get("name") or c.get("display_name") or c.get("userid") or ""
             print(f"[DHAN] get_positions error for {name}: {e}")
-            rows = []
-
-        for pos in rows:
-            net_qty   = pos.get("netQty", 0) or 0
-            buy_avg   = pos.get("buyAvg", 0) or 0
-            sell_avg  = pos.get("sellAvg", 0) or 0
-            symbol    = pos.get("tradingSymbol", "") or ""
-            realized  = pos.get("realizedProfit", 0) or 0
-            unreal    = pos.get("unrealizedProfit", 0) or 0
-            net_pnl   = (realized + unreal)
-
-            row = {
-                "name": name,
-                "symbol": symbol,
-                "quantity": net_qty,
-                "buy_avg": round(buy_avg, 2),
-                "sell_avg": round(sell_avg, 2),
-                "net_profit": round(net_pnl, 2),
-            }
-            if net_qty == 0:
-                positions_data["closed"].append(row)
-            else:
-                positions_data["open"].append(row)
+            continue
+        positions_data["open"].extend(part["open"])
+        positions_data["closed"].extend(part["closed"])
 
     return positions_data
 
 
-def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
-    by_name = {}
-    for c in _read_clients():
-        nm = (c.get("name") or c.get("display_name") or "").strip()
-        if nm:
-            by_name[nm] = c
+def _close_plan(cj: Dict[str, Any], rows: List[Dict[str, Any]], req: Dict[str, Any]):
+    """Opposite MARKET order for req's symbol from the account's position rows (Square_off plan)."""
+    name   = req.get("name") or ""
+    symbol = req.get("symbol") or ""
+    client = (cj.get("userid") or cj.get("client_id") or "").strip()
+    if not (cj.get("access_token") or "").strip() or not client:
+        return None, f"❌ Missing token/client for: {name}"
 
-    messages: List[str] = []
+    prow = [x for x in rows if (x.get("tradingSymbol") or "") == symbol]
+    if not prow:
+        return None, f"❌ Position not found: {name} - {symbol}"
+    return _close_leg(client, next((x for x in prow if int(x.get("netQty", 0) or 0)), prow[0]), name)
 
-    for req in positions or []:
-        name   = (req or {}).get("name") or ""
-        symbol = (req or {}).get("symbol") or ""
-        cj     = by_name.get(name)
-        if not cj:
-            messages.append(f"❌ Client not found for: {name}")
-            continue
 
-        token = (cj.get("access_token") or "").strip()
-        client = (cj.get("userid") or cj.get("client_id") or "").strip()
-        if not token or not client:
-            messages.append(f"❌ Missing token/client for: {name}")
-            continue
+def _close_leg(client: str, pos: Dict[str, Any], name: str):
+    """Closing order for one position row, or (None, message) when it is flat."""
+    symbol  = pos.get("tradingSymbol") or ""
+    net_qty = int(pos.get("netQty", 0) or 0)
+    if net_qty == 0:
+        return None, f"ℹ️ Already flat: {name} - {symbol}"
+
+    qty = abs(net_qty)      # Dhan orders are in units: no lot conversion
 
-        # fetch fresh positions
+    return {
+        "dhanClientId": client,
+        "correlationId": f"SQ{int(time.time())}{client[-4:]}",
+        "transactionType": "SELL" if net_qty > 0 else "BUY",
+        "exchangeSegment": pos.get("exchangeSegment"),
+        "productType": pos.get("productType", "CNC"),
+        "orderType": "MARKET",
+        "validity": "DAY",
+        "securityId": str(pos.get("securityId")),
+        "quantity": int(qty),
+        "disclosedQuantity": 0,
+        "price": 0,
+        "triggerPrice": 0,
+        "afterMarketOrder": False,
+        "amoTime": "OPEN",
+        "boProfitValue": 0,
+        "boStopLossValue": 0,
+        "_name": name,
+        "_symbol": symbol,
+    }, None
+
+
+def _close_send(leg: Dict[str, Any]) -> str:
+    """Place one exit; the order id is kept in leg["_order_id"] for _close_confirm()."""
+    name, symbol = leg["_name"], leg["_symbol"]
+    token = (leg["_client_json"].get("access_token") or "").strip()
+    payload = {k: v for k, v in leg.items() if not k.startswith("_")}
+    try:
+        r = _http.post(f"{_API}/orders", headers=_headers(token), json=payload, endpoint="place")
         try:
-            p = requests.get(
-                "https://api.dhan.co/v2/positions",
-                headers={"Content-Type": "application/json", "access-token": token},
-                timeout=10
-            )
-            prow = []
-            if p.status_code == 200:
-                arr = p.json() if p.content else []
-                if isinstance(arr, list):
-                    for x in arr:
-                        if (x.get("tradingSymbol") or "") == symbol:
-                            prow.append(x)
-            if not prow:
-                messages.append(f"❌ Position not found: {name} - {symbol}")
-                continue
-            pos = prow[0]
-        except Exception as e:
-            messages.append(f"❌ Fetch positions failed for {name}: {e}")
-            continue
+            data = r.json() if r.content else {}
+        except Exception:
+            data = {}
 
-        net_qty = int(pos.get("netQty", 0) or 0)
-        if net_qty == 0:
-            messages.append(f"ℹ️ Already flat: {name} - {symbol}")
+        order_id     = str(data.get("orderId") or "").strip()
+        order_status = str(data.get("orderStatus") or data.get("status") or "").strip().upper()
+        err_msg      = str(data.get("message") or data.get("errorMessage") or "").strip()
+
+        ok_http = r.status_code in (200, 202)
+        ok_body = (bool(order_id) or order_status in {"SUCCESS", "TRANSIT", "PENDING", "SENT", "RECEIVED", "PLACED", "OPEN"})
+        ok = ok_http and ok_body
+
+        if ok:
+            shown = {"orderId": order_id} if order_id else {}
+            if order_status:
+                shown["orderStatus"] = order_status
+            leg["_order_id"], leg["_reply"] = order_id, str(shown or "OK")
+            return f"✅ {name} - close {symbol}: {shown or 'OK'}"
+        else:
+            detail = err_msg or (data if data else f"HTTP {r.status_code}")
+            return f"❌ {name} - close {symbol}: {detail}"
+
+    except Exception as e:
+        return f"❌ {name} - close {symbol}: {e}"
+
+
+def _close_fetch(cj: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return _json_list(_http.get(f"{_API}/positions", headers=_headers((cj.get("access_token") or "").strip()),
+                                endpoint="positions"))
+
+
+def _close_confirm(legs: List[Dict[str, Any]], messages: List[Optional[str]],
+                   confirm_s: float = DHAN_CANCEL_CONFIRM_S) -> List[Optional[str]]:
+    """
+    After all exits are out: wait for the order-update feed to report each one,
+    sharing one confirm_s deadline; a rejected/cancelled exit turns ❌.
+    """
+    deadline = time.monotonic() + confirm_s
+    out: List[Optional[str]] = []
+    for leg, msg in zip(legs, messages):
+        oid, uid = leg.get("_order_id"), str(leg.get("dhanClientId") or "")
+        if not oid or confirm_s <= 0 or not order_store.live(uid):
+            out.append(msg)
             continue
+        st = order_store.wait_status(oid, ("TRADED", "REJECTED", "CANCELLED"),
+                                     max(0.0, deadline - time.monotonic()))
+        out.append(f"{'✅' if st in (None, 'TRADED') else '❌'} {leg['_name']} - close {leg['_symbol']}: "
+                   f"{leg['_reply']} ({st.lower() if st else 'fill not yet confirmed'})")
+    return out
 
-        side  = "SELL" if net_qty > 0 else "BUY"
-        qty   = abs(net_qty)
-
-        payload = {
-            "dhanClientId": client,
-            "correlationId": f"SQ{int(__import__('time').time())}{client[-4:]}",
-            "transactionType": side,
-            "exchangeSegment": pos.get("exchangeSegment"),
-            "productType": pos.get("productType", "CNC"),
-            "orderType": "MARKET",
-            "validity": "DAY",
-            "securityId": str(pos.get("securityId")),
-            "quantity": int(qty),
-            "disclosedQuantity": 0,
-            "price": 0,
-            "triggerPrice": 0,
-            "afterMarketOrder": False,
-            "amoTime": "OPEN",
-            "boProfitValue": 0,
-            "boStopLossValue": 0
-        }
 
-        try:
-            r = requests.post(
-                "https://api.dhan.co/v2/orders",
-                headers={"Content-Type": "application/json", "access-token": token},
-                json=payload,
-                timeout=10
-            )
-            try:
-                data = r.json() if r.content else {}
-            except Exception:
-                data = {}
+# order statuses that can still fill (cancelled by flatten_account)
+_DHAN_OPEN_STATUSES = ("PENDING", "TRANSIT", "PART_TRADED", "OPEN")
 
-            order_id     = str(data.get("orderId") or "").strip()
-            order_status = str(data.get("orderStatus") or data.get("status") or "").strip().upper()
-            err_msg      = str(data.get("message") or data.get("errorMessage") or "").strip()
 
-            ok_http = r.status_code in (200, 202)
-            ok_body = (bool(order_id) or order_status in {"SUCCESS", "TRANSIT", "PENDING", "SENT", "RECEIVED", "PLACED", "OPEN"})
-            ok = ok_http and ok_body
+def flatten_account(cj: Dict[str, Any], symbol: Optional[str] = None,
+                    progress: Optional[Any] = None,
+                    confirm_s: float = DHAN_CANCEL_CONFIRM_S) -> Dict[str, Any]:
+    """
+    Kill switch for one account (Flatten): send every cancel at once, wait up
+    to confirm_s for the feed to confirm them, then send every exit at once
+    and confirm their fills. <symbol> limits both steps to one trading symbol.
+    A failed order-book read counts as a cancel failure and the close stage
+    still runs. progress(stage, message) is called as each step lands.
+    """
+    name  = _client_name(cj)
+    uid   = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    token = (cj.get("access_token") or "").strip()
+    say   = progress or (lambda *_a: None)
+    out   = {"cancelled": 0, "cancel_failed": 0, "closed": 0, "close_failed": 0, "messages": []}
+
+    def _note(stage: str, ok: bool, msg: str) -> None:
+        out[(stage + "led" if stage == "cancel" else stage + "d") if ok else stage + "_failed"] += 1
+        out["messages"].append(msg)
+        say(stage, msg)
+
+    if not token or not uid:
+        _note("close", False, f"❌ Missing token/client for: {name}")
+        return out
+
+    # ---- cancel working orders first so nothing fills behind the exit
+    try:
+        orders = order_store.orders(uid) if order_store.live(uid) else _fetch_order_book(token)
+    except Exception as e:
+        orders = []
+        _note("cancel", False, f"❌ {name} order book unavailable, working orders not cancelled: {e}")
+    working = [o for o in orders
+               if str(o.get("orderStatus") or "").upper() in _DHAN_OPEN_STATUSES
+               and (not symbol or o.get("tradingSymbol") == symbol)]
+    def _cancel(leg: Dict[str, Any]) -> str:
+        r = cancel_order_dhan(cj, leg["order_id"], confirm_s=0)
+        leg["_ok"] = r.get("status") == "success"
+        return (f"{'✅' if leg['_ok'] else '❌'} {name} cancel {leg['order_id']} {leg['_symbol']}: "
+                f"{r.get('orderStatus') if leg['_ok'] else r.get('message')}")
+
+    # all cancels at once (priority calls), then one shared confirm deadline
+    cancels = [{"_name": name, "_symbol": o.get("tradingSymbol", ""), "order_id": str(o.get("orderId") or "")}
+               for o in working]
+    for leg, msg in zip(cancels, square_off.send_burst(cancels, _cancel)):
+        _note("cancel", bool(leg.get("_ok")), msg or f"❌ {name} cancel {leg['order_id']}: send failed")
+    _cancel_confirm([(uid, leg["order_id"]) for leg in cancels if leg.get("_ok")], confirm_s)
+
+    # ---- then square off what is open now: all exits out first, fills confirmed after
+    try:
+        rows = _close_fetch(cj)
+    except Exception as e:
+        _note("close", False, f"❌ {name} positions unavailable: {e}")
+        return out
+    legs = []
+    for pos in rows:
+        if int(pos.get("netQty", 0) or 0) == 0 or (symbol and pos.get("tradingSymbol") != symbol):
+            continue
+        leg, _msg = _close_leg(uid, pos, name)
+        if leg is not None:
+            leg["_client_json"] = cj
+            legs.append(leg)
+    sent = square_off.send_burst(legs, _close_send, lambda ls, ms: _close_confirm(ls, ms, confirm_s))
+    for leg, msg in zip(legs, sent):
+        msg = msg or f"❌ {name} - close {leg['_symbol']}: send failed"
+        _note("close", msg.startswith("✅"), msg)
+    return out
+
+
+def close_positions(positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Square off [{name, symbol}] with opposite MARKET orders via the Square_off
+    planner: one positions fetch per account, then all exits dispatched at once.
+    Returns {"message": [...], "timings": {...}}.
+    """
+    def _resolve(name: str):
+        hit = client_registry.by_name(name, "dhan")
+        return hit[1] if hit else None
 
-            if ok:
-                shown = {"orderId": order_id} if order_id else {}
-                if order_status:
-                    shown["orderStatus"] = order_status
-                messages.append(f"✅ {name} - close {symbol}: {shown or 'OK'}")
-            else:
-                detail = err_msg or (data if data else f"HTTP {r.status_code}")
-                messages.append(f"❌ {name} - close {symbol}: {detail}")
+    return square_off.run(
+        "dhan", positions, _resolve, _close_fetch, _close_plan, _close_send,
+        lambda cj: str(cj.get("userid") or cj.get("client_id") or ""))
 
-        except Exception as e:
-            messages.append(f"❌ {name} - close {symbol}: {e}")
 
-    return messages
+# ---------------------------
+# copy trading (Copy_trading reads master orders through these)
+# ---------------------------
+_COPY_STATUS = {"PENDING": "open", "TRANSIT": "open", "OPEN": "open", "PART_TRADED": "open",
+                "TRADED": "filled", "CANCELLED": "cancelled", "REJECTED": "rejected", "EXPIRED": "rejected"}
+_COPY_PRODUCT = {"INTRADAY": "VALUEPLUS", "CNC": "DELIVERY", "MARGIN": "NORMAL", "MTF": "MTF"}
+_COPY_ORDER_TYPE = {"STOP_LOSS": "STOPLOSS", "STOP_LOSS_MARKET": "SL_MARKET"}
+_COPY_SEGMENT = {"NSE_EQ": "NSE", "BSE_EQ": "BSE", "NSE_FNO": "NSEFO", "BSE_FNO": "BSEFO",
+                 "NSE_CURRENCY": "NSECD", "BSE_CURRENCY": "BSECD", "MCX_COMM": "MCX"}
+
+
+def copy_order(o: Dict[str, Any]) -> Dict[str, Any]:
+    """A /v2/orders row (REST or order-update push) in router order fields."""
+    sid = str(o.get("securityId") or "").strip()
+    inst = instrument_cache.get(sid) if sid else None
+    ot = _norm_order_type(o.get("orderType") or "")
+    return {
+        "order_id": str(o.get("orderId") or ""),
+        "status": _COPY_STATUS.get(str(o.get("orderStatus") or "").upper(), ""),
+        "action": str(o.get("transactionType") or "").upper(),
+        "ordertype": _COPY_ORDER_TYPE.get(ot, ot),
+        "producttype": _COPY_PRODUCT.get(str(o.get("productType") or "").upper(), o.get("productType") or ""),
+        "orderduration": str(o.get("validity") or "DAY").upper(),
+        "exchange": (inst.exchange if inst else "") or _COPY_SEGMENT.get(o.get("exchangeSegment") or "", "")
+                    or str(o.get("exchange") or "NSE").upper(),
+        "security_id": sid,
+        "symbol": o.get("tradingSymbol") or "",
+        "qty": int(float(o.get("quantity") or 0)),
+        "price": float(o.get("price") or 0),
+        "triggerprice": float(o.get("triggerPrice") or 0),
+    }
+
+
+def copy_master_orders(cj: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Master's order book as copy_order() rows (poll fallback). Raises on fetch failure or no token."""
+    if not (cj.get("access_token") or "").strip():
+        raise RuntimeError(f"no access token for {_client_name(cj)}")
+    return [copy_order(o) for o in _raw_orders(cj) if isinstance(o, dict)]
 
 
 # ---------------------------
 # holdings + funds
 # ---------------------------
-def get_holdings() -> Dict[str, Any]:
+def _funds_from(resp, name: str) -> Dict[str, Any]:
+    """fundlimit body, or {} (funds are best-effort)."""
+    if isinstance(resp, Exception):
+        print(f"[DHAN] fundlimit error for {name}: {resp}", flush=True)
+        return {}
+    try:
+        if resp.status_code == 200 and resp.content:
+            return resp.json() or {}
+    except Exception as e:
+        print(f"[DHAN] fundlimit error for {name}: {e}", flush=True)
+    return {}
+
+
+def get_holdings_for_client(c: Dict[str, Any]) -> Dict[str, Any]:
+    """Holdings + one summary row for one client. Raises if the holdings fetch fails."""
+    name = _client_name(c)
+    access_tok = (c.get("access_token") or "").strip()
+    if not access_tok:
+        return {"holdings": [], "summary": []}
+
+    rows = _json_list(_http.get(f"{_API}/holdings", headers=_headers(access_tok), endpoint="holdings"))
+    try:
+        f = _http.get(f"{_API}/fundlimit", headers=_headers(access_tok), endpoint="fundlimit")
+    except Exception as e:
+        f = e
+    return _holdings_summary(c, name, rows, _funds_from(f, name))
+
+
+async def get_holdings_for_client_async(c: Dict[str, Any]) -> Dict[str, Any]:
+    """get_holdings_for_client() on the async client; holdings and funds are fetched together."""
+    name = _client_name(c)
+    access_tok = (c.get("access_token") or "").strip()
+    if not access_tok:
+        return {"holdings": [], "summary": []}
+
+    h, f = await asyncio.gather(
+        _ahttp.get(f"{_API}/holdings", headers=_headers(access_tok), endpoint="holdings"),
+        _ahttp.get(f"{_API}/fundlimit", headers=_headers(access_tok), endpoint="fundlimit"),
+        return_exceptions=True,
+    )
+    if isinstance(h, Exception):
+        raise h
+    return _holdings_summary(c, name, _json_list(h), _funds_from(f, name))
+
+
+def _holdings_summary(c: Dict[str, Any], name: str, rows: List[Dict[str, Any]],
+                      funds: Dict[str, Any]) -> Dict[str, Any]:
     holdings_rows: List[Dict[str, Any]] = []
     summaries: List[Dict[str, Any]] = []
+    try:
+        capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
+    except Exception:
+        capital = 0.0
 
-    for c in _read_clients():
-        name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
-        access_tok = (c.get("access_token") or "").strip()
-
-        if not access_tok:
-            continue
+    invested = 0.0
+    total_pnl = 0.0
 
+    for h in rows:
         try:
-            capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
+            qty = float(h.get("availableQty", h.get("totalQty", 0)) or 0)
+            buyavg = float(h.get("avgCostPrice", 0) or 0)
+            ltp = float(h.get("lastTradedPrice", h.get("ltp", 0)) or 0)
         except Exception:
-            capital = 0.0
+            continue
+        # holdings LTP can lag; prefer a fresh shared-cache price (NSE token == securityId),
+        # only for NSE holdings: a BSE securityId is a different instrument on NSE
+        if h.get("securityId") and str(h.get("exchange") or "").upper() == "NSE":
+            market_data.lease([md_inst("NSE", h.get("securityId"))])
+            ltp = ltp_service.peek("NSE", h.get("securityId")) or ltp
 
-        # ---------------- holdings ----------------
-        try:
-            resp = requests.get(
-                "https://api.dhan.co/v2/holdings",
-                headers={"Content-Type": "application/json", "access-token": access_tok},
-                timeout=10
-            )
-            rows = resp.json() if resp.status_code == 200 else []
-            if not isinstance(rows, list):
-                rows = []
-        except Exception as e:
-            print(f"[DHAN] get_holdings error for {name}: {e}", flush=True)
-            rows = []
+        if qty <= 0:
+            continue
 
-        invested = 0.0
-        total_pnl = 0.0
+        pnl = round((ltp - buyavg) * qty, 2)
+        invested += qty * buyavg
+        total_pnl += pnl
 
-        for h in rows:
-            try:
-                qty = float(h.get("availableQty", h.get("totalQty", 0)) or 0)
-                buyavg = float(h.get("avgCostPrice", 0) or 0)
-                ltp = float(h.get("lastTradedPrice", h.get("ltp", 0)) or 0)
-            except Exception:
-                continue
+        holdings_rows.append({
+            "name": name,
+            "symbol": h.get("tradingSymbol", ""),
+            "quantity": qty,
+            "buy_avg": round(buyavg, 2),
+            "ltp": round(ltp, 2),
+            "pnl": pnl,
+        })
 
-            if qty <= 0:
-                continue
+    current_value = invested + total_pnl
 
-            pnl = round((ltp - buyavg) * qty, 2)
-            invested += qty * buyavg
-            total_pnl += pnl
+    available_balance = float(funds.get("availableBalance", funds.get("availabelBalance", 0)) or 0)
+    net_gain = round((current_value + available_balance) - capital, 2)
 
-            holdings_rows.append({
-                "name": name,
-                "symbol": h.get("tradingSymbol", ""),
-                "quantity": qty,
-                "buy_avg": round(buyavg, 2),
-                "ltp": round(ltp, 2),
-                "pnl": pnl,
-            })
+    summaries.append({
+        "name": name,
+        "capital": round(capital, 2),
+        "invested": round(invested, 2),
+        "pnl": round(total_pnl, 2),
+        "current_value": round(current_value, 2),
+        "available_margin": round(available_balance, 2),
+        "net_gain": net_gain,
+    })
 
-        current_value = invested + total_pnl
+    return {"holdings": holdings_rows, "summary": summaries}
 
-        # ---------------- funds ----------------
-        funds = {}
-        try:
-            f = requests.get(
-                "https://api.dhan.co/v2/fundlimit",
-                headers={"Content-Type": "application/json", "access-token": access_tok},
-                timeout=10
-            )
-            if f.status_code == 200 and f.content:
-                funds = f.json() or {}
-        except Exception as e:
-            print(f"[DHAN] fundlimit error for {name}: {e}", flush=True)
 
-        available_balance = float(funds.get("availableBalance", funds.get("availabelBalance", 0)) or 0)
-        net_gain = round((current_value + available_balance) - capital, 2)
+def get_holdings() -> Dict[str, Any]:
+    holdings_rows: List[Dict[str, Any]] = []
+    summaries: List[Dict[str, Any]] = []
 
-        summaries.append({
-            "name": name,
-            "capital": round(capital, 2),
-            "invested": round(invested, 2),
-            "pnl": round(total_pnl, 2),
-            "current_value": round(current_value, 2),
-            "available_margin": round(available_balance, 2),
-            "net_gain": net_gain,
-        })
+    for c in _read_clients():
+        try:
+            part = get_holdings_for_client(c)
+        except Exception as e:
+            name = c.get("name") or c.get("display_name") or c.get("userid") or ""
+            print(f"[DHAN] get_holdings error for {name}: {e}", flush=True)
+            continue
+        holdings_rows.extend(part["holdings"])
+        summaries.extend(part["summary"])
 
     return {"holdings": holdings_rows, "summary": summaries}
 
@@ -883,13 +1239,6 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     if not isinstance(orders, list) or not orders:
         return {"status": "empty", "order_responses": {}}
 
-    # Build dhan userid -> client json map
-    by_id: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        uid = str(c.get("userid") or c.get("client_id") or "").strip()
-        if uid:
-            by_id[uid] = c
-
     EXCHANGE_MAP = {
         "NSE": "NSE_EQ",
         "BSE": "BSE_EQ",
@@ -915,7 +1264,6 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
 
     responses: Dict[str, Any] = {}
     lock = threading.Lock()
-    threads: List[threading.Thread] = []
 
     def _worker(od: Dict[str, Any]) -> None:
         uid = str(od.get("client_id") or "").strip()
@@ -923,7 +1271,7 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
         key = f"{tag}:{uid}" if tag else uid
         name = od.get("name") or uid
 
-        cj = by_id.get(uid)
+        cj = client_registry.get("dhan", uid)
         if not cj:
             with lock:
                 responses[key] = {"status": "ERROR", "message": "Client JSON not found"}
@@ -995,14 +1343,14 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
             pass
 
         try:
-            r = requests.post(
-                "https://api.dhan.co/v2/orders",
+            r = _http.post(
+                f"{_API}/orders",
                 headers={
                     "Content-Type": "application/json",
                     "access-token": token
                 },
                 json=data,
-                timeout=15,
+                endpoint="place",
             )
             resp = r.json()
         except Exception as e:
@@ -1011,18 +1359,12 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
         with lock:
             responses[key] = resp
 
-    for item in orders:
-        t = threading.Thread(target=_worker, args=(item,))
-        t.start()
-        threads.append(t)
-
-    for t in threads:
-        t.join()
+    # one lane per account: legs for a client go out in the order given
+    order_dispatcher("dhan").run_all(orders, lambda od: str(od.get("client_id") or "").strip(), _worker)
 
     return {"status": "completed", "order_responses": responses}
 
 from typing import Dict, Any, List
-import requests
 import json
 
 def _build_dhan_modify_payload(row: Dict[str, Any]) -> Dict[str, Any]:
@@ -1128,11 +1470,11 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
       price?, triggerPrice?, quantity?, validity?, disclosedQuantity? (ignored -> always 0),
       _client_json { userid, apikey|access_token }
 
+    Rows run through the order dispatcher (one lane per account).
+
     Returns: {"message": [ "...", ... ]}
     """
-    messages: List[str] = []
-
-    for row in (orders or []):
+    def _modify_one(row: Dict[str, Any]) -> str:
         try:
             name     = (row.get("name") or "").strip() or "<unknown>"
             order_id = str(row.get("order_id") or row.get("orderId") or "").strip()
@@ -1141,26 +1483,22 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
             dhan_id  = str(cj.get("userid") or cj.get("client_id") or "").strip()
 
             if not order_id or not token or not dhan_id:
-                messages.append(f"❌ {name}: missing order_id/client/token")
-                continue
+                return f"❌ {name}: missing order_id/client/token"
 
             payload = _build_dhan_modify_payload(row)
 
             # Basic validations for explicit types
             ot = payload.get("orderType")
             if ot == "LIMIT" and "price" not in payload:
-                messages.append(f"❌ {name} ({order_id}): LIMIT requires Price > 0")
-                continue
+                return f"❌ {name} ({order_id}): LIMIT requires Price > 0"
             if ot == "STOP_LOSS" and not {"price", "triggerPrice"} <= payload.keys():
-                messages.append(f"❌ {name} ({order_id}): STOP_LOSS requires Price & Trigger > 0")
-                continue
+                return f"❌ {name} ({order_id}): STOP_LOSS requires Price & Trigger > 0"
             if ot == "STOP_LOSS_MARKET" and "triggerPrice" not in payload:
-                messages.append(f"❌ {name} ({order_id}): SL-MARKET requires Trigger > 0")
-                continue
+                return f"❌ {name} ({order_id}): SL-MARKET requires Trigger > 0"
             if payload.get("quantity", 1) <= 0:
                 payload.pop("quantity", None)  # don't send zero/negative qty
 
-            url = f"https://api.dhan.co/v2/orders/{order_id}"
+            url = f"{_API}/orders/{order_id}"
             headers = {"Content-Type": "application/json", "access-token": token}
 
             # --- DEBUG OUT ---
@@ -1175,7 +1513,7 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
             except Exception:
                 pass
 
-            r = requests.put(url, headers=headers, json=payload, timeout=20)
+            r = _http.put(url, headers=headers, json=payload, endpoint="modify")
             try:
                 body = r.json() if r.content else {}
             except Exception:
@@ -1191,16 +1529,24 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
             # Success heuristic: 2xx and no errorType
             ok = (200 <= r.status_code < 300) and not (isinstance(body, dict) and body.get("errorType"))
             if ok:
-                messages.append(f"✅ {name} ({order_id}): Modified")
+                return f"✅ {name} ({order_id}): Modified"
             else:
                 err = ""
                 if isinstance(body, dict):
                     err = body.get("errorMessage") or body.get("message") or body.get("status") or ""
-                messages.append(f"❌ {name} ({order_id}): {err or ('HTTP ' + str(r.status_code))}")
+                return f"❌ {name} ({order_id}): {err or ('HTTP ' + str(r.status_code))}"
 
         except Exception as e:
-            messages.append(f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}")
+            return f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}"
+
+    def _lane(row: Dict[str, Any]) -> str:
+        cj = row.get("_client_json") or {}
+        return str(cj.get("userid") or cj.get("client_id") or row.get("name") or "")
 
+    rows = orders or []
+    results = order_dispatcher("dhan").run_all(rows, _lane, _modify_one)
+    messages: List[str] = [m or f"❌ {r.get('name','<unknown>')} ({r.get('order_id','?')}): modify failed"
+                           for r, m in zip(rows, results)]
     return {"message": messages}
 
 
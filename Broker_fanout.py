@@ -0,0 +1,214 @@
+# Broker_fanout.py
+"""
+Shared fan-out executor for per-(broker, client) reads.
+
+Each broker gets its own bounded worker pool (its concurrency limit), and every
+fan_out() call carries a deadline: whatever has not finished by then is
+reported as a timeout and the caller gets the partial results collected so far.
+
+fan_out_async() is the same for async routes: coroutine tasks run on the event
+loop under a per-broker semaphore (same limit), blocking ones (SDK calls) on
+the broker's pool via run_blocking(), never on the server's shared threadpool.
+Slow tasks keep running past the deadline so their snapshot still lands.
+run_sync() lets threads (stream refreshers) call into the server loop.
+"""
+import asyncio, functools, os, time, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# per-call deadline (seconds) — keep it below the UI polling interval (3 s)
+FANOUT_DEADLINE_S = float(os.getenv("FANOUT_DEADLINE_S", "2.5"))
+
+# max in-flight calls per broker
+BROKER_CONCURRENCY: Dict[str, int] = {
+    "dhan":    int(os.getenv("FANOUT_DHAN_CONCURRENCY", "16")),
+    "motilal": int(os.getenv("FANOUT_MOTILAL_CONCURRENCY", "8")),
+}
+
+_pools: Dict[str, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+_sems: Dict[Tuple[int, str], asyncio.Semaphore] = {}      # (id(loop), broker) -> limit
+_background: Set[asyncio.Task] = set()                   # tasks left running past a deadline
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# (broker, client_json, fn) — fn is called as fn(client_json)
+Task = Tuple[str, Dict[str, Any], Callable[[Dict[str, Any]], Any]]
+
+
+def _pool_for(broker: str) -> ThreadPoolExecutor:
+    with _pools_lock:
+        pool = _pools.get(broker)
+        if pool is None:
+            workers = max(1, int(BROKER_CONCURRENCY.get(broker, 4)))
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"fanout-{broker}")
+            _pools[broker] = pool
+        return pool
+
+
+def _sem_for(broker: str) -> asyncio.Semaphore:
+    key = (id(asyncio.get_running_loop()), broker)
+    sem = _sems.get(key)
+    if sem is None:
+        sem = _sems[key] = asyncio.Semaphore(max(1, int(BROKER_CONCURRENCY.get(broker, 4))))
+    return sem
+
+
+async def run_blocking(broker: str, fn: Callable[..., Any], *args: Any) -> Any:
+    """Await a blocking call on <broker>'s bounded pool."""
+    return await asyncio.get_running_loop().run_in_executor(_pool_for(broker), functools.partial(fn, *args))
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Remember the server's event loop (from startup) for run_sync()."""
+    global _loop
+    _loop = loop
+
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Run <coro> to completion from a plain thread: on the bound server loop, else a private one."""
+    loop = _loop
+    if loop is not None and loop.is_running():
+        return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
+    return asyncio.run(coro)
+
+
+def client_id_of(c: Dict[str, Any]) -> str:
+    return str((c or {}).get("userid") or (c or {}).get("client_id") or "").strip()
+
+
+def client_name_of(c: Dict[str, Any]) -> str:
+    c = c or {}
+    return c.get("name") or c.get("display_name") or client_id_of(c)
+
+
+def fan_out(tasks: List[Task], deadline_s: Optional[float] = None
+            ) -> Tuple[List[Tuple[str, Dict[str, Any], Any]], Dict[str, Any]]:
+    """
+    Run every (broker, client) task in parallel on its broker's pool.
+
+    Returns (results, meta):
+      results: [(broker, client_json, value)] for tasks that finished OK
+      meta:    { deadline_ms, elapsed_ms, partial, clients: [
+                   {broker, client_id, name, status: ok|error|timeout, latency_ms, error} ] }
+    """
+    deadline = FANOUT_DEADLINE_S if deadline_s is None else max(0.05, float(deadline_s))
+    t0 = time.perf_counter()
+
+    timings: Dict[int, Tuple[float, float]] = {}
+
+    def _timed(i: int, fn: Callable[[Dict[str, Any]], Any], c: Dict[str, Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return fn(c)
+        finally:
+            timings[i] = (start, time.perf_counter())
+
+    futures = []
+    for i, (brk, c, fn) in enumerate(tasks):
+        futures.append(_pool_for(brk).submit(_timed, i, fn, c))
+
+    done, not_done = wait(futures, timeout=deadline)
+    elapsed = time.perf_counter() - t0
+
+    results: List[Tuple[str, Dict[str, Any], Any]] = []
+    clients: List[Dict[str, Any]] = []
+    for i, (fut, (brk, c, _fn)) in enumerate(zip(futures, tasks)):
+        row = {
+            "broker": brk,
+            "client_id": client_id_of(c),
+            "name": client_name_of(c),
+            "status": "ok",
+            "latency_ms": None,
+            "error": None,
+        }
+        if fut in not_done:
+            fut.cancel()  # only drops it if it never started
+            row["status"] = "timeout"
+            row["latency_ms"] = round(elapsed * 1000, 1)
+            row["error"] = f"no response within {int(deadline * 1000)} ms"
+        else:
+            start, end = timings.get(i, (t0, t0 + elapsed))
+            row["latency_ms"] = round((end - start) * 1000, 1)
+            err = fut.exception()
+            if err is not None:
+                row["status"] = "error"
+                row["error"] = str(err) or err.__class__.__name__
+            else:
+                results.append((brk, c, fut.result()))
+        clients.append(row)
+
+    meta = {
+        "deadline_ms": int(deadline * 1000),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "partial": any(r["status"] != "ok" for r in clients),
+        "clients": clients,
+    }
+    return results, meta
+
+
+async def fan_out_async(tasks: List[Task], deadline_s: Optional[float] = None
+                        ) -> Tuple[List[Tuple[str, Dict[str, Any], Any]], Dict[str, Any]]:
+    """
+    fan_out() for the event loop. fn may be a coroutine function (awaited under
+    the broker's semaphore) or a plain one (run on the broker's pool).
+    Same (results, meta) shape.
+    """
+    deadline = FANOUT_DEADLINE_S if deadline_s is None else max(0.05, float(deadline_s))
+    t0 = time.perf_counter()
+
+    timings: Dict[int, Tuple[float, float]] = {}
+
+    async def _timed(i: int, brk: str, fn: Callable[[Dict[str, Any]], Any], c: Dict[str, Any]) -> Any:
+        if asyncio.iscoroutinefunction(fn):
+            async with _sem_for(brk):
+                start = time.perf_counter()
+                try:
+                    return await fn(c)
+                finally:
+                    timings[i] = (start, time.perf_counter())
+        start = time.perf_counter()
+        try:
+            return await run_blocking(brk, fn, c)
+        finally:
+            timings[i] = (start, time.perf_counter())
+
+    futures = [asyncio.ensure_future(_timed(i, brk, fn, c)) for i, (brk, c, fn) in enumerate(tasks)]
+    done, not_done = (await asyncio.wait(futures, timeout=deadline)) if futures else (set(), set())
+    elapsed = time.perf_counter() - t0
+
+    results: List[Tuple[str, Dict[str, Any], Any]] = []
+    clients: List[Dict[str, Any]] = []
+    for i, (fut, (brk, c, _fn)) in enumerate(zip(futures, tasks)):
+        row = {
+            "broker": brk,
+            "client_id": client_id_of(c),
+            "name": client_name_of(c),
+            "status": "ok",
+            "latency_ms": None,
+            "error": None,
+        }
+        if fut in not_done:
+            _background.add(fut)                  # let it finish (and fill the snapshot cache)
+            fut.add_done_callback(_background.discard)
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())   # no "never retrieved" noise
+            row["status"] = "timeout"
+            row["latency_ms"] = round(elapsed * 1000, 1)
+            row["error"] = f"no response within {int(deadline * 1000)} ms"
+        else:
+            start, end = timings.get(i, (t0, t0 + elapsed))
+            row["latency_ms"] = round((end - start) * 1000, 1)
+            err = fut.exception()
+            if err is not None:
+                row["status"] = "error"
+                row["error"] = str(err) or err.__class__.__name__
+            else:
+                results.append((brk, c, fut.result()))
+        clients.append(row)
+
+    meta = {
+        "deadline_ms": int(deadline * 1000),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "partial": any(r["status"] != "ok" for r in clients),
+        "clients": clients,
+    }
+    return results, meta
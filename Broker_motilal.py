@@ -1,7 +1,7 @@
 import os, json, logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from collections import OrderedDict
-import threading
+import time
 from datetime import datetime, timedelta, timezone
 IST = timezone(timedelta(hours=5, minutes=30))
 
@@ -14,7 +14,15 @@ try:
 except Exception:
     pyotp = None
 
-from MOFSLOPENAPI import MOFSLOPENAPI  # requires your SDK
+from MOFSLOPENAPI import MOFSLOPENAPI, WarmDeviceIdentity  # requires your SDK
+from Broker_fanout import run_blocking
+import Square_off as square_off
+from Client_registry import client_registry
+from Instrument_cache import instrument_cache
+from Order_dispatch import order_dispatcher
+from Motilal_order_feed import order_store, trade_feed
+from Ltp_service import ltp_service, ltp_key
+from Market_data import market_data, inst as md_inst
 
 BASE_URL        = os.getenv("MO_BASE_URL", "https://openapi.motilaloswal.com")
 SOURCE_ID       = os.getenv("MO_SOURCE_ID", "Desktop")
@@ -24,6 +32,12 @@ BROWSER_VERSION = os.getenv("MO_BROWSER_VER", "104")
 STAT_KEYS = ["pending","traded","rejected","cancelled","others"]
 _sessions: Dict[str, MOFSLOPENAPI] = {}
 
+# how long cancel / square-off wait for the TradeStatus feed to confirm
+MO_CONFIRM_S = float(os.getenv("MO_CONFIRM_S", "2"))
+
+# device identity (public IP etc.) is probed once per process, off the login path
+WarmDeviceIdentity()
+
 DATA_DIR    = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
 CLIENTS_DIR = os.path.join(DATA_DIR, "clients", "motilal")
 _MO_DIR     = CLIENTS_DIR
@@ -33,19 +47,17 @@ SQLITE_DB = os.path.join(DATA_DIR, "symbols.db")
 
 
 def _read_clients() -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
-    try:
-        for fn in os.listdir(CLIENTS_DIR):
-            if not fn.endswith('.json'):
-                continue
-            try:
-                with open(os.path.join(CLIENTS_DIR, fn), 'r', encoding='utf-8') as f:
-                    items.append(json.load(f))
-            except Exception:
-                pass
-    except FileNotFoundError:
-        pass
-    return items
+    return client_registry.clients("motilal")
+
+
+def _client_by_name(name: str) -> Dict[str, Any] | None:
+    hit = client_registry.by_name(name, "motilal")
+    return hit[1] if hit else None
+
+def _client_key(name: str) -> str:
+    """Dispatch lane for a display name: the userid when known."""
+    cj = _client_by_name(name or "")
+    return str(cj.get("userid") or cj.get("client_id") or name) if cj else (name or "")
 
 def _pick(*vals):
     for v in vals:
@@ -73,12 +85,19 @@ def login(client: Dict[str, Any]) -> bool:
         resp = sdk.login(userid, password, pan, otp, userid)
         if resp and resp.get("status") == "SUCCESS":
             _sessions[userid] = sdk
+            trade_feed.attach(userid, sdk)
             return True
         logging.error("[MO] login failed for %s: %s", userid, (resp or {}).get("message"))
     except Exception as e:
         logging.exception("[MO] login error for %s: %s", userid, e)
     return False
 
+def logout(userid: str) -> None:
+    """Forget a client's session (client removed/renamed) and close its TradeStatus feed."""
+    userid = str(userid or "").strip()
+    _sessions.pop(userid, None)
+    trade_feed.detach(userid)
+
 def _ensure_session(c: Dict[str, Any]) -> MOFSLOPENAPI | None:
     uid = (c.get('userid') or c.get('client_id') or '').strip()
     if not uid:
@@ -89,6 +108,111 @@ def _ensure_session(c: Dict[str, Any]) -> MOFSLOPENAPI | None:
     if login(c):
         return _sessions.get(uid)
     return None
+def _min_qty(token: str, tag: str) -> int:
+    """Lot size for a symboltoken from the shared instrument cache; 1 if unknown."""
+    try:
+        return instrument_cache.lot_size(token)
+    except Exception as e:
+        print(f"[MO][{tag}] min-qty lookup error: {e}", flush=True)
+        return 1
+
+MD_MOTILAL_USERID = os.getenv("MD_MOTILAL_USERID", "").strip()
+
+def market_data_session():
+    """
+    (userid, sdk) for the market-data hub: MD_MOTILAL_USERID if set, else any
+    client already logged in, else one login attempt for the first client.
+    """
+    clients = _read_clients()
+    if MD_MOTILAL_USERID:
+        clients = [c for c in clients if str(c.get("userid") or c.get("client_id") or "").strip() == MD_MOTILAL_USERID]
+    for c in clients:
+        uid = str(c.get("userid") or c.get("client_id") or "").strip()
+        if uid in _sessions:
+            return uid, _sessions[uid]
+    for c in clients[:1]:
+        sdk = _ensure_session(c)
+        if sdk:
+            return str(c.get("userid") or c.get("client_id") or "").strip(), sdk
+    return None
+
+def fetch_ltp(exchange: str, code: str) -> float | None:
+    """REST GetLtp on the market-data session (paise -> rupees); None if unavailable."""
+    got = market_data_session()
+    if not got:
+        return None
+    uid, sdk = got
+    r = sdk.GetLtp({"clientcode": uid, "exchange": exchange, "scripcode": int(code)})
+    if isinstance(r, dict) and r.get("status") == "SUCCESS":
+        return float((r.get("data") or {}).get("ltp", 0) or 0) / 100.0 or None
+    return None
+
+def list_clients() -> List[Dict[str, Any]]:
+    """Client docs served by this adapter (used by the router fan-out)."""
+    return _read_clients()
+
+
+def _order_book(sdk, userid: str, name: str, strict: bool = False) -> List[Dict[str, Any]]:
+    """
+    Raw order rows: the TradeStatus store when live, else GetOrderBook (which
+    reconciles the store). strict=True raises when GetOrderBook fails instead
+    of returning [] (an empty book is not an error).
+    """
+    if order_store.live(userid):
+        return order_store.orders(userid)
+
+    today_date = datetime.now().strftime("%d-%b-%Y 09:00:00")
+    resp = sdk.GetOrderBook({"clientcode": userid, "datetimestamp": today_date})
+
+    if not isinstance(resp, dict) or resp.get("status") != "SUCCESS":
+        msg = resp.get("message", "No message") if isinstance(resp, dict) else str(resp)
+        logging.error("❌ Error fetching orders for %s: %s", name, msg)
+        if strict and "no data" not in str(msg).lower():
+            raise RuntimeError(f"GetOrderBook failed for {name}: {msg}")
+
+    orders = resp.get("data", []) if isinstance(resp, dict) else []
+    if not isinstance(orders, list):
+        orders = []
+    if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+        order_store.apply_rest(userid, orders)
+    return orders
+
+
+def get_orders_for_client(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Order book for one client, bucketed like get_orders(). Raises if no session."""
+    orders_data: Dict[str, List[Dict[str, Any]]] = {k: [] for k in STAT_KEYS}
+
+    name   = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+    userid = str(c.get("userid") or c.get("client_id") or "").strip()
+    sdk    = _ensure_session(c)
+    if not sdk or not userid:
+        raise RuntimeError(f"no session/userid for {name}")
+
+    for order in _order_book(sdk, userid, name):
+        row = {
+            "name": name,
+            "symbol": order.get("symbol", ""),
+            "transaction_type": order.get("buyorsell", ""),
+            "quantity": order.get("orderqty", ""),
+            "price": order.get("price", ""),
+            "status": order.get("orderstatus", ""),
+            "order_id": order.get("uniqueorderid", "")
+        }
+        s = (row["status"] or "").lower()
+        if "confirm" in s:
+            orders_data["pending"].append(row)
+        elif "traded" in s:
+            orders_data["traded"].append(row)
+        elif "rejected" in s or "error" in s:
+            orders_data["rejected"].append(row)
+        elif "cancel" in s:
+            orders_data["cancelled"].append(row)
+        else:
+            orders_data["others"].append(row)
+
+    return orders_data
+
+
 def get_orders() -> Dict[str, List[Dict[str, Any]]]:
     """
     Fetch Motilal orders for all logged-in clients and bucketize:
@@ -103,116 +227,144 @@ def get_orders() -> Dict[str, List[Dict[str, Any]]]:
     }
 
     for c in _read_clients():
-        name   = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
-        userid = str(c.get("userid") or c.get("client_id") or "").strip()
-        sdk    = _ensure_session(c)
-        if not sdk or not userid:
-            logging.error("[MO] get_orders: no session/userid for %s", name)
-            continue
-
         try:
-            today_date = datetime.now().strftime("%d-%b-%Y 09:00:00")
-            resp = sdk.GetOrderBook({"clientcode": userid, "datetimestamp": today_date})
-
-            if resp and resp.get("status") != "SUCCESS":
-                logging.error("❌ Error fetching orders for %s: %s",
-                              name, resp.get("message", "No message"))
-
-            orders = resp.get("data", []) if isinstance(resp, dict) else []
-            if not isinstance(orders, list):
-                orders = []
-
-            for order in orders:
-                row = {
-                    "name": name,
-                    "symbol": order.get("symbol", ""),
-                    "transaction_type": order.get("buyorsell", ""),
-                    "quantity": order.get("orderqty", ""),
-                    "price": order.get("price", ""),
-                    "status": order.get("orderstatus", ""),
-                    "order_id": order.get("uniqueorderid", "")
-                }
-                s = (row["status"] or "").lower()
-                if "confirm" in s:
-                    orders_data["pending"].append(row)
-                elif "traded" in s:
-                    orders_data["traded"].append(row)
-                elif "rejected" in s or "error" in s:
-                    orders_data["rejected"].append(row)
-                elif "cancel" in s:
-                    orders_data["cancelled"].append(row)
-                else:
-                    orders_data["others"].append(row)
-
+            part = get_orders_for_client(c)
         except Exception as e:
-            print(f"❌ Error fetching orders for {name}: {e}")
+            name = c.get("name") or c.get("display_name") or c.get("userid") or ""
+            logging.error("[MO] get_orders: %s (%s)", e, name)
+            continue
+        for k in STAT_KEYS:
+            orders_data[k].extend(part.get(k, []))
 
     return orders_data
 
+def _cancel_confirm(acked: List[Tuple[str, str]], confirm_s: float = MO_CONFIRM_S) -> Dict[str, Optional[str]]:
+    """
+    After all cancels are out: final status of each acknowledged (userid,
+    order id) from TradeStatus, sharing one confirm_s deadline. Only clients
+    with a live feed get an entry; None = not confirmed in time.
+    """
+    deadline = time.monotonic() + confirm_s
+    final: Dict[str, Optional[str]] = {}
+    for uid, oid in acked:
+        if confirm_s > 0 and uid and order_store.live(uid):
+            final[oid] = order_store.wait_for(oid, lambda s: any(w in s for w in ("cancel", "traded", "reject")),
+                                              max(0.0, deadline - time.monotonic()))
+    return final
+
+
 def cancel_orders(orders: List[Dict[str, Any]]) -> List[str]:
     """
-    Cancel Motilal orders in parallel.
+    Cancel Motilal orders through the order dispatcher. The lane jobs only
+    send CancelOrder; TradeStatus confirmations are awaited afterwards, together.
     Input:  [{ "name": "<client display name>", "order_id": "<id>" }, ...]
     Output: list of user-facing status messages.
     """
     if not isinstance(orders, list) or not orders:
         return ["❌ No orders received for cancellation."]
 
-    messages: List[str] = []
-    lock = threading.Lock()
-
-    # map client display name -> client json
-    by_name: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        nm = (c.get("name") or c.get("display_name") or "").strip()
-        if nm:
-            by_name[nm] = c
-
-    def cancel_single(order: Dict[str, Any]) -> None:
+    def cancel_single(order: Dict[str, Any]) -> Any:
         name     = (order or {}).get("name")
-        order_id = (order or {}).get("order_id")
+        order_id = str((order or {}).get("order_id") or "")
         if not name or not order_id:
-            with lock:
-                messages.append(f"❌ Missing data in order: {order}")
-            return
+            return f"❌ Missing data in order: {order}"
 
-        cj = by_name.get(name)
+        cj = _client_by_name(name)
         if not cj:
-            with lock:
-                messages.append(f"❌ Session not found for: {name}")
-            return
+            return f"❌ Session not found for: {name}"
 
         userid = str(cj.get("userid") or cj.get("client_id") or "").strip()
         sdk    = _ensure_session(cj)
         if not sdk or not userid:
-            with lock:
-                messages.append(f"❌ Session not found for: {name}")
-            return
+            return f"❌ Session not found for: {name}"
 
         try:
             resp = sdk.CancelOrder(order_id, userid)
             msg  = (resp.get("message", "") or "").lower() if isinstance(resp, dict) else ""
-            with lock:
-                if "cancel order request sent" in msg:
-                    messages.append(f"✅ Cancelled Order {order_id} for {name}")
-                else:
-                    messages.append(f"❌ Failed to cancel Order {order_id} for {name}: {resp.get('message','') if isinstance(resp,dict) else resp}")
+            if "cancel order request sent" in msg:
+                return userid, order_id
+            return f"❌ Failed to cancel Order {order_id} for {name}: {resp.get('message','') if isinstance(resp,dict) else resp}"
         except Exception as e:
-            with lock:
-                messages.append(f"❌ Error cancelling {order_id} for {name}: {e}")
+            return f"❌ Error cancelling {order_id} for {name}: {e}"
 
-    threads: List[threading.Thread] = []
-    for od in orders:
-        t = threading.Thread(target=cancel_single, args=(od,))
-        t.start()
-        threads.append(t)
-    for t in threads:
-        t.join()
+    results = order_dispatcher("motilal").run_all(
+        orders, lambda od: _client_key((od or {}).get("name") or ""), cancel_single)
+    final = _cancel_confirm([r for r in results if isinstance(r, tuple)])
 
+    messages = []
+    for od, r in zip(orders, results):
+        name = (od or {}).get("name")
+        if not isinstance(r, tuple):
+            messages.append(r or f"❌ Error cancelling {(od or {}).get('order_id')} for {name}")
+            continue
+        order_id = r[1]
+        st = final.get(order_id, "cancel")          # no live feed: the broker's ack is all we have
+        if st is None:
+            messages.append(f"✅ Cancel sent for Order {order_id} for {name} (not yet confirmed by exchange)")
+        elif "cancel" in st:
+            messages.append(f"✅ Cancelled Order {order_id} for {name}")
+        else:
+            messages.append(f"❌ Order {order_id} for {name} was {st} before the cancel")
     return messages
 
 
 
+def get_positions_for_client(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Positions for one client as {open, closed}. Raises if no session or the fetch fails."""
+    data: Dict[str, List[Dict[str, Any]]] = {"open": [], "closed": []}
+
+    name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
+    uid  = str(c.get("userid") or c.get("client_id") or "").strip()
+    sdk  = _ensure_session(c)
+    if not sdk or not uid:
+        raise RuntimeError(f"no session/userid for {name}")
+
+    # --- API call aligned with get_orders() ---
+    resp = sdk.GetPosition({"clientcode": uid})
+    if resp and resp.get("status") != "SUCCESS":
+        logging.error("❌ Error fetching positions for %s: %s", name, resp.get("message", "No message"))
+    rows = resp.get("data", []) if isinstance(resp, dict) else []
+    if not isinstance(rows, list):
+        rows = []
+    # -----------------------------------------
+
+    # --- same parsing / math you already use ---
+    for pos in rows:
+        buy_qty  = (pos.get("buyquantity", 0)  or 0)
+        sell_qty = (pos.get("sellquantity", 0) or 0)
+        qty      = buy_qty - sell_qty
+        booked   = (pos.get("bookedprofitloss", 0) or 0)
+        buy_amt  = (pos.get("buyamount", 0) or 0)
+        sell_amt = (pos.get("sellamount", 0) or 0)
+        ltp      = (pos.get("LTP", 0) or 0)
+        if qty != 0 and pos.get("symboltoken"):
+            # live MTM: a fresh feed/cache price beats the one in the positions response
+            key = md_inst(pos.get("exchange"), pos.get("symboltoken"))
+            market_data.lease([key])
+            ltp = ltp_service.peek(*key) or ltp
+
+        buy_avg  = (buy_amt / buy_qty)  if buy_qty  > 0 else 0
+        sell_avg = (sell_amt / sell_qty) if sell_qty > 0 else 0
+        # MTM + booked P&L (unchanged)
+        net_pnl  = ((ltp - buy_avg) * qty if qty > 0 else (sell_avg - ltp) * abs(qty)) + booked
+
+        row = {
+            "name": name,
+            "symbol": pos.get("symbol", "") or "",
+            "quantity": qty,
+            "buy_avg": round(buy_avg, 2),
+            "sell_avg": round(sell_avg, 2),
+            "net_profit": round(net_pnl, 2),
+        }
+        if qty == 0:
+            data["closed"].append(row)
+        else:
+            data["open"].append(row)
+    # -------------------------------------------
+
+    return data
+
+
 def get_positions() -> Dict[str, List[Dict[str, Any]]]:
     """
     Fetch Motilal positions for all logged-in clients and bucketize:
@@ -222,185 +374,274 @@ def get_positions() -> Dict[str, List[Dict[str, Any]]]:
     data: Dict[str, List[Dict[str, Any]]] = {"open": [], "closed": []}
 
     for c in _read_clients():
-        name = c.get("name") or c.get("display_name") or c.get("userid") or c.get("client_id") or ""
-        uid  = str(c.get("userid") or c.get("client_id") or "").strip()
-        sdk  = _ensure_session(c)
-        if not sdk or not uid:
-            logging.error("[MO] get_positions: no session/userid for %s", name)
-            continue
-
-        # --- API call aligned with get_orders() ---
         try:
-            resp = sdk.GetPosition({"clientcode": uid})
-            if resp and resp.get("status") != "SUCCESS":
-                logging.error("❌ Error fetching positions for %s: %s", name, resp.get("message", "No message"))
-            rows = resp.get("data", []) if isinstance(resp, dict) else []
-            if not isinstance(rows, list):
-                rows = []
+            part = get_positions_for_client(c)
         except Exception as e:
+            name = c.get("name") or c.get("display_name") or c.get("userid") or ""
             logging.error("[MO] get_positions error for %s: %s", name, e)
-            rows = []
-        # -----------------------------------------
-
-        # --- same parsing / math you already use ---
-        for pos in rows:
-            buy_qty  = (pos.get("buyquantity", 0)  or 0)
-            sell_qty = (pos.get("sellquantity", 0) or 0)
-            qty      = buy_qty - sell_qty
-            booked   = (pos.get("bookedprofitloss", 0) or 0)
-            buy_amt  = (pos.get("buyamount", 0) or 0)
-            sell_amt = (pos.get("sellamount", 0) or 0)
-            ltp      = (pos.get("LTP", 0) or 0)
-
-            buy_avg  = (buy_amt / buy_qty)  if buy_qty  > 0 else 0
-            sell_avg = (sell_amt / sell_qty) if sell_qty > 0 else 0
-            # MTM + booked P&L (unchanged)
-            net_pnl  = ((ltp - buy_avg) * qty if qty > 0 else (sell_avg - ltp) * abs(qty)) + booked
-
-            row = {
-                "name": name,
-                "symbol": pos.get("symbol", "") or "",
-                "quantity": qty,
-                "buy_avg": round(buy_avg, 2),
-                "sell_avg": round(sell_avg, 2),
-                "net_profit": round(net_pnl, 2),
-            }
-            if qty == 0:
-                data["closed"].append(row)
-            else:
-                data["open"].append(row)
-        # -------------------------------------------
+            continue
+        data["open"].extend(part["open"])
+        data["closed"].extend(part["closed"])
 
     return data
 
-def close_positions(positions: List[Dict[str, Any]]) -> List[str]:
+def _close_fetch(cj: Dict[str, Any]) -> List[Dict[str, Any]]:
     """
-    Close (square-off) positions for given [{name, symbol}] by placing
-    opposite MARKET orders via MOFSLOPENAPI. Also prints the exact payload
-    and raw response so you can see them in Railway Logs.
+    GetPosition rows for one account (Square_off fetch). Raises without a
+    session or when GetPosition fails (no positions is not an error).
     """
-    import json, os, sqlite3, sys, logging
-
-    # --- map client display name -> client json (reuse the login/session flow)
-    by_name: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        nm = (c.get("name") or c.get("display_name") or "").strip()
-        if nm:
-            by_name[nm] = c
+    sdk = _ensure_session(cj)
+    if not sdk:
+        raise RuntimeError(f"no session for {cj.get('name') or cj.get('userid')}")
+    resp = sdk.GetPosition()
+    if not isinstance(resp, dict) or resp.get("status") != "SUCCESS":
+        msg = resp.get("message", "No message") if isinstance(resp, dict) else str(resp)
+        if "no data" in str(msg).lower():
+            return []
+        raise RuntimeError(f"GetPosition failed: {msg}")
+    rows = resp.get("data", [])
+    return rows if isinstance(rows, list) else []
+
+
+def _close_plan(cj: Dict[str, Any], rows: List[Dict[str, Any]], req: Dict[str, Any]):
+    """Opposite MARKET order for req's symbol from the account's GetPosition rows (Square_off plan)."""
+    name   = req.get("name") or ""
+    symbol = req.get("symbol") or ""
+    uid    = (cj.get("userid") or cj.get("client_id") or "").strip()
+
+    pos_row = next((r for r in rows if (r.get("symbol") or "") == symbol), None)
+    if not pos_row:
+        return None, f"❌ Position not found: {name} - {symbol}"
+    return _close_leg(uid, pos_row, name)
+
+
+def _close_leg(uid: str, pos_row: Dict[str, Any], name: str):
+    """Closing order for one GetPosition row, or (None, message) when it is flat."""
+    symbol = pos_row.get("symbol") or ""
+    buy_q  = int(pos_row.get("buyquantity", 0) or 0)
+    sell_q = int(pos_row.get("sellquantity", 0) or 0)
+    net_q  = buy_q - sell_q
+    if net_q == 0:
+        return None, f"ℹ️ Already flat: {name} - {symbol}"
+
+    side = "SELL" if net_q > 0 else "BUY"
+    qty  = abs(net_q)
+
+    # --- lot sizing: use symboltoken to pick min qty (defaults to 1)
+    token   = str(pos_row.get("symboltoken") or "")
+    min_qty = _min_qty(token, "CLOSE")
+    lots    = max(1, int(qty // min_qty)) if min_qty > 0 else int(qty)
+
+    # producttype from position; MO usually expects NORMAL/VALUEPLUS/etc.
+    product = (pos_row.get("productname") or pos_row.get("producttype") or "CNC")
+
+    return {
+        "clientcode": uid,
+        "exchange": pos_row.get("exchange", "NSE"),
+        "symboltoken": int(token),
+        "buyorsell": side,
+        "ordertype": "MARKET",
+        "producttype": product,
+        "orderduration": "DAY",
+        "price": 0,
+        "triggerprice": 0,
+        "quantityinlot": int(lots),
+        "disclosedquantity": 0,
+        "amoorder": "N",
+        "algoid": "",
+        "goodtilldate": "",
+        "tag": "SQUAREOFF",
+        "_name": name,
+        "_symbol": symbol,
+    }, None
+
+
+def _close_send(leg: Dict[str, Any]) -> str:
+    """
+    Place one exit. Never waits for the fill: the placed order id is kept in
+    leg["_order_id"] for _close_confirm(), which runs after every leg is out.
+    """
+    name, symbol, cj = leg["_name"], leg["_symbol"], leg["_client_json"]
+    payload = {k: v for k, v in leg.items() if not k.startswith("_")}
+    sdk = _ensure_session(cj)
+    if not sdk:
+        return f"❌ No session for: {name}"
 
-    # --- load min-qty map once (Security ID -> Min Qty). We key by symboltoken.
-    min_qty_map: Dict[str, int] = {}
+    print(f"[MO][CLOSE] payload for {name} - {symbol} => {json.dumps(payload)}", flush=True)
     try:
-        if os.path.exists(SQLITE_DB):
-            conn = sqlite3.connect(SQLITE_DB)
-            cur  = conn.cursor()
-            cur.execute('SELECT [Security ID], [Min Qty] FROM symbols')
-            for sid, q in cur.fetchall():
-                if sid:
-                    try:
-                        min_qty_map[str(sid)] = int(q) if q else 1
-                    except Exception:
-                        min_qty_map[str(sid)] = 1
-            conn.close()
+        r = sdk.PlaceOrder(payload)
     except Exception as e:
-        print(f"[MO][CLOSE] min-qty DB read error: {e}", flush=True)
-
-    out: List[str] = []
-
-    for req in positions or []:
-        name   = (req or {}).get("name")   or ""
-        symbol = (req or {}).get("symbol") or ""
-        if not name or not symbol:
-            out.append(f"❌ Missing name/symbol in request: {req}")
-            continue
+        r = {"status": "ERROR", "message": str(e)}
+    try:
+        print(f"[MO][CLOSE] response for {name} - {symbol} => {json.dumps(r)}", flush=True)
+    except Exception:
+        pass
 
-        cj  = by_name.get(name)
-        uid = (cj.get("userid") or cj.get("client_id") or "").strip() if cj else ""
-        sdk = _ensure_session(cj) if cj else None
-        if not (cj and uid and sdk):
-            out.append(f"❌ No session for: {name}")
-            continue
+    # --- normalize message for UI
+    msg = r.get("message") if isinstance(r, dict) else None
+    ok = False
+    if isinstance(r, dict):
+        st = (r.get("status") or "").upper()
+        ok = st == "SUCCESS" or ("order placed" in (msg or "").lower())
 
-        # --- fetch fresh positions so we get exchange, product, symboltoken, and net qty
-        try:
-            resp = sdk.GetPosition()
-            rows = resp.get("data", []) if (resp and resp.get("status") == "SUCCESS") else []
-        except Exception as e:
-            out.append(f"❌ GetPosition failed for {name}: {e}")
-            continue
+    if ok and isinstance(r, dict):
+        d = r.get("data") if isinstance(r.get("data"), dict) else {}
+        leg["_order_id"] = str(r.get("uniqueorderid") or d.get("uniqueorderid") or "")
+        leg["_reply"] = msg or "order placed"
+    return f"{'✅' if ok else '❌'} {name} - close {symbol}: {msg or r}"
 
-        pos_row = next((r for r in rows if (r.get("symbol") or "") == symbol), None)
-        if not pos_row:
-            out.append(f"❌ Position not found: {name} - {symbol}")
-            continue
 
-        buy_q  = int(pos_row.get("buyquantity", 0) or 0)
-        sell_q = int(pos_row.get("sellquantity", 0) or 0)
-        net_q  = buy_q - sell_q
-        if net_q == 0:
-            out.append(f"ℹ️ Already flat: {name} - {symbol}")
+def _close_confirm(legs: List[Dict[str, Any]], messages: List[Optional[str]],
+                   confirm_s: float = MO_CONFIRM_S) -> List[Optional[str]]:
+    """
+    After all exits are out: wait for their fills on the TradeStatus feed,
+    sharing one confirm_s deadline, and note the outcome in each message.
+    """
+    deadline = time.monotonic() + confirm_s
+    out: List[Optional[str]] = []
+    for leg, msg in zip(legs, messages):
+        oid, uid = leg.get("_order_id"), str(leg.get("clientcode") or "")
+        if not oid or confirm_s <= 0 or not order_store.live(uid):
+            out.append(msg)
             continue
+        fill = order_store.wait_for(oid, lambda s: any(w in s for w in ("traded", "reject", "cancel")),
+                                    max(0.0, deadline - time.monotonic()))
+        ok = not fill or "traded" in fill
+        out.append(f"{'✅' if ok else '❌'} {leg['_name']} - close {leg['_symbol']}: "
+                   f"{leg['_reply']} ({fill or 'fill not yet confirmed'})")
+    return out
 
-        side = "SELL" if net_q > 0 else "BUY"
-        qty  = abs(net_q)
-
-        # --- lot sizing: use symboltoken to pick min qty (defaults to 1)
-        token   = str(pos_row.get("symboltoken") or "")
-        min_qty = max(1, int(min_qty_map.get(token, 1)))
-        lots    = max(1, int(qty // min_qty)) if min_qty > 0 else int(qty)
-
-        # producttype from position; MO usually expects NORMAL/VALUEPLUS/etc.
-        product = (pos_row.get("productname") or pos_row.get("producttype") or "CNC")
 
-        # --- build MO payload
-        order = {
-            "clientcode": uid,
-            "exchange": pos_row.get("exchange", "NSE"),
-            "symboltoken": int(token),
-            "buyorsell": side,
-            "ordertype": "MARKET",
-            "producttype": product,
-            "orderduration": "DAY",
-            "price": 0,
-            "triggerprice": 0,
-            "quantityinlot": int(lots),
-            "disclosedquantity": 0,
-            "amoorder": "N",
-            "algoid": "",
-            "goodtilldate": "",
-            "tag": "SQUAREOFF",
-        }
+def _is_working(status: str) -> bool:
+    """Order status that can still fill (open / partly filled)."""
+    s = (status or "").lower()
+    if not s or "partial" in s:
+        return bool(s)
+    return not any(w in s for w in ("traded", "cancel", "reject", "error", "expire"))
 
-        # --- print the payload (and flush so it appears in logs immediately)
-        try:
-            print(f"[MO][CLOSE] payload for {name} - {symbol} =>", flush=True)
-            print(json.dumps(order, indent=2), flush=True)
-        except Exception:
-            # never let logging break the flow
-            pass
 
-        # --- call the API
+def flatten_account(cj: Dict[str, Any], symbol: Optional[str] = None,
+                    progress: Optional[Any] = None,
+                    confirm_s: float = MO_CONFIRM_S) -> Dict[str, Any]:
+    """
+    Kill switch for one account (Flatten): send every cancel at once, wait up
+    to confirm_s for TradeStatus to confirm them, then send every exit at once
+    and confirm their fills. <symbol> limits both steps. A failed order-book
+    or positions read counts as a failure. progress(stage, message) per step.
+    """
+    name = cj.get("name") or cj.get("display_name") or cj.get("userid") or ""
+    uid  = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    say  = progress or (lambda *_a: None)
+    out  = {"cancelled": 0, "cancel_failed": 0, "closed": 0, "close_failed": 0, "messages": []}
+
+    def _note(stage: str, ok: bool, msg: str) -> None:
+        out[(stage + "led" if stage == "cancel" else stage + "d") if ok else stage + "_failed"] += 1
+        out["messages"].append(msg)
+        say(stage, msg)
+
+    sdk = _ensure_session(cj)
+    if not sdk or not uid:
+        _note("close", False, f"❌ No session for: {name}")
+        return out
+
+    # ---- cancel working orders first so nothing fills behind the exit
+    try:
+        book = _order_book(sdk, uid, name, strict=True)
+    except Exception as e:
+        book = []
+        _note("cancel", False, f"❌ {name} order book unavailable, working orders not cancelled: {e}")
+    def _cancel(leg: Dict[str, Any]) -> str:
         try:
-            r = sdk.PlaceOrder(order)
+            resp = sdk.CancelOrder(leg["order_id"], uid)
+            rmsg = resp.get("message", "") if isinstance(resp, dict) else str(resp)
         except Exception as e:
-            r = {"status": "ERROR", "message": str(e)}
+            rmsg = str(e)
+        leg["_ok"] = "cancel order request sent" in (rmsg or "").lower()
+        return f"{'✅' if leg['_ok'] else '❌'} {name} cancel {leg['order_id']} {leg['_symbol']}: {rmsg}"
+
+    # all cancels at once (priority calls), then one shared confirm deadline
+    cancels = [{"_name": name, "_symbol": o.get("symbol", ""), "order_id": str(o.get("uniqueorderid") or "")}
+               for o in book
+               if _is_working(str(o.get("orderstatus") or "")) and not (symbol and o.get("symbol") != symbol)]
+    for leg, msg in zip(cancels, square_off.send_burst(cancels, _cancel)):
+        _note("cancel", bool(leg.get("_ok")), msg or f"❌ {name} cancel {leg['order_id']}: send failed")
+    _cancel_confirm([(uid, leg["order_id"]) for leg in cancels if leg.get("_ok")], confirm_s)
+
+    # ---- then square off what is open now: all exits out first, fills confirmed after
+    try:
+        rows = _close_fetch(cj)
+    except Exception as e:
+        _note("close", False, f"❌ {name} positions unavailable: {e}")
+        return out
+    legs = []
+    for pos in rows:
+        if symbol and pos.get("symbol") != symbol:
+            continue
+        leg, _msg = _close_leg(uid, pos, name)
+        if leg is not None:
+            leg["_client_json"] = cj
+            legs.append(leg)
+    sent = square_off.send_burst(legs, _close_send, lambda ls, ms: _close_confirm(ls, ms, confirm_s))
+    for leg, msg in zip(legs, sent):
+        msg = msg or f"❌ {name} - close {leg['_symbol']}: send failed"
+        _note("close", msg.startswith("✅"), msg)
+    return out
 
-        # --- print the raw response too
-        try:
-            print(f"[MO][CLOSE] response for {name} - {symbol} =>", flush=True)
-            print(json.dumps(r, indent=2), flush=True)
-        except Exception:
-            pass
 
-        # --- normalize message for UI
-        msg = r.get("message") if isinstance(r, dict) else None
-        ok = False
-        if isinstance(r, dict):
-            st = (r.get("status") or "").upper()
-            ok = st == "SUCCESS" or ("order placed" in (msg or "").lower())
-        out.append(f"{'✅' if ok else '❌'} {name} - close {symbol}: {msg or r}")
+def close_positions(positions: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Square off [{name, symbol}] with opposite MARKET orders via the Square_off
+    planner: one GetPosition per account, then all exits dispatched at once.
+    Payloads and raw responses are logged. Returns {"message": [...], "timings": {...}}.
+    """
+    return square_off.run(
+        "motilal", positions, _client_by_name, _close_fetch, _close_plan, _close_send,
+        lambda cj: str(cj.get("userid") or cj.get("client_id") or ""), _close_confirm)
+
+
+# ---------- copy trading (Copy_trading reads master orders through these) ----------
+_COPY_ORDER_TYPE = {"SL-M": "SL_MARKET", "SL_M": "SL_MARKET", "SL_MARKET": "SL_MARKET",
+                    "STOPLOSS": "STOPLOSS", "SL": "STOPLOSS", "SL_LIMIT": "STOPLOSS"}
+
+
+def _copy_status(status: str) -> str:
+    s = (status or "").lower()
+    if _is_working(s):
+        return "open"
+    if "traded" in s:
+        return "filled"
+    if "cancel" in s:
+        return "cancelled"
+    return "rejected" if s else ""
+
+
+def copy_order(o: Dict[str, Any]) -> Dict[str, Any]:
+    """A GetOrderBook / TradeStatus order row in router order fields (qty in shares)."""
+    ot = str(o.get("ordertype") or "").strip().upper().replace(" ", "_")
+    return {
+        "order_id": str(o.get("uniqueorderid") or ""),
+        "status": _copy_status(str(o.get("orderstatus") or "")),
+        "action": str(o.get("buyorsell") or "").upper(),
+        "ordertype": _COPY_ORDER_TYPE.get(ot, ot),
+        "producttype": str(o.get("producttype") or "").upper(),
+        "orderduration": str(o.get("orderduration") or "DAY").upper(),
+        "exchange": str(o.get("exchange") or "NSE").upper(),
+        "security_id": str(o.get("symboltoken") or "").strip(),
+        "symbol": o.get("symbol") or "",
+        "qty": int(float(o.get("orderqty") or 0)),
+        "price": float(o.get("price") or o.get("orderprice") or 0),
+        "triggerprice": float(o.get("triggerprice") or 0),
+    }
 
-    return out
+
+def copy_master_orders(cj: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Master's order book as copy_order() rows (poll fallback). Raises if no session or the read fails."""
+    name = cj.get("name") or cj.get("display_name") or cj.get("userid") or ""
+    uid  = str(cj.get("userid") or cj.get("client_id") or "").strip()
+    sdk  = _ensure_session(cj)
+    if not sdk or not uid:
+        raise RuntimeError(f"no session/userid for {name}")
+    return [copy_order(o) for o in _order_book(sdk, uid, name, strict=True) if isinstance(o, dict)]
 
 
 def _get_available_margin(sdk, clientcode: str) -> float:
@@ -425,9 +666,119 @@ def _get_available_margin(sdk, clientcode: str) -> float:
 
 
 
+def get_holdings_for_client(c: Dict[str, Any]) -> Dict[str, Any]:
+    """Holdings + one summary row for one Motilal client. Raises if no session."""
+    holdings_rows: List[Dict[str, Any]] = []
+    summaries: List[Dict[str, Any]] = []
+
+    userid = str(c.get("userid") or c.get("client_id") or "").strip()
+    name   = c.get("name") or c.get("display_name") or userid
+    if not userid:
+        return {"holdings": holdings_rows, "summary": summaries}
+
+    # capital from client file (fallback 0.0)
+    try:
+        capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
+    except Exception:
+        capital = 0.0
+
+    sdk = _ensure_session(c)
+    if not sdk:
+        raise RuntimeError(f"no session for {name} ({userid})")
+
+    # --- 1) HOLDINGS (DP holdings)
+    rows: List[Dict[str, Any]] = []
+    try:
+        # Your working shape prefers plain userid; try that first.
+        resp = sdk.GetDPHolding(userid)
+        if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
+            # fallbacks
+            for arg in ({"clientcode": userid}, None):
+                fn = getattr(sdk, "GetDPHolding", None)
+                if callable(fn):
+                    try:
+                        resp = fn(arg) if arg is not None else fn()
+                        if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+                            break
+                    except Exception:
+                        pass
+        if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
+            rows = resp.get("data", []) or []
+            if not isinstance(rows, list):
+                rows = []
+    except Exception as e:
+        logging.error("[MO] GetDPHolding error for %s: %s", name, e)
+        rows = []
+
+    invested = 0.0
+    total_pnl = 0.0
+
+    # --- 1.a) LTPs for every scrip at once, through the shared cache (paise -> divide by 100)
+    def _fetch_ltp(exchange: str, code: str) -> float | None:
+        r = sdk.GetLtp({"clientcode": userid, "exchange": exchange, "scripcode": int(code)})
+        if isinstance(r, dict) and r.get("status") == "SUCCESS":
+            return float((r.get("data") or {}).get("ltp", 0) or 0) / 100.0
+        return None
+
+    codes = [h.get("nsesymboltoken") or h.get("symboltoken") or h.get("token") for h in rows]
+    market_data.lease([md_inst("NSE", code) for code in codes if code])     # next refresh comes off the feed
+    ltps = ltp_service.get_many([("NSE", code) for code in codes if code], _fetch_ltp)
+
+    for h in rows:
+        symbol   = (h.get("scripname") or h.get("symbol") or "").strip()
+        try:
+            qty    = float(h.get("dpquantity", h.get("quantity", 0)) or 0)
+            buyavg = float(h.get("buyavgprice", h.get("avgprice", 0)) or 0)
+        except Exception:
+            qty, buyavg = 0.0, 0.0
+
+        # token for NSE; your working code uses nsesymboltoken
+        scripcode = h.get("nsesymboltoken") or h.get("symboltoken") or h.get("token")
+        if not scripcode or qty <= 0:
+            continue
+
+        ltp = ltps.get(ltp_key("NSE", scripcode), 0.0)
+
+        pnl = round((ltp - buyavg) * qty, 2)
+        invested  += qty * buyavg
+        total_pnl += pnl
+
+        holdings_rows.append({
+            "name": name,
+            "symbol": symbol,
+            "quantity": qty,
+            "buy_avg": round(buyavg, 2),
+            "ltp": round(ltp, 2),
+            "pnl": pnl
+        })
+
+    current_value = invested + total_pnl
+
+    # --- 2) AVAILABLE MARGIN
+    available_margin = 0.0
+    try:
+        available_margin = _get_available_margin(sdk, userid)
+    except Exception as e:
+        logging.error("[MO] get available margin error for %s: %s", name, e)
+
+    net_gain = round((current_value + available_margin) - capital, 2)
+
+    summaries.append({
+        "name": name,
+        "capital": round(capital, 2),
+        "invested": round(invested, 2),
+        "pnl": round(total_pnl, 2),
+        "current_value": round(current_value, 2),
+        "available_margin": round(available_margin, 2),
+        "net_gain": net_gain
+    })
+
+    return {"holdings": holdings_rows, "summary": summaries}
+
+
 def get_holdings() -> Dict[str, Any]:
     """
-    Motilal holdings using GetDPHolding + per-scrip GetLtp.
+    Motilal holdings using GetDPHolding + GetLtp through the shared LTP cache.
     Returns: {"holdings": [...], "summary": [...]}
 
     holdings rows:
@@ -440,130 +791,45 @@ def get_holdings() -> Dict[str, Any]:
     summaries: List[Dict[str, Any]] = []
 
     for c in _read_clients():
-        userid = str(c.get("userid") or c.get("client_id") or "").strip()
-        name   = c.get("name") or c.get("display_name") or userid
-        if not userid:
-            continue
-
-        # capital from client file (fallback 0.0)
         try:
-            capital = float(c.get("capital", 0) or c.get("base_amount", 0) or 0.0)
-        except Exception:
-            capital = 0.0
-
-        sdk = _ensure_session(c)
-        if not sdk:
-            logging.error("[MO] No session for %s (%s)", name, userid)
-            continue
-
-        # --- 1) HOLDINGS (DP holdings)
-        rows: List[Dict[str, Any]] = []
-        try:
-            # Your working shape prefers plain userid; try that first.
-            resp = sdk.GetDPHolding(userid)
-            if not (isinstance(resp, dict) and resp.get("status") == "SUCCESS"):
-                # fallbacks
-                for arg in ({"clientcode": userid}, None):
-                    fn = getattr(sdk, "GetDPHolding", None)
-                    if callable(fn):
-                        try:
-                            resp = fn(arg) if arg is not None else fn()
-                            if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
-                                break
-                        except Exception:
-                            pass
-            if isinstance(resp, dict) and resp.get("status") == "SUCCESS":
-                rows = resp.get("data", []) or []
-                if not isinstance(rows, list):
-                    rows = []
+            part = get_holdings_for_client(c)
         except Exception as e:
-            logging.error("[MO] GetDPHolding error for %s: %s", name, e)
-            rows = []
-
-        invested = 0.0
-        total_pnl = 0.0
-
-        for h in rows:
-            symbol   = (h.get("scripname") or h.get("symbol") or "").strip()
-            try:
-                qty    = float(h.get("dpquantity", h.get("quantity", 0)) or 0)
-                buyavg = float(h.get("buyavgprice", h.get("avgprice", 0)) or 0)
-            except Exception:
-                qty, buyavg = 0.0, 0.0
-
-            # token for NSE; your working code uses nsesymboltoken
-            scripcode = h.get("nsesymboltoken") or h.get("symboltoken") or h.get("token")
-            if not scripcode or qty <= 0:
-                continue
-
-            # --- 1.a) LTP per scrip (paise -> divide by 100)
-            ltp = 0.0
-            try:
-                ltp_req = {"clientcode": userid, "exchange": "NSE", "scripcode": int(scripcode)}
-                ltp_resp = sdk.GetLtp(ltp_req)
-                if isinstance(ltp_resp, dict) and ltp_resp.get("status") == "SUCCESS":
-                    ltp_val = (ltp_resp.get("data") or {}).get("ltp", 0)
-                    ltp = float(ltp_val or 0) / 100.0
-            except Exception:
-                ltp = 0.0
+            logging.error("[MO] get_holdings: %s", e)
+            continue
+        holdings_rows.extend(part["holdings"])
+        summaries.extend(part["summary"])
 
-            pnl = round((ltp - buyavg) * qty, 2)
-            invested  += qty * buyavg
-            total_pnl += pnl
+    return {"holdings": holdings_rows, "summary": summaries}
 
-            holdings_rows.append({
-                "name": name,
-                "symbol": symbol,
-                "quantity": qty,
-                "buy_avg": round(buyavg, 2),
-                "ltp": round(ltp, 2),
-                "pnl": pnl
-            })
 
-        current_value = invested + total_pnl
+# ---------- async reads (router fan-out) ----------
+# MOFSLOPENAPI is blocking; these run it on the motilal fan-out pool
+# (FANOUT_MOTILAL_CONCURRENCY workers) rather than the server's threadpool.
+async def get_orders_for_client_async(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    return await run_blocking("motilal", get_orders_for_client, c)
 
-        # --- 2) AVAILABLE MARGIN
-        available_margin = 0.0
-        try:
-            available_margin = _get_available_margin(sdk, userid)
-        except Exception as e:
-            logging.error("[MO] get available margin error for %s: %s", name, e)
 
-        net_gain = round((current_value + available_margin) - capital, 2)
+async def get_positions_for_client_async(c: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    return await run_blocking("motilal", get_positions_for_client, c)
 
-        summaries.append({
-            "name": name,
-            "capital": round(capital, 2),
-            "invested": round(invested, 2),
-            "pnl": round(total_pnl, 2),
-            "current_value": round(current_value, 2),
-            "available_margin": round(available_margin, 2),
-            "net_gain": net_gain
-        })
 
-    return {"holdings": holdings_rows, "summary": summaries}
+async def get_holdings_for_client_async(c: Dict[str, Any]) -> Dict[str, Any]:
+    return await run_blocking("motilal", get_holdings_for_client, c)
 
 def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     import json, threading
-    from typing import Dict, Any, List
+    from typing import Dict, Any
 
     if not isinstance(orders, list) or not orders:
         return {"status": "empty", "order_responses": {}}
 
-    by_id: Dict[str, Dict[str, Any]] = {}
-    for c in _read_clients():
-        uid = str(c.get("userid") or c.get("client_id") or "").strip()
-        if uid:
-            by_id[uid] = c
-
     responses: Dict[str, Any] = {}
     lock = threading.Lock()
-    threads: List[threading.Thread] = []
 
     def _worker(od: Dict[str, Any]):
         uid  = str(od.get("client_id") or "").strip()
         name = od.get("name") or uid
-        cj   = by_id.get(uid)
+        cj   = client_registry.get("motilal", uid)
         key  = f"{od.get('tag') or ''}:{uid}"
 
         if not cj:
@@ -618,27 +884,22 @@ def place_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
                 print(resp)
             responses[key] = resp
 
-    for od in orders:
-        t = threading.Thread(target=_worker, args=(od,))
-        t.start()
-        threads.append(t)
-    for t in threads:
-        t.join()
+    # one lane per account: legs for a client go out in the order given
+    order_dispatcher("motilal").run_all(orders, lambda od: str(od.get("client_id") or "").strip(), _worker)
 
     return {"status": "completed", "order_responses": responses}
 
 def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
     Motilal ModifyOrder (order-details aware):
-      • Prefer GetOrderDetails to fetch symboltoken, orderqty, and *exact* last-modified time.
+      • Take symboltoken, orderqty and *exact* last-modified time from the live
+        TradeStatus store; otherwise ask GetOrderDetails.
       • Fall back to GetOrderBook if details missing.
       • If UI = NO_CHANGE, derive type from snapshot so STOPLOSS/SL-M don't become MARKET.
       • Convert SHARES -> LOTS using min-qty in SQLite symbols.db.
       • Always include newordertype and lastmodifiedtime per MO requirement.
     """
-    import json, os, sqlite3
-
-    messages: List[str] = []
+    import json
 
     # ---------- small utils ----------
     def _num_i(x, default=None):
@@ -701,21 +962,6 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
         if has_p and not has_t: return "LIMIT"
         return "MARKET"
 
-    # load client JSON by display name
-    def _load_client(name: str) -> Dict[str, Any] | None:
-        needle = (name or "").strip().lower()
-        try:
-            for fn in os.listdir(_MO_DIR):
-                if not fn.endswith(".json"): continue
-                with open(os.path.join(_MO_DIR, fn), "r", encoding="utf-8") as f:
-                    cj = json.load(f)
-                nm = (cj.get("name") or cj.get("display_name") or "").strip().lower()
-                if nm == needle:
-                    return cj
-        except Exception:
-            pass
-        return None
-
     # ---- data sources for live order ----
     def _fetch_order_details(sdk, uid: str, oid: str) -> dict | None:
         """
@@ -776,25 +1022,8 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
                 return int(q)
         return None
 
-    # Build min-qty map once
-    min_qty_map: Dict[str, int] = {}
-    try:
-        if os.path.exists(SQLITE_DB):
-            conn = sqlite3.connect(SQLITE_DB)
-            cur  = conn.cursor()
-            cur.execute('SELECT [Security ID], [Min Qty] FROM symbols')
-            for sid, q in cur.fetchall():
-                if sid:
-                    try: min_qty_map[str(sid)] = int(q) if q else 1
-                    except Exception: min_qty_map[str(sid)] = 1
-            conn.close()
-        else:
-            print(f"[MO][MODIFY] WARNING: SQLITE_DB not found at {SQLITE_DB}", flush=True)
-    except Exception as e:
-        print(f"[MO][MODIFY] min-qty DB read error: {e}", flush=True)
-
-    # --------- process each order ---------
-    for row in (orders or []):
+    # --------- process each order (one dispatcher job per row) ---------
+    def _modify_one(row: Dict[str, Any]) -> str:
         try:
             # Debug IN row
             try:
@@ -806,39 +1035,37 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
             name = (row.get("name") or "").strip() or "<unknown>"
             oid  = str(row.get("order_id") or row.get("orderId") or "").strip()
             if not oid:
-                messages.append(f"ℹ️ {name}: skipped (missing order_id)")
-                continue
+                return f"ℹ️ {name}: skipped (missing order_id)"
 
-            cj = _load_client(name)
+            cj = _client_by_name(name)
             if not cj:
-                messages.append(f"❌ {name} ({oid}): client JSON not found")
-                continue
+                return f"❌ {name} ({oid}): client JSON not found"
 
             uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
             sdk = _ensure_session(cj)
             if not (uid and sdk):
-                messages.append(f"❌ {name} ({oid}): session not available")
-                continue
+                return f"❌ {name} ({oid}): session not available"
 
             price_in = row.get("price")
             trig_in  = row.get("triggerPrice", row.get("triggerprice"))
             qty_shares_in = _num_i(row.get("quantity"))   # router sends SHARES
 
-            # Prefer order details; fallback to order book
-            snap = _fetch_order_details(sdk, uid, oid)
+            # Live TradeStatus store first; else order details, then the order book
+            snap = order_store.get(oid) if order_store.live(uid) else None
+            if not snap:
+                snap = _fetch_order_details(sdk, uid, oid)
             if not snap:
                 snap = _fetch_order_book_row(sdk, uid, oid) or {}
 
             token     = _extract_token(snap)
-            min_qty   = max(1, int(min_qty_map.get(token, 1))) if token else 1
+            min_qty   = _min_qty(token, "MODIFY") if token else 1
             shares    = qty_shares_in if _pos(qty_shares_in) else _extract_orderqty(snap) or 0
             lots      = int(shares // min_qty) if _pos(shares) else 0
             last_mod  = _extract_last_mod(snap)
 
             if lots <= 0:
-                messages.append(f"❌ {name} ({oid}): cannot determine quantity in LOTS "
-                                f"(shares={shares}, token={token}, min_qty={min_qty})")
-                continue
+                return (f"❌ {name} ({oid}): cannot determine quantity in LOTS "
+                        f"(shares={shares}, token={token}, min_qty={min_qty})")
 
             # Decide order type (always include)
             ui_type = _ui_to_mo(row.get("orderType"))
@@ -859,14 +1086,11 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
 
             # Type-specific validations
             if payload["newordertype"] == "LIMIT" and "newprice" not in payload:
-                messages.append(f"❌ {name} ({oid}): LIMIT requires Price > 0")
-                continue
+                return f"❌ {name} ({oid}): LIMIT requires Price > 0"
             if payload["newordertype"] == "STOPLOSS" and not (("newprice" in payload) and ("newtriggerprice" in payload)):
-                messages.append(f"❌ {name} ({oid}): STOPLOSS requires Price & Trigger > 0")
-                continue
+                return f"❌ {name} ({oid}): STOPLOSS requires Price & Trigger > 0"
             if payload["newordertype"] == "SL-M" and "newtriggerprice" not in payload:
-                messages.append(f"❌ {name} ({oid}): SL-M requires Trigger > 0")
-                continue
+                return f"❌ {name} ({oid}): SL-M requires Trigger > 0"
 
             # Debug OUT payload
             try:
@@ -897,11 +1121,16 @@ def modify_orders(orders: List[Dict[str, Any]]) -> Dict[str, Any]:
                 ok = bool(resp)
                 msg = "" if ok else str(resp)
 
-            messages.append(f"{'✅' if ok else '❌'} {name} ({oid}): {'Modified' if ok else (msg or 'modify failed')}")
+            return f"{'✅' if ok else '❌'} {name} ({oid}): {'Modified' if ok else (msg or 'modify failed')}"
 
         except Exception as e:
-            messages.append(f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}")
+            return f"❌ {row.get('name','<unknown>')} ({row.get('order_id','?')}): {e}"
 
+    rows = orders or []
+    results = order_dispatcher("motilal").run_all(
+        rows, lambda row: _client_key((row.get("name") or "").strip()), _modify_one)
+    messages = [m or f"❌ {r.get('name','<unknown>')} ({r.get('order_id','?')}): modify failed"
+                for r, m in zip(rows, results)]
     return {"message": messages}
 
 
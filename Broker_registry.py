@@ -0,0 +1,192 @@
+# Broker_registry.py
+"""
+Broker adapter registry.
+
+Each broker module (Broker_dhan, Broker_motilal) is imported once and wrapped in
+an adapter with one fixed interface; every route dispatches through
+broker_registry.get(<broker>) instead of importing the module itself.
+
+Write calls (place / cancel / modify / close) invalidate the cached read
+snapshots of the clients they touched (Snapshot_cache).
+
+Modules are never reloaded on the request path. reload() is the explicit hot
+reload used by POST /admin/reload_brokers; it carries Broker_motilal._sessions
+over so live MOFSL sessions survive a code reload.
+"""
+import importlib, threading, time
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Protocol, runtime_checkable
+
+from Client_registry import client_registry
+from Snapshot_cache import snapshot_cache
+
+BROKER_MODULES: Dict[str, str] = {
+    "dhan":    "Broker_dhan",
+    "motilal": "Broker_motilal",
+}
+
+# functions every broker module must export
+REQUIRED = (
+    "place_orders", "cancel_orders", "modify_orders",
+    "get_orders", "get_positions", "get_holdings", "close_positions",
+)
+# optional: login + per-client reads used by the fan-out routes; the async
+# routes prefer the coroutine variant (<fn>_async) and fall back to the sync one
+OPTIONAL = (
+    "login", "list_clients",
+    "get_orders_for_client", "get_positions_for_client", "get_holdings_for_client",
+    "get_orders_for_client_async", "get_positions_for_client_async", "get_holdings_for_client_async",
+)
+# module-level state carried across an explicit reload
+_PRESERVE = ("_sessions",)
+
+
+@runtime_checkable
+class BrokerAdapter(Protocol):
+    name: str
+
+    def place_orders(self, orders: List[Dict[str, Any]]) -> Any: ...
+    def cancel_orders(self, orders: List[Dict[str, Any]]) -> Any: ...
+    def modify_orders(self, orders: List[Dict[str, Any]]) -> Any: ...
+    def get_orders(self) -> Dict[str, List[Dict[str, Any]]]: ...
+    def get_positions(self) -> Dict[str, List[Dict[str, Any]]]: ...
+    def get_holdings(self) -> Dict[str, Any]: ...
+    def close_positions(self, positions: List[Dict[str, Any]]) -> Any: ...
+
+
+class ModuleBrokerAdapter:
+    """BrokerAdapter backed by one of the Broker_<name> modules."""
+
+    def __init__(self, name: str, module: ModuleType):
+        self.name = name
+        self.module = module
+        self.loaded_at = time.time()
+        self.missing = [fn for fn in REQUIRED if not callable(getattr(module, fn, None))]
+
+    def _call(self, fn: str, *args):
+        f = getattr(self.module, fn, None)
+        if not callable(f):
+            raise NotImplementedError(f"{self.module.__name__}.{fn} not implemented")
+        return f(*args)
+
+    def _client_ids(self, rows) -> List[str]:
+        """Client ids touched by a batch: client_id, _client_json.userid or display name."""
+        ids: List[str] = []
+        for r in rows or []:
+            if not isinstance(r, dict):
+                continue
+            cj = r.get("_client_json") or {}
+            uid = str(r.get("client_id") or cj.get("userid") or cj.get("client_id") or "").strip()
+            if not uid and r.get("name"):
+                hit = client_registry.by_name(r["name"], self.name)
+                uid = str((hit[1].get("userid") or hit[1].get("client_id") or "") if hit else "").strip()
+            if uid:
+                ids.append(uid)
+        return ids
+
+    def _write(self, fn: str, rows):
+        try:
+            return self._call(fn, rows)
+        finally:
+            snapshot_cache.invalidate(self.name, self._client_ids(rows))
+
+    def has(self, fn: str) -> bool:
+        return callable(getattr(self.module, fn, None))
+
+    def fn(self, fn: str):
+        """Raw module function (or None) — for per-client fan-out tasks."""
+        f = getattr(self.module, fn, None)
+        return f if callable(f) else None
+
+    # ---- interface ----
+    def place_orders(self, orders):     return self._write("place_orders", orders)
+    def cancel_orders(self, orders):    return self._write("cancel_orders", orders)
+    def modify_orders(self, orders):    return self._write("modify_orders", orders)
+    def get_orders(self):               return self._call("get_orders")
+    def get_positions(self):            return self._call("get_positions")
+    def get_holdings(self):             return self._call("get_holdings")
+    def close_positions(self, rows):    return self._write("close_positions", rows)
+
+    # ---- optional ----
+    def login(self, client):            return self._call("login", client)
+
+    def list_clients(self) -> List[Dict[str, Any]]:
+        return self._call("list_clients") if self.has("list_clients") else []
+
+
+class BrokerRegistry:
+    def __init__(self, modules: Dict[str, str]):
+        self.modules = dict(modules)
+        self._lock = threading.RLock()
+        self._adapters: Dict[str, ModuleBrokerAdapter] = {}
+        self._errors: Dict[str, str] = {}
+
+    def _load_one(self, broker: str, reload: bool = False) -> None:
+        mod_name = self.modules[broker]
+        try:
+            cur = self._adapters.get(broker)
+            if reload and cur is not None:
+                saved = {k: getattr(cur.module, k) for k in _PRESERVE if hasattr(cur.module, k)}
+                mod = importlib.reload(cur.module)
+                for k, v in saved.items():
+                    if isinstance(getattr(mod, k, None), dict) and isinstance(v, dict):
+                        getattr(mod, k).update(v)
+            else:
+                mod = importlib.import_module(mod_name)
+            adapter = ModuleBrokerAdapter(broker, mod)
+            self._adapters[broker] = adapter
+            self._errors.pop(broker, None)
+            if adapter.missing:
+                print(f"[brokers] {mod_name} missing: {', '.join(adapter.missing)}", flush=True)
+        except ModuleNotFoundError as e:
+            self._errors[broker] = f"missing: {e}"
+            print(f"[brokers] {mod_name} not found: {e}", flush=True)
+        except Exception as e:
+            self._errors[broker] = f"error: {e}"
+            print(f"[brokers] {mod_name} load error: {e}", flush=True)
+
+    def load(self) -> None:
+        """Import every broker module once (no-op for already loaded ones)."""
+        with self._lock:
+            for brk in self.modules:
+                if brk not in self._adapters:
+                    self._load_one(brk)
+
+    def reload(self, broker: Optional[str] = None) -> Dict[str, str]:
+        """Explicit hot reload of one broker (or all). Returns status()."""
+        with self._lock:
+            targets = [broker] if broker else list(self.modules)
+            for brk in targets:
+                if brk not in self.modules:
+                    raise KeyError(brk)
+                self._load_one(brk, reload=True)
+            return self.status()
+
+    def get(self, broker: str) -> ModuleBrokerAdapter:
+        brk = (broker or "").lower()
+        adapter = self._adapters.get(brk)
+        if adapter is None:
+            with self._lock:
+                if brk not in self._adapters and brk in self.modules:
+                    self._load_one(brk)
+                adapter = self._adapters.get(brk)
+        if adapter is None:
+            raise LookupError(self._errors.get(brk) or f"Unknown broker '{broker}'")
+        return adapter
+
+    def items(self):
+        self.load()
+        return [(brk, self._adapters[brk]) for brk in self.modules if brk in self._adapters]
+
+    def status(self) -> Dict[str, str]:
+        out: Dict[str, str] = {}
+        for brk in self.modules:
+            if brk in self._adapters:
+                miss = self._adapters[brk].missing
+                out[brk] = "ready" if not miss else "incomplete: " + ", ".join(miss)
+            else:
+                out[brk] = self._errors.get(brk, "not loaded")
+        return out
+
+
+broker_registry = BrokerRegistry(BROKER_MODULES)
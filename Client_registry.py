@@ -0,0 +1,240 @@
+# Client_registry.py
+"""
+Process-wide in-memory index of data/clients/{dhan,motilal}/*.json.
+
+Loaded once, then kept coherent two ways:
+  - write-through: the router calls upsert_path()/forget_path() right after it
+    writes or deletes a client file (_save, _update_minimal, _delete_client_file)
+  - an mtime watcher thread that picks up edits made behind our back
+    (GitHub sync-down, manual edits, Broker_dhan._save_access_token).
+
+Lookups are O(1) by (broker, userid), by userid and by lower-cased display name.
+All getters return shallow copies so callers can't mutate the index.
+`version` increases on every index change, so derived caches (Group_plans)
+can tell when their resolved clients may be stale.
+"""
+import os, json, threading, time
+from typing import Any, Dict, List, Optional, Tuple
+
+BROKERS = ("dhan", "motilal")
+REGISTRY_POLL_S = float(os.getenv("CLIENT_REGISTRY_POLL_S", "2"))
+
+
+def _uid_of(doc: Dict[str, Any]) -> str:
+    return str(doc.get("userid") or doc.get("client_id") or "").strip()
+
+
+def _name_key(doc: Dict[str, Any]) -> str:
+    return (doc.get("name") or doc.get("display_name") or "").strip().lower()
+
+
+class ClientRegistry:
+    def __init__(self, base_dir: str):
+        self.base_dir = os.path.abspath(base_dir)
+        self.dirs = {brk: os.path.join(self.base_dir, "clients", brk) for brk in BROKERS}
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._docs: Dict[Tuple[str, str], Dict[str, Any]] = {}        # (broker, uid) -> doc
+        self._by_userid: Dict[str, Tuple[str, str]] = {}               # uid -> (broker, uid)
+        self._by_name: Dict[str, List[Tuple[str, str]]] = {}           # lower name -> [(broker, uid)]
+        self._by_path: Dict[str, Tuple[str, str]] = {}                 # abs path -> (broker, uid)
+        self._mtimes: Dict[str, float] = {}                            # abs path -> mtime
+        self._watcher: Optional[threading.Thread] = None
+        self.version = 0
+
+    # ---------- index maintenance ----------
+    def _broker_for_path(self, path: str) -> Optional[str]:
+        folder = os.path.dirname(os.path.abspath(path))
+        for brk, d in self.dirs.items():
+            if folder == d:
+                return brk
+        return None
+
+    def _unindex(self, key: Tuple[str, str]) -> None:
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        if self._by_userid.get(key[1]) == key:
+            self._by_userid.pop(key[1], None)
+            # another broker may hold the same userid
+            for other in self._docs:
+                if other[1] == key[1]:
+                    self._by_userid[key[1]] = other
+                    break
+        nk = _name_key(doc)
+        lst = self._by_name.get(nk)
+        if lst and key in lst:
+            lst.remove(key)
+            if not lst:
+                self._by_name.pop(nk, None)
+
+    def _index(self, broker: str, path: str, doc: Dict[str, Any]) -> None:
+        path = os.path.abspath(path)
+        old = self._by_path.pop(path, None)
+        if old:
+            self._unindex(old)
+        uid = _uid_of(doc)
+        if not uid:
+            return
+        key = (broker, uid)
+        self._unindex(key)
+        self.version += 1
+        self._docs[key] = doc
+        self._by_path[path] = key
+        # dhan wins a userid/name tie, matching the old dhan-then-motilal scans
+        cur = self._by_userid.get(uid)
+        if cur is None or BROKERS.index(broker) <= BROKERS.index(cur[0]):
+            self._by_userid[uid] = key
+        lst = self._by_name.setdefault(_name_key(doc), [])
+        lst.append(key)
+        lst.sort(key=lambda k: BROKERS.index(k[0]))
+
+    def _load_file(self, broker: str, path: str) -> None:
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except Exception:
+            return
+        if isinstance(doc, dict):
+            self._index(broker, path, doc)
+            self._mtimes[os.path.abspath(path)] = mtime
+
+    def _drop_path(self, path: str) -> None:
+        path = os.path.abspath(path)
+        key = self._by_path.pop(path, None)
+        self._mtimes.pop(path, None)
+        if key:
+            self._unindex(key)
+            self.version += 1
+
+    def reload(self) -> None:
+        """Full rescan of both client folders."""
+        with self._lock:
+            self._docs.clear(); self._by_userid.clear(); self._by_name.clear()
+            self._by_path.clear(); self._mtimes.clear()
+            self.version += 1
+            for brk, folder in self.dirs.items():
+                try:
+                    for fn in os.listdir(folder):
+                        if fn.endswith(".json"):
+                            self._load_file(brk, os.path.join(folder, fn))
+                except FileNotFoundError:
+                    pass
+            self._loaded = True
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.reload()
+
+    # ---------- write-through hooks ----------
+    def upsert_path(self, path: str, doc: Optional[Dict[str, Any]] = None) -> None:
+        """Call after writing a client file. Non-client paths are ignored."""
+        brk = self._broker_for_path(path)
+        if not brk:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            if doc is None:
+                self._load_file(brk, path)
+                return
+            self._index(brk, path, dict(doc))
+            try:
+                self._mtimes[os.path.abspath(path)] = os.path.getmtime(path)
+            except OSError:
+                pass
+
+    def forget_path(self, path: str) -> None:
+        """Call after deleting a client file."""
+        if not self._broker_for_path(path):
+            return
+        with self._lock:
+            self._ensure_loaded()
+            self._drop_path(path)
+
+    # ---------- watcher ----------
+    def sync_from_disk(self) -> int:
+        """Re-read files whose mtime changed, drop vanished ones. Returns #changes."""
+        changes = 0
+        with self._lock:
+            self._ensure_loaded()
+            seen = set()
+            for brk, folder in self.dirs.items():
+                try:
+                    names = os.listdir(folder)
+                except FileNotFoundError:
+                    continue
+                for fn in names:
+                    if not fn.endswith(".json"):
+                        continue
+                    path = os.path.abspath(os.path.join(folder, fn))
+                    seen.add(path)
+                    try:
+                        mtime = os.path.getmtime(path)
+                    except OSError:
+                        continue
+                    if self._mtimes.get(path) != mtime:
+                        self._load_file(brk, path)
+                        changes += 1
+            for path in [p for p in self._mtimes if p not in seen]:
+                self._drop_path(path)
+                changes += 1
+        return changes
+
+    def start_watcher(self, interval_s: float = REGISTRY_POLL_S) -> None:
+        if self._watcher and self._watcher.is_alive():
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval_s)
+                try:
+                    self.sync_from_disk()
+                except Exception as e:
+                    print(f"[registry] watcher error: {e}", flush=True)
+
+        self._watcher = threading.Thread(target=_loop, name="client-registry-watch", daemon=True)
+        self._watcher.start()
+
+    # ---------- lookups ----------
+    def get(self, broker: str, userid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            doc = self._docs.get(((broker or "").lower(), str(userid or "").strip()))
+            return dict(doc) if doc is not None else None
+
+    def by_userid(self, userid: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(broker, doc) for a userid, or None."""
+        with self._lock:
+            self._ensure_loaded()
+            key = self._by_userid.get(str(userid or "").strip())
+            return (key[0], dict(self._docs[key])) if key else None
+
+    def by_name(self, name: str, broker: Optional[str] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """(broker, doc) for a display name (case-insensitive), optionally within one broker."""
+        needle = str(name or "").strip().lower()
+        if not needle:
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            for key in self._by_name.get(needle, []):
+                if broker is None or key[0] == broker:
+                    return key[0], dict(self._docs[key])
+        return None
+
+    def broker_of_name(self, name: str) -> Optional[str]:
+        hit = self.by_name(name)
+        return hit[0] if hit else None
+
+    def clients(self, broker: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(d) for (brk, _uid), d in self._docs.items() if brk == broker]
+
+    def all(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            self._ensure_loaded()
+            return [(brk, dict(d)) for (brk, _uid), d in self._docs.items()]
+
+
+client_registry = ClientRegistry(os.environ.get("DATA_DIR", "./data"))
@@ -0,0 +1,491 @@
+# Copy_trading.py
+"""
+Copy-trading replication: mirror each enabled setup's master orders onto its
+child accounts.
+
+Setups (copy_setups/*.json: master, children, multipliers, enabled) are
+compiled into an in-memory index by master client id, so an order event for
+any account costs one dict lookup and only masters go further.
+
+Detection: order pushes from the Dhan order-update feed and Motilal
+TradeStatus (order store listeners). A master whose feed is not live is
+polled every COPY_POLL_S through its broker's copy_master_orders().
+
+For every master order the engine keeps the last state it acted on and the
+child orders it placed, so a push and a poll of the same state do nothing
+twice:
+  new open/filled order     -> place child orders (all at once: brokers in
+                               parallel, each child on its dispatcher lane)
+  price/qty/type changed    -> modify the child orders
+  cancelled                 -> cancel the child orders
+Events for one master run in order on that master's lane; masters don't wait
+for each other. Orders already on the book when a master starts being
+watched (baseline) and the child orders the engine placed are ignored;
+nothing is copied for a master until its baseline read has succeeded (pushes
+before that are dropped; the poll loop keeps retrying the read). Master
+orders evicted from the COPY_HISTORY window join the baseline, so a later
+poll never sees them as new.
+
+Child quantity = master quantity x multiplier, rounded down to the
+instrument's lot (Instrument_cache); under one lot the child is skipped.
+Dhan takes shares, Motilal place takes lots.
+
+Latency per setup runs from detecting the master event to the last child
+acknowledgement: latency_ms {last, p50, p95, max} over the last
+COPY_LATENCY_WINDOW mirrored events. COPY_TRADING=0 disables the engine.
+"""
+import os, threading, time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from Broker_registry import broker_registry
+from Client_registry import client_registry
+from Dhan_order_feed import order_store as dhan_order_store
+from Instrument_cache import instrument_cache
+from Motilal_order_feed import order_store as motilal_order_store
+from Order_dispatch import OrderDispatcher
+
+COPY_ENABLED        = os.getenv("COPY_TRADING", "1") == "1"
+COPY_POLL_S         = float(os.getenv("COPY_POLL_S", "0.5"))
+COPY_WORKERS        = int(os.getenv("COPY_WORKERS", "16"))
+COPY_LATENCY_WINDOW = int(os.getenv("COPY_LATENCY_WINDOW", "200"))
+COPY_HISTORY        = int(os.getenv("COPY_HISTORY", "2000"))     # master orders remembered per master
+
+_STORES = {"dhan": dhan_order_store, "motilal": motilal_order_store}
+_LOT_QTY = ("motilal",)                       # brokers whose place_orders qty is in lots
+_MODIFY_FIELDS = ("qty", "price", "triggerprice", "ordertype")
+
+
+class Child(NamedTuple):
+    client_id: str
+    broker: str
+    name: str
+    multiplier: float
+
+
+class CopySetup:
+    """One setup doc with its master and children resolved through the client registry."""
+
+    def __init__(self, doc: Dict[str, Any]):
+        self.id = str(doc.get("id") or doc.get("name") or "")
+        self.name = str(doc.get("name") or self.id)
+        self.master = str(doc.get("master") or "").strip()
+        self.enabled = bool(doc.get("enabled", False))
+        hit = client_registry.by_userid(self.master) if self.master else None
+        self.master_broker = hit[0] if hit else ""
+        self.master_json = hit[1] if hit else None
+
+        mults = doc.get("multipliers") or {}
+        children: List[Child] = []
+        missing: List[str] = []
+        for raw in doc.get("children") or []:
+            uid = str(raw or "").strip()
+            if not uid or uid == self.master:
+                continue
+            h = client_registry.by_userid(uid)
+            if not h:
+                missing.append(uid)
+                continue
+            try:
+                m = float(mults.get(uid, 1))
+            except (TypeError, ValueError):
+                m = 1.0
+            children.append(Child(uid, h[0], h[1].get("name") or h[1].get("display_name") or uid, m))
+        self.children: Tuple[Child, ...] = tuple(children)
+        self.missing: Tuple[str, ...] = tuple(missing)
+
+
+class _Mirror:
+    """A master order: the state last acted on and its child orders."""
+    __slots__ = ("state", "children")
+
+    def __init__(self, state: Dict[str, Any]):
+        self.state = state
+        # (setup id, child id) -> (broker, child name, child order id)
+        self.children: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+
+
+def _order_id_of(resp: Any) -> str:
+    """Child order id from a place_orders response row, "" when it failed."""
+    if not isinstance(resp, dict):
+        return ""
+    if str(resp.get("status") or "").upper() == "ERROR" or resp.get("errorType"):
+        return ""
+    data = resp.get("data") if isinstance(resp.get("data"), dict) else {}
+    return str(resp.get("orderId") or resp.get("uniqueorderid") or data.get("uniqueorderid") or "")
+
+
+def _pct(sorted_ms: List[float], p: float) -> Optional[float]:
+    if not sorted_ms:
+        return None
+    return sorted_ms[min(len(sorted_ms) - 1, int(p * len(sorted_ms)))]
+
+
+class CopyEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs: Dict[str, Dict[str, Any]] = {}                  # setup id -> doc
+        self._setups: Dict[str, CopySetup] = {}                     # setup id -> compiled (enabled only)
+        self._by_master: Dict[str, Dict[str, CopySetup]] = {}       # master id -> setup id -> setup
+        self._mirrors: Dict[str, "OrderedDict[str, _Mirror]"] = {}  # master id -> master order id -> mirror
+        self._baseline: Dict[str, Set[str]] = {}                    # master id -> order ids to ignore
+        self._own: Set[str] = set()                                 # child order ids placed by the engine
+        self._polling: Set[str] = set()
+        self._stats: Dict[str, Dict[str, Any]] = {}                 # setup id -> counters / latency
+        self._version = -1
+        self._lanes = OrderDispatcher("copy", COPY_WORKERS)         # one lane per master
+        self._send_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="copy-send")
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- setups ----------
+    def load(self, docs: List[Dict[str, Any]]) -> None:
+        """Replace every setup (startup / after a sync-down)."""
+        with self._lock:
+            self._docs = {str(d.get("id") or d.get("name")): dict(d) for d in docs or [] if isinstance(d, dict)}
+        self._rebuild()
+
+    def put(self, doc: Dict[str, Any]) -> None:
+        """A setup was created, edited, enabled or disabled."""
+        with self._lock:
+            self._docs[str(doc.get("id") or doc.get("name"))] = dict(doc)
+        self._rebuild()
+
+    def drop(self, setup_id: str) -> None:
+        with self._lock:
+            self._docs.pop(str(setup_id), None)
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        with self._lock:
+            docs = list(self._docs.values())
+            version = client_registry.version
+        setups: Dict[str, CopySetup] = {}
+        by_master: Dict[str, Dict[str, CopySetup]] = {}
+        for d in docs:
+            if not d.get("enabled"):
+                continue
+            s = CopySetup(d)
+            if not s.master_broker:
+                print(f"[copy] {s.name}: master {s.master} not found", flush=True)
+                continue
+            setups[s.id] = s
+            by_master.setdefault(s.master, {})[s.id] = s
+        with self._lock:
+            new = [m for m in by_master if m not in self._by_master]
+            for m in self._by_master:
+                if m not in by_master:
+                    self._mirrors.pop(m, None)
+                    self._baseline.pop(m, None)
+            self._setups, self._by_master = setups, by_master
+            self._version = version
+            for sid in setups:
+                self._stats.setdefault(sid, {"placed": 0, "modified": 0, "cancelled": 0, "failed": 0,
+                                             "skipped": 0, "events": 0, "latency": deque(maxlen=COPY_LATENCY_WINDOW),
+                                             "last_event": None, "last_error": None})
+        for m in new:
+            self._lanes.submit(m, self._ensure_baseline, m)
+        if docs:
+            print(f"[copy] {len(setups)} enabled setup(s), {len(by_master)} master(s)", flush=True)
+
+    # ---------- detection ----------
+    def start(self, docs: List[Dict[str, Any]]) -> None:
+        """Load setups, listen to the order feeds and start the poll fallback."""
+        if not COPY_ENABLED:
+            print("[copy] disabled (COPY_TRADING=0)", flush=True)
+            return
+        self.load(docs)
+        if self._thread is not None:
+            return
+        for brk, store in _STORES.items():
+            store.add_listener(lambda uid, order, _b=brk: self.on_order(_b, uid, order))
+        self._thread = threading.Thread(target=self._poll_loop, name="copy-poll", daemon=True)
+        self._thread.start()
+
+    def on_order(self, broker: str, uid: str, raw: Dict[str, Any]) -> None:
+        """Order store listener (feed thread): only masters get past the index lookup."""
+        if uid not in self._by_master:
+            return
+        self._lanes.submit(uid, self._on_push, broker, uid, raw, time.perf_counter())
+
+    def _on_push(self, broker: str, uid: str, raw: Dict[str, Any], t0: float) -> None:
+        fn = broker_registry.get(broker).fn("copy_order")
+        if fn is None:
+            return
+        if uid not in self._baseline:
+            return                              # can't tell new from old yet: the poll loop takes the baseline
+        self._apply(uid, fn(raw), t0, "push")
+
+    def _poll_loop(self) -> None:
+        while True:
+            time.sleep(COPY_POLL_S)
+            try:
+                if client_registry.version != self._version:
+                    self._rebuild()
+                for uid, setups in list(self._by_master.items()):
+                    brk = next(iter(setups.values())).master_broker
+                    store = _STORES.get(brk)
+                    live = store is not None and store.live(uid) and uid in self._baseline
+                    if live or uid in self._polling:
+                        continue
+                    with self._lock:
+                        self._polling.add(uid)
+                    self._lanes.submit(uid, self._poll, uid)
+            except Exception as e:
+                print(f"[copy] poll loop error: {e}", flush=True)
+
+    def _master_orders(self, uid: str) -> List[Dict[str, Any]]:
+        setups = self._by_master.get(uid) or {}
+        s = next(iter(setups.values()), None)
+        if s is None:
+            return []
+        fn = broker_registry.get(s.master_broker).fn("copy_master_orders")
+        if fn is None:
+            raise RuntimeError(f"{s.master_broker} has no copy_master_orders")
+        return fn(s.master_json)
+
+    def _ensure_baseline(self, uid: str) -> bool:
+        """
+        First successful read of a master's book: what's there now is never
+        copied, and nothing is copied until it exists. True only when this
+        call took it.
+        """
+        if uid in self._baseline:
+            return False
+        try:
+            rows = self._master_orders(uid)
+        except Exception as e:
+            print(f"[copy] baseline for {uid} failed: {e}", flush=True)
+            return False
+        with self._lock:
+            self._baseline[uid] = {o["order_id"] for o in rows if o.get("order_id")}
+        return True
+
+    def _poll(self, uid: str) -> None:
+        t0 = time.perf_counter()
+        try:
+            if uid not in self._baseline:
+                self._ensure_baseline(uid)      # this read is the baseline, or it failed: copy nothing
+                return
+            for o in self._master_orders(uid):
+                self._apply(uid, o, t0, "poll")
+        except Exception as e:
+            print(f"[copy] poll {uid} failed: {e}", flush=True)
+        finally:
+            with self._lock:
+                self._polling.discard(uid)
+
+    # ---------- replication (runs on the master's lane) ----------
+    def _apply(self, uid: str, o: Dict[str, Any], t0: float, via: str) -> None:
+        oid = o.get("order_id") or ""
+        baseline = self._baseline.get(uid)
+        if baseline is None:
+            return                              # no successful snapshot yet: can't tell new from old
+        if not oid or oid in self._own or oid in baseline:
+            return
+        setups = list((self._by_master.get(uid) or {}).values())
+        if not setups:
+            return
+        mirrors = self._mirrors.setdefault(uid, OrderedDict())
+        mirror = mirrors.get(oid)
+        if mirror is None:
+            mirror = mirrors[oid] = _Mirror(o)
+            while len(mirrors) > COPY_HISTORY:
+                old, _m = mirrors.popitem(last=False)
+                baseline.add(old)               # forget its state, never copy it again
+            if o["status"] in ("open", "filled"):
+                self._place(setups, o, mirror, t0, via)
+            return
+
+        prev, mirror.state = mirror.state, o
+        if o["status"] == "cancelled" and prev["status"] != "cancelled":
+            self._cancel(setups, o, mirror, t0, via)
+        elif o["status"] == "open" and any(o[k] != prev[k] for k in _MODIFY_FIELDS):
+            self._modify(setups, o, mirror, t0, via)
+
+    def _child_qty(self, o: Dict[str, Any], child: Child) -> Tuple[int, int]:
+        """(shares, lot) for one child; shares is 0 under one lot."""
+        lot = max(1, int(instrument_cache.lot_size(o["security_id"], o["exchange"]) or 1))
+        shares = int(round(o["qty"] * child.multiplier, 6) // lot) * lot
+        return shares, lot
+
+    def _send(self, fn: str, by_broker: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """broker_registry.get(b).<fn>(rows) for every broker at once -> {broker: result | Exception}."""
+        def _one(brk: str, rows: List[Dict[str, Any]]) -> Any:
+            try:
+                return getattr(broker_registry.get(brk), fn)(rows)
+            except Exception as e:
+                return e
+        if len(by_broker) == 1:
+            (brk, rows), = by_broker.items()
+            return {brk: _one(brk, rows)}
+        futs = {brk: self._send_pool.submit(_one, brk, rows) for brk, rows in by_broker.items()}
+        return {brk: f.result() for brk, f in futs.items()}
+
+    def _place(self, setups: List[CopySetup], o: Dict[str, Any], mirror: _Mirror, t0: float, via: str) -> None:
+        legs: List[Tuple[CopySetup, Child, Dict[str, Any]]] = []
+        by_broker: Dict[str, List[Dict[str, Any]]] = {}
+        for i, s in enumerate(setups):
+            for ch in s.children:
+                shares, lot = self._child_qty(o, ch)
+                if shares <= 0:
+                    self._count(s, "skipped", f"{ch.name}: {o['qty']} x {ch.multiplier} is under one lot ({lot})")
+                    continue
+                row = {
+                    "client_id": ch.client_id, "name": ch.name, "broker": ch.broker,
+                    "action": o["action"], "ordertype": o["ordertype"], "producttype": o["producttype"],
+                    "orderduration": o["orderduration"], "exchange": o["exchange"],
+                    "price": o["price"], "triggerprice": o["triggerprice"],
+                    "disclosedquantity": 0, "amoorder": "N",
+                    "qty": shares // lot if ch.broker in _LOT_QTY else shares,
+                    "tag": f"CT{i}", "correlation_id": f"COPY{mirror.state['order_id']}"[:25],
+                    "symbol": o["symbol"], "security_id": o["security_id"],
+                    "symboltoken": o["security_id"], "stock_symbol": o["symbol"],
+                }
+                legs.append((s, ch, row))
+                by_broker.setdefault(ch.broker, []).append(row)
+        if not legs:
+            return
+
+        results = self._send("place_orders", by_broker)
+        placed = 0
+        for s, ch, row in legs:
+            res = results.get(ch.broker)
+            resp = (res.get("order_responses") or {}).get(f"{row['tag']}:{ch.client_id}") if isinstance(res, dict) else res
+            coid = _order_id_of(resp)
+            if coid:
+                placed += 1
+                mirror.children[(s.id, ch.client_id)] = (ch.broker, ch.name, coid)
+                with self._lock:
+                    self._own.add(coid)
+                self._count(s, "placed")
+            else:
+                err = resp.get("message") or resp.get("errorMessage") if isinstance(resp, dict) else resp
+                self._count(s, "failed", f"place {ch.name}: {err or 'no order id'}")
+        self._done(setups, "place", o, t0, via, placed, len(legs))
+
+    def _modify(self, setups: List[CopySetup], o: Dict[str, Any], mirror: _Mirror, t0: float, via: str) -> None:
+        legs: List[Tuple[CopySetup, Dict[str, Any]]] = []
+        by_broker: Dict[str, List[Dict[str, Any]]] = {}
+        for s in setups:
+            for ch in s.children:
+                link = mirror.children.get((s.id, ch.client_id))
+                if not link:
+                    continue
+                shares, _lot = self._child_qty(o, ch)
+                row = {
+                    "name": ch.name, "client_id": ch.client_id, "order_id": link[2],
+                    "orderType": o["ordertype"], "price": o["price"], "triggerPrice": o["triggerprice"],
+                    "quantity": shares or None, "validity": o["orderduration"],
+                    "_client_json": client_registry.get(ch.broker, ch.client_id) or {},
+                }
+                legs.append((s, row))
+                by_broker.setdefault(ch.broker, []).append(row)
+        if not legs:
+            return
+
+        results = self._send("modify_orders", by_broker)
+        msgs: Dict[int, str] = {}
+        for brk, rows in by_broker.items():
+            res = results.get(brk)
+            out = res.get("message") if isinstance(res, dict) else None
+            for row, m in zip(rows, out or [str(res)] * len(rows)):
+                msgs[id(row)] = str(m or "")
+        ok_n = 0
+        for s, row in legs:
+            m = msgs.get(id(row), "")
+            if m.startswith("✅"):
+                ok_n += 1
+                self._count(s, "modified")
+            else:
+                self._count(s, "failed", f"modify {row['name']}: {m or 'failed'}")
+        self._done(setups, "modify", o, t0, via, ok_n, len(legs))
+
+    def _cancel(self, setups: List[CopySetup], o: Dict[str, Any], mirror: _Mirror, t0: float, via: str) -> None:
+        legs: List[Tuple[CopySetup, Dict[str, Any]]] = []
+        by_broker: Dict[str, List[Dict[str, Any]]] = {}
+        by_id = {s.id: s for s in setups}
+        for (sid, _cid), (brk, name, coid) in mirror.children.items():
+            s = by_id.get(sid)
+            if s is None:
+                continue
+            row = {"name": name, "order_id": coid}
+            legs.append((s, row))
+            by_broker.setdefault(brk, []).append(row)
+        if not legs:
+            return
+
+        results = self._send("cancel_orders", by_broker)
+        msgs: Dict[int, str] = {}
+        for brk, rows in by_broker.items():
+            res = results.get(brk)
+            for row, m in zip(rows, res if isinstance(res, list) else [str(res)] * len(rows)):
+                msgs[id(row)] = str(m or "")
+        ok_n = 0
+        for s, row in legs:
+            m = msgs.get(id(row), "")
+            if m.startswith("✅"):
+                ok_n += 1
+                self._count(s, "cancelled")
+            else:
+                self._count(s, "failed", f"cancel {row['name']} {row['order_id']}: {m or 'failed'}")
+        self._done(setups, "cancel", o, t0, via, ok_n, len(legs))
+
+    # ---------- stats ----------
+    def _count(self, s: CopySetup, key: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            st = self._stats.get(s.id)
+            if st is None:
+                return
+            st[key] += 1
+            if error:
+                st["last_error"] = error
+        if error:
+            print(f"[copy] {s.name}: {error}", flush=True)
+
+    def _done(self, setups: List[CopySetup], action: str, o: Dict[str, Any], t0: float,
+              via: str, ok_n: int, total: int) -> None:
+        ms = round((time.perf_counter() - t0) * 1000, 1)
+        event = {"action": action, "master_order_id": o["order_id"], "symbol": o["symbol"],
+                 "via": via, "ok": ok_n, "children": total, "ms": ms, "at": time.time()}
+        with self._lock:
+            for s in setups:
+                st = self._stats.get(s.id)
+                if st is not None:
+                    st["events"] += 1
+                    st["latency"].append(ms)
+                    st["last_event"] = event
+        print(f"[copy] {o['order_id']} {action} {o['action']} {o['symbol']} x{o['qty']}: "
+              f"{ok_n}/{total} child order(s) in {ms} ms ({via})", flush=True)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            setups = list(self._setups.values())
+            stats = {k: dict(v, latency=list(v["latency"])) for k, v in self._stats.items()}
+            docs = list(self._docs.values())
+        rows = []
+        for s in setups:
+            st = stats.get(s.id) or {}
+            lat = sorted(st.pop("latency", []))
+            store = _STORES.get(s.master_broker)
+            rows.append({
+                "id": s.id, "name": s.name,
+                "master": s.master, "master_broker": s.master_broker,
+                "watch": "push" if store is not None and store.live(s.master) else "poll",
+                "children": len(s.children), "missing_children": list(s.missing),
+                **st,
+                "latency_ms": {"n": len(lat), "last": (st.get("last_event") or {}).get("ms"),
+                               "p50": _pct(lat, 0.5), "p95": _pct(lat, 0.95),
+                               "max": lat[-1] if lat else None},
+            })
+        return {
+            "enabled": COPY_ENABLED,
+            "poll_s": COPY_POLL_S,
+            "setups_total": len(docs),
+            "masters": len(self._by_master),
+            "lanes": self._lanes.status(),
+            "setups": rows,
+        }
+
+
+copy_engine = CopyEngine()
@@ -0,0 +1,58 @@
+# Dhan_fake_feed.py
+"""
+Local stand-in for Dhan's order-update WebSocket, for testing the order feed
+without a broker connection.
+
+    uvicorn Dhan_fake_feed:app --port 8765
+    DHAN_ORDER_WS_URL=ws://127.0.0.1:8765/ uvicorn MultiBroker_Router:app ...
+
+Clients connect to "/" and send the usual login message; a partner login
+receives updates for every account. POST /push with an order_alert "Data"
+object (OrderNo, Status, ClientId, ...) to send it to the matching
+connections; GET /sessions lists who is logged in.
+"""
+import asyncio, json
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from fastapi import Body, FastAPI, WebSocket, WebSocketDisconnect
+
+app = FastAPI(title="Fake Dhan order feed")
+
+_sessions: List[Tuple[str, WebSocket]] = []      # (client id or "*", socket)
+
+
+@app.websocket("/")
+async def feed(ws: WebSocket):
+    await ws.accept()
+    key = None
+    try:
+        login = json.loads(await ws.receive_text())
+        req = login.get("LoginReq") or {}
+        key = "*" if str(login.get("UserType") or "").upper() == "PARTNER" else str(req.get("ClientId") or "")
+        _sessions.append((key, ws))
+        print(f"[fake-feed] login {key}", flush=True)
+        while True:
+            await ws.receive_text()
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        if key is not None and (key, ws) in _sessions:
+            _sessions.remove((key, ws))
+
+
+@app.post("/push")
+async def push(data: Dict[str, Any] = Body(...)):
+    """Send one order update; Data.ClientId picks the account."""
+    data = dict(data)
+    data.setdefault("LastUpdatedTime", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    msg = json.dumps({"Type": "order_alert", "Data": data})
+    uid = str(data.get("ClientId") or "")
+    targets = [ws for key, ws in list(_sessions) if key in ("*", uid)]
+    results = await asyncio.gather(*(ws.send_text(msg) for ws in targets), return_exceptions=True)
+    return {"ok": True, "sent": sum(1 for r in results if not isinstance(r, Exception))}
+
+
+@app.get("/sessions")
+def sessions():
+    return {"ok": True, "sessions": [key for key, _ in _sessions]}
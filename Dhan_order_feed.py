@@ -0,0 +1,356 @@
+# Dhan_order_feed.py
+"""
+Live Dhan order updates (order-update WebSocket) into an in-memory store.
+
+DhanOrderStore keeps every known order keyed by orderId, in the same field
+names as GET /v2/orders (orderId, tradingSymbol, orderStatus, quantity ...),
+so readers don't care whether a row came from REST or from a push.
+add_listener(fn) calls fn(client id, order) after every applied push (copy
+trading reacts to master orders this way); listeners must not block.
+
+A client is "live" once its feed's login is acknowledged (first message, or
+the socket still open DHAN_ORDER_FEED_LOGIN_GRACE_S after login: Dhan closes
+it on a bad login) and the store has been seeded by one REST order-book read
+after that (Broker_dhan.get_orders_for_client does the seeding). While live,
+order-book reads are served from the store, and live clients are reseeded
+over REST every DHAN_ORDER_FEED_RESEED_S in case a push was lost; a
+disconnect drops the client back to REST until the next seed.
+
+Feeds: one connection per account (UserType SELF, access token), or a single
+partner connection when DHAN_PARTNER_ID / DHAN_PARTNER_SECRET are set.
+DHAN_ORDER_WS_URL points at a fake feed (Dhan_fake_feed.py) for tests;
+DHAN_ORDER_FEED=0 disables it.
+"""
+import json, os, threading, time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import websocket  # websocket-client
+
+DHAN_ORDER_WS_URL  = os.getenv("DHAN_ORDER_WS_URL", "wss://api-order-update.dhan.co")
+DHAN_PARTNER_ID     = os.getenv("DHAN_PARTNER_ID", "")
+DHAN_PARTNER_SECRET = os.getenv("DHAN_PARTNER_SECRET", "")
+FEED_ENABLED        = os.getenv("DHAN_ORDER_FEED", "1") == "1"
+FEED_SYNC_S         = float(os.getenv("DHAN_ORDER_FEED_SYNC_S", "30"))
+RECONNECT_MAX_S     = float(os.getenv("DHAN_ORDER_FEED_RECONNECT_MAX_S", "60"))
+LOGIN_GRACE_S       = float(os.getenv("DHAN_ORDER_FEED_LOGIN_GRACE_S", "3"))
+RESEED_S            = float(os.getenv("DHAN_ORDER_FEED_RESEED_S", "300"))
+
+_TXN     = {"B": "BUY", "S": "SELL"}
+_OTYPE   = {"LMT": "LIMIT", "MKT": "MARKET", "SL": "STOP_LOSS", "SLM": "STOP_LOSS_MARKET"}
+_PRODUCT = {"C": "CNC", "I": "INTRADAY", "M": "MARGIN", "F": "MTF", "V": "CO", "B": "BO"}
+
+
+def _status(raw: Any) -> str:
+    s = str(raw or "").strip().upper().replace(" ", "_").replace("-", "_")
+    return {"MODIFIED": "PENDING", "PARTTRADED": "PART_TRADED", "TRIGGERED": "PENDING"}.get(s, s)
+
+
+def order_from_update(d: Dict[str, Any]) -> Dict[str, Any]:
+    """order_alert Data -> REST /v2/orders field names."""
+    return {
+        "dhanClientId":       str(d.get("ClientId") or ""),
+        "orderId":            str(d.get("OrderNo") or ""),
+        "correlationId":      d.get("CorrelationId") or "",
+        "orderStatus":        _status(d.get("Status")),
+        "transactionType":    _TXN.get(str(d.get("TxnType") or "").upper(), d.get("TxnType") or ""),
+        "exchange":           d.get("Exchange") or "",
+        "productType":        d.get("ProductName") or _PRODUCT.get(str(d.get("Product") or "").upper(), d.get("Product") or ""),
+        "orderType":          _OTYPE.get(str(d.get("OrderType") or "").upper(), d.get("OrderType") or ""),
+        "validity":           d.get("Validity") or "",
+        "tradingSymbol":      d.get("Symbol") or d.get("DisplayName") or "",
+        "securityId":         str(d.get("SecurityId") or ""),
+        "quantity":           d.get("Quantity"),
+        "disclosedQuantity":  d.get("DiscQuantity"),
+        "price":              d.get("Price"),
+        "triggerPrice":       d.get("TriggerPrice"),
+        "filledQty":          d.get("TradedQty"),
+        "remainingQuantity":  d.get("RemainingQuantity"),
+        "averageTradedPrice": d.get("AvgTradedPrice"),
+        "omsErrorDescription": d.get("ReasonDescription") or "",
+        "updateTime":         d.get("LastUpdatedTime") or d.get("ExchOrderTime") or "",
+    }
+
+
+class DhanOrderStore:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._orders: Dict[str, Dict[str, Any]] = {}          # orderId -> order
+        self._by_client: Dict[str, Set[str]] = {}             # client id -> orderIds
+        self._connected: Dict[str, Any] = {}                  # client id -> feed that is up for it
+        self._seeded: Set[str] = set()
+        self._pushed: Dict[str, float] = {}                   # orderId -> monotonic time of last push
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.stats = {"updates": 0, "stale": 0, "seeds": 0}
+
+    def add_listener(self, fn: Callable[[str, Dict[str, Any]], None]) -> None:
+        self._listeners.append(fn)
+
+    def _notify(self, uid: str, order: Dict[str, Any]) -> None:
+        for fn in list(self._listeners):
+            try:
+                fn(uid, order)
+            except Exception as e:
+                print(f"[dhan-feed] listener error: {e}", flush=True)
+
+    def _put(self, uid: str, order: Dict[str, Any]) -> bool:
+        oid = str(order.get("orderId") or "")
+        if not oid:
+            return False
+        cur = self._orders.get(oid)
+        if cur is not None and str(cur.get("updateTime") or "") > str(order.get("updateTime") or ""):
+            self.stats["stale"] += 1
+            return False
+        merged = dict(cur or {})
+        merged.update({k: v for k, v in order.items() if v not in (None, "")})
+        merged["dhanClientId"] = uid
+        self._orders[oid] = merged
+        self._by_client.setdefault(uid, set()).add(oid)
+        return True
+
+    # ---------- writers ----------
+    def apply_update(self, data: Dict[str, Any], uid: Optional[str] = None) -> Optional[str]:
+        """One order_alert payload. Returns the orderId applied, if any."""
+        order = order_from_update(data)
+        uid = str(order.get("dhanClientId") or uid or "")
+        with self._cond:
+            ok = self._put(uid, order)
+            if ok:
+                self._pushed[order["orderId"]] = time.monotonic()
+                merged = dict(self._orders[order["orderId"]])
+            self.stats["updates"] += 1
+            self._cond.notify_all()
+        if ok and self._listeners:
+            self._notify(uid, merged)
+        return order["orderId"] if ok else None
+
+    def apply_rest(self, uid: str, orders: Iterable[Dict[str, Any]]) -> None:
+        """
+        Seed/refresh from GET /v2/orders. The REST book replaces the client's
+        orders (yesterday's are gone), except ones pushed in the last few
+        seconds, which the REST read may have raced; a newer pushed version wins.
+        """
+        uid = str(uid)
+        with self._cond:
+            seen = set()
+            for o in orders or []:
+                if isinstance(o, dict):
+                    self._put(uid, dict(o))
+                    seen.add(str(o.get("orderId") or ""))
+            recent = time.monotonic() - 5.0
+            for oid in list(self._by_client.get(uid, ())):
+                if oid not in seen and self._pushed.get(oid, 0.0) < recent:
+                    self._by_client[uid].discard(oid)
+                    self._orders.pop(oid, None)
+                    self._pushed.pop(oid, None)
+            if uid in self._connected or "*" in self._connected:
+                self._seeded.add(uid)
+            self.stats["seeds"] += 1
+            self._cond.notify_all()
+
+    def set_connected(self, uid: str, up: bool, feed: Any = None) -> None:
+        """
+        uid "*" is the partner connection, which covers every account. A feed
+        going down only clears the uid if it is still the feed that is up for
+        it (a replaced feed closing late must not drop its successor).
+        """
+        with self._cond:
+            if up:
+                self._connected[uid] = feed
+            elif uid in self._connected and (feed is None or self._connected[uid] is feed):
+                del self._connected[uid]
+                # pushes may have been missed: reseed after reconnect
+                if uid == "*":
+                    self._seeded.clear()
+                else:
+                    self._seeded.discard(uid)
+
+    # ---------- readers ----------
+    def live(self, uid: str) -> bool:
+        uid = str(uid)
+        return (uid in self._connected or "*" in self._connected) and uid in self._seeded
+
+    def orders(self, uid: str) -> List[Dict[str, Any]]:
+        """The client's orders, newest update first (like the REST book)."""
+        with self._cond:
+            rows = [dict(self._orders[o]) for o in self._by_client.get(str(uid), ()) if o in self._orders]
+        rows.sort(key=lambda o: str(o.get("updateTime") or ""), reverse=True)
+        return rows
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            o = self._orders.get(str(order_id))
+            return dict(o) if o is not None else None
+
+    def wait_status(self, order_id: str, statuses: Iterable[str], timeout: float) -> Optional[str]:
+        """Block until the order reaches one of <statuses>; returns it, or None on timeout."""
+        want = {s.upper() for s in statuses}
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                st = str((self._orders.get(str(order_id)) or {}).get("orderStatus") or "").upper()
+                if st in want:
+                    return st
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self._cond.wait(left)
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"orders": len(self._orders), "clients": len(self._by_client),
+                    "connected": sorted(self._connected), "live": sorted(u for u in self._seeded if self.live(u)),
+                    **self.stats}
+
+
+order_store = DhanOrderStore()
+
+
+class _Feed:
+    """One order-update connection (an account, or the partner login)."""
+
+    def __init__(self, key: str, login: Dict[str, Any]):
+        self.key = key                    # client id, or "*" for the partner login
+        self.login = login
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._ws: Optional[websocket.WebSocketApp] = None
+        self._up: Optional[websocket.WebSocketApp] = None     # connection whose login was acknowledged
+        self.thread = threading.Thread(target=self._run, name=f"dhan-feed-{key}", daemon=True)
+        self.thread.start()
+
+    def _on_open(self, ws) -> None:
+        ws.send(json.dumps(self.login))
+        t = threading.Timer(LOGIN_GRACE_S, self._login_acked, (ws,))
+        t.daemon = True
+        t.start()
+
+    def _login_acked(self, ws) -> None:
+        """First message, or the socket outlived the login grace: the feed is usable."""
+        with self._lock:
+            if self._ws is not ws or self._up is ws or self._stop.is_set():
+                return
+            self._up = ws
+            order_store.set_connected(self.key, True, self)
+        print(f"[dhan-feed] {self.key} connected", flush=True)
+
+    def _on_message(self, ws, message) -> None:
+        if self._up is not ws:
+            self._login_acked(ws)
+        try:
+            msg = json.loads(message)
+        except Exception:
+            return
+        if isinstance(msg, dict) and str(msg.get("Type") or "").lower() == "order_alert":
+            order_store.apply_update(msg.get("Data") or {}, None if self.key == "*" else self.key)
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            ws = websocket.WebSocketApp(DHAN_ORDER_WS_URL, on_open=self._on_open,
+                                        on_message=self._on_message)
+            with self._lock:
+                self._ws = ws
+            t0 = time.monotonic()
+            try:
+                ws.run_forever(ping_interval=20, ping_timeout=10)
+            except Exception as e:
+                print(f"[dhan-feed] {self.key} error: {e}", flush=True)
+            with self._lock:
+                self._ws = self._up = None
+                order_store.set_connected(self.key, False, self)
+            if self._stop.is_set():
+                return
+            backoff = 1.0 if time.monotonic() - t0 > 60 else min(RECONNECT_MAX_S, backoff * 2)
+            self._stop.wait(backoff)
+
+    def stop(self) -> None:
+        self._stop.set()
+        try:
+            if self._ws is not None:
+                self._ws.close()
+        except Exception:
+            pass
+
+
+class DhanOrderFeed:
+    """Keeps one feed per Dhan account (by current access token), or one partner feed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._feeds: Dict[str, _Feed] = {}
+        self._tokens: Dict[str, str] = {}
+        self._clients: Callable[[], List[Dict[str, Any]]] = lambda: []
+        self._reseed: Optional[Callable[[Dict[str, Any]], Any]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def sync(self) -> None:
+        """Start feeds for new accounts / changed tokens, stop removed ones."""
+        clients = {str(c.get("userid") or c.get("client_id") or "").strip(): c for c in self._clients()}
+        clients.pop("", None)
+        with self._lock:
+            if DHAN_PARTNER_ID and DHAN_PARTNER_SECRET:
+                if "*" not in self._feeds:
+                    login = {"LoginReq": {"MsgCode": 42, "ClientId": DHAN_PARTNER_ID},
+                             "UserType": "PARTNER", "Secret": DHAN_PARTNER_SECRET}
+                    self._feeds["*"] = _Feed("*", login)
+                return
+            for uid, c in clients.items():
+                token = (c.get("access_token") or "").strip()
+                if not token or self._tokens.get(uid) == token:
+                    continue
+                old = self._feeds.pop(uid, None)
+                if old:
+                    old.stop()
+                login = {"LoginReq": {"MsgCode": 42, "ClientId": uid, "Token": token}, "UserType": "SELF"}
+                self._feeds[uid] = _Feed(uid, login)
+                self._tokens[uid] = token
+            for uid in [u for u in self._feeds if u not in clients]:
+                self._feeds.pop(uid).stop()
+                self._tokens.pop(uid, None)
+
+    def reseed(self) -> int:
+        """REST-reseed every live client (pushes lost while connected are picked up)."""
+        n = 0
+        for c in self._clients():
+            uid = str(c.get("userid") or c.get("client_id") or "").strip()
+            if not uid or self._reseed is None or not order_store.live(uid):
+                continue
+            try:
+                self._reseed(c)
+                n += 1
+            except Exception as e:
+                print(f"[dhan-feed] reseed {uid} failed: {e}", flush=True)
+        return n
+
+    def start(self, clients: Callable[[], List[Dict[str, Any]]],
+              reseed: Optional[Callable[[Dict[str, Any]], Any]] = None) -> None:
+        """reseed(client) re-reads the client's REST order book into the store."""
+        if not FEED_ENABLED:
+            return
+        self._clients = clients
+        self._reseed = reseed
+        if self._thread and self._thread.is_alive():
+            return
+
+        def _loop():
+            last_reseed = time.monotonic()
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"[dhan-feed] sync error: {e}", flush=True)
+                if RESEED_S > 0 and time.monotonic() - last_reseed >= RESEED_S:
+                    last_reseed = time.monotonic()
+                    self.reseed()
+                time.sleep(FEED_SYNC_S)
+
+        self._thread = threading.Thread(target=_loop, name="dhan-feed-sync", daemon=True)
+        self._thread.start()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            feeds = sorted(self._feeds)
+        return {"enabled": FEED_ENABLED, "url": DHAN_ORDER_WS_URL, "feeds": feeds, "store": order_store.status()}
+
+
+order_feed = DhanOrderFeed()
@@ -0,0 +1,197 @@
+# Flatten.py
+"""
+Emergency flatten (kill switch): cancel every working order and square off
+every open position for a set of accounts, all accounts at once.
+
+Each account runs its broker's flatten_account(client, symbol, progress) on a
+dedicated executor (FLATTEN_WORKERS threads, shared with nothing else: not
+the read fan-out pools, not the order dispatcher lanes), inside
+rate_limiter.priority_lane(), so its calls neither queue behind polling reads
+nor wait for tokens those reads used up.
+
+A run records an event log that /stream/flatten/<id> replays and then follows:
+  event: start     {run_id, scope, accounts}
+  event: progress  {broker, client_id, name, stage: cancel|close, message}
+  event: account   {broker, client_id, name, ms, cancelled, closed, ..., error}
+  event: done      {run_id, time_to_flat_ms, flat, totals}
+time_to_flat_ms is from the request to the last account finishing; "flat" is
+true when no cancel or close failed.
+"""
+import asyncio, itertools, json, os, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from Broker_fanout import client_id_of, client_name_of
+from Rate_limit import rate_limiter
+from Snapshot_cache import snapshot_cache
+
+FLATTEN_WORKERS = int(os.getenv("FLATTEN_WORKERS", "32"))
+FLATTEN_HISTORY = int(os.getenv("FLATTEN_HISTORY", "20"))
+FLATTEN_HEARTBEAT_S = 15.0
+
+_TOTALS = ("cancelled", "cancel_failed", "closed", "close_failed")
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+class FlattenRun:
+    def __init__(self, run_id: str, scope: Dict[str, Any], accounts: List[Tuple[str, Dict[str, Any]]]):
+        self.id = run_id
+        self.scope = scope
+        self.accounts = accounts
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._cond = threading.Condition()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.results: Dict[str, Dict[str, Any]] = {}          # "broker:client_id" -> account summary
+        self.totals = {k: 0 for k in _TOTALS}
+        self.time_to_flat_ms: Optional[float] = None
+        self.done = False
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    def emit(self, event: str, data: Dict[str, Any]) -> None:
+        with self._cond:
+            self.events.append((event, data))
+            waiters = list(self._waiters)
+            self._cond.notify_all()
+        for loop, ev in waiters:
+            try:
+                loop.call_soon_threadsafe(ev.set)
+            except RuntimeError:
+                pass                            # loop closed: client went away
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout)
+
+    def report(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "run_id": self.id,
+                "scope": self.scope,
+                "started_at": self.started_at,
+                "accounts": len(self.accounts),
+                "finished": len(self.results),
+                "done": self.done,
+                "time_to_flat_ms": self.time_to_flat_ms,
+                "flat": self.done and not (self.totals["cancel_failed"] or self.totals["close_failed"]),
+                "totals": dict(self.totals),
+                "results": list(self.results.values()),
+            }
+
+    async def stream(self):
+        """SSE chunks: every event so far, then new ones until "done"."""
+        loop = asyncio.get_running_loop()
+        ev = asyncio.Event()
+        with self._cond:
+            self._waiters.append((loop, ev))
+        try:
+            i = 0
+            while True:
+                ev.clear()
+                with self._cond:
+                    batch = self.events[i:]
+                i += len(batch)
+                for name, data in batch:
+                    yield _sse(name, data)
+                    if name == "done":
+                        return
+                try:
+                    await asyncio.wait_for(ev.wait(), timeout=FLATTEN_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            with self._cond:
+                if (loop, ev) in self._waiters:
+                    self._waiters.remove((loop, ev))
+
+
+class Flattener:
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=FLATTEN_WORKERS, thread_name_prefix="flatten")
+        self._lock = threading.Lock()
+        self._runs: "OrderedDict[str, FlattenRun]" = OrderedDict()
+        self._seq = itertools.count(1)
+
+    def start(self, scope: Dict[str, Any], accounts: List[Tuple[str, Dict[str, Any]]],
+              fn_for: Callable[[str], Optional[Callable[..., Dict[str, Any]]]]) -> FlattenRun:
+        """
+        Flatten <accounts> [(broker, client json)]; fn_for(broker) gives that
+        broker's flatten_account. Returns at once; the run proceeds in the background.
+        """
+        run = FlattenRun(f"F{int(time.time())}-{next(self._seq)}", scope, accounts)
+        with self._lock:
+            self._runs[run.id] = run
+            while len(self._runs) > FLATTEN_HISTORY:
+                self._runs.popitem(last=False)
+        print(f"[flatten] {run.id} scope={scope} accounts={len(accounts)}", flush=True)
+        run.emit("start", {"run_id": run.id, "scope": scope, "accounts": len(accounts)})
+        if not accounts:
+            self._finish(run)
+            return run
+        for brk, cj in accounts:
+            self._pool.submit(self._account, run, brk, cj, fn_for(brk), scope.get("symbol"))
+        return run
+
+    def _account(self, run: FlattenRun, brk: str, cj: Dict[str, Any],
+                 fn: Optional[Callable[..., Dict[str, Any]]], symbol: Optional[str]) -> None:
+        cid, name = client_id_of(cj), client_name_of(cj)
+        row: Dict[str, Any] = {"broker": brk, "client_id": cid, "name": name, "error": None}
+        t0 = time.perf_counter()
+
+        def _progress(stage: str, message: str) -> None:
+            run.emit("progress", {"broker": brk, "client_id": cid, "name": name,
+                                  "stage": stage, "message": message})
+        try:
+            if fn is None:
+                raise RuntimeError(f"{brk} has no flatten_account")
+            with rate_limiter.priority_lane():
+                res = fn(cj, symbol, _progress)
+            row.update({k: int(res.get(k, 0) or 0) for k in _TOTALS})
+        except Exception as e:
+            row.update({k: 0 for k in _TOTALS})
+            row["close_failed"] = 1
+            row["error"] = str(e) or e.__class__.__name__
+            _progress("close", f"❌ {name}: {row['error']}")
+        finally:
+            snapshot_cache.invalidate(brk, [cid])
+        row["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+        with run._cond:
+            run.results[f"{brk}:{cid}"] = row
+            for k in _TOTALS:
+                run.totals[k] += row[k]
+            last = len(run.results) == len(run.accounts)
+        run.emit("account", row)
+        if last:
+            self._finish(run)
+
+    def _finish(self, run: FlattenRun) -> None:
+        with run._cond:
+            run.time_to_flat_ms = run.elapsed_ms()
+            run.done = True
+        rep = run.report()
+        print(f"[flatten] {run.id} done in {run.time_to_flat_ms} ms: {rep['totals']}", flush=True)
+        run.emit("done", {"run_id": run.id, "time_to_flat_ms": run.time_to_flat_ms,
+                          "flat": rep["flat"], "totals": rep["totals"]})
+
+    def get(self, run_id: str) -> Optional[FlattenRun]:
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            runs = list(self._runs.values())
+        return {
+            "workers": FLATTEN_WORKERS,
+            "runs": [{k: v for k, v in r.report().items() if k != "results"} for r in reversed(runs)],
+        }
+
+
+flattener = Flattener()
@@ -0,0 +1,386 @@
+# Github_mirror.py
+"""
+Background replication of data/ JSON files to the GitHub backup repo.
+
+Request handlers only enqueue (path -> latest content, or None for delete);
+a single worker thread coalesces repeated writes to the same path and pushes
+every pending change as ONE commit through the Git Data API:
+
+    GET  git/ref/heads/<branch>      (only when the cached head is unknown/stale)
+    POST git/trees   {base_tree, entries}
+    POST git/commits {tree, parents}
+    PATCH git/refs/heads/<branch>
+
+Blob shas are computed locally (git's "blob <len>\\0" sha1) and kept in a
+manifest (data/.github_manifest.json), so unchanged writes are skipped and no
+per-file GET is needed (only a delete of a path missing from the manifest
+asks once). Failed batches are re-queued (unless a newer write for the path
+arrived meanwhile) and retried with exponential backoff. When GitHub rejects
+the content itself (HTTP 400/422), every path of that batch is retried alone,
+so one bad entry cannot hold the others back, and a path rejected
+GITHUB_MIRROR_MAX_ATTEMPTS times is dropped (stats "dropped"/"last_dropped")
+until its next write.
+
+sync_down() is the startup direction: one recursive tree listing, skip every
+file whose blob sha matches the manifest (or the local file), and fetch the
+changed blobs concurrently.
+"""
+import os, json, time, base64, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from Http_pool import get_client
+
+DEBOUNCE_S   = float(os.getenv("GITHUB_MIRROR_DEBOUNCE_S", "1.0"))
+MAX_BATCH    = int(os.getenv("GITHUB_MIRROR_MAX_BATCH", "200"))
+BACKOFF_MAX  = float(os.getenv("GITHUB_MIRROR_BACKOFF_MAX_S", "120"))
+MAX_ATTEMPTS = int(os.getenv("GITHUB_MIRROR_MAX_ATTEMPTS", "5"))
+MANIFEST     = ".github_manifest.json"
+GITHUB_API   = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+SYNC_WORKERS = int(os.getenv("GITHUB_SYNC_WORKERS", "8"))
+
+_http = get_client("github", pool_maxsize=8, get_retries=2, default_timeout=(3.05, 20))
+
+
+class GithubError(RuntimeError):
+    def __init__(self, what: str, status: int, text: str):
+        super().__init__(f"{what}: HTTP {status} {text[:200]}")
+        self.status = status
+
+
+def blob_sha(content: bytes) -> str:
+    """Git blob id of <content> (what GitHub reports as the file's sha)."""
+    h = hashlib.sha1()
+    h.update(b"blob %d\0" % len(content))
+    h.update(content)
+    return h.hexdigest()
+
+
+class GithubMirror:
+    def __init__(self, owner: str, repo: str, branch: str, token: Optional[str], base_dir: str):
+        self.owner, self.repo, self.branch, self.token = owner, repo, branch, token
+        self.base_dir = os.path.abspath(base_dir)
+        self._cond = threading.Condition()
+        self._pending: Dict[str, Optional[bytes]] = {}      # rel path -> content (None = delete)
+        self._inflight = 0
+        self._rejected: Dict[str, int] = {}                 # rel path -> times GitHub rejected it
+        self._worker: Optional[threading.Thread] = None
+        self._head: Optional[Tuple[str, str]] = None        # (commit sha, tree sha)
+        self._manifest_lock = threading.Lock()
+        self._manifest: Dict[str, str] = self._load_manifest()
+        self.stats = {"enqueued": 0, "coalesced": 0, "skipped": 0, "commits": 0,
+                      "files": 0, "failures": 0, "dropped": 0, "last_error": None,
+                      "last_commit": None, "last_dropped": None}
+
+    # ---------- config ----------
+    @property
+    def enabled(self) -> bool:
+        return bool(self.owner and self.repo and self.token)
+
+    def _api(self, path: str) -> str:
+        return f"{GITHUB_API}/repos/{self.owner}/{self.repo}/{path}"
+
+    def _headers(self) -> Dict[str, str]:
+        h = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            h["Authorization"] = f"Bearer {self.token}"
+        return h
+
+    # ---------- manifest (path -> remote blob sha) ----------
+    def _manifest_path(self) -> str:
+        return os.path.join(self.base_dir, MANIFEST)
+
+    def _load_manifest(self) -> Dict[str, str]:
+        try:
+            with open(self._manifest_path(), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {str(k): str(v) for k, v in (data or {}).items()}
+        except Exception:
+            return {}
+
+    def _save_manifest(self) -> None:
+        with self._manifest_lock:
+            snap = dict(self._manifest)
+        path = self._manifest_path()
+        tmp = path + ".tmp"
+        try:
+            os.makedirs(self.base_dir, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(snap, f, indent=0, sort_keys=True)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[github] manifest save failed: {e}", flush=True)
+
+    def known_sha(self, rel_path: str) -> Optional[str]:
+        with self._manifest_lock:
+            return self._manifest.get(rel_path)
+
+    def set_known(self, shas: Dict[str, Optional[str]], save: bool = True) -> None:
+        with self._manifest_lock:
+            for p, sha in shas.items():
+                if sha:
+                    self._manifest[p] = sha
+                else:
+                    self._manifest.pop(p, None)
+        if save:
+            self._save_manifest()
+
+    # ---------- enqueue ----------
+    def _enqueue(self, rel_path: str, content: Optional[bytes]) -> None:
+        rel_path = (rel_path or "").replace("\\", "/").lstrip("/")
+        if not rel_path or not self.enabled:
+            return
+        with self._cond:
+            if rel_path in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[rel_path] = content
+            self._rejected.pop(rel_path, None)    # new content: give it a fresh chance
+            self.stats["enqueued"] += 1
+            self._cond.notify()
+        self._ensure_worker()
+
+    def write(self, rel_path: str, content: str) -> None:
+        self._enqueue(rel_path, (content or "").encode("utf-8"))
+
+    def delete(self, rel_path: str) -> None:
+        self._enqueue(rel_path, None)
+
+    # ---------- worker ----------
+    def _ensure_worker(self) -> None:
+        if self._worker and self._worker.is_alive():
+            return
+        with self._cond:
+            if self._worker and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name="github-mirror", daemon=True)
+            self._worker.start()
+
+    def _take_batch(self) -> Dict[str, Optional[bytes]]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+        time.sleep(DEBOUNCE_S)        # let bursts (bulk toggles, group edits) coalesce
+        with self._cond:
+            # paths from a rejected batch go one per commit until they succeed or are dropped
+            suspect = next((k for k in self._pending if k in self._rejected), None)
+            keys = [suspect] if suspect is not None else list(self._pending)[:MAX_BATCH]
+            batch = {k: self._pending.pop(k) for k in keys}
+            self._inflight = len(batch)
+            return batch
+
+    def _requeue(self, batch: Dict[str, Optional[bytes]], rejected: bool = False) -> None:
+        """
+        Put a failed batch back. rejected = GitHub refused the content (not a
+        transient/network error): each path's count goes up and a path alone
+        in its batch that reached MAX_ATTEMPTS is dropped.
+        """
+        with self._cond:
+            for p, c in batch.items():
+                if p in self._pending:
+                    continue                     # a newer write wins
+                if rejected:
+                    n = self._rejected.get(p, 0) + 1
+                    if len(batch) == 1 and n >= MAX_ATTEMPTS:
+                        self._rejected.pop(p, None)
+                        self.stats["dropped"] += 1
+                        self.stats["last_dropped"] = p
+                        print(f"[github] dropping {p} after {n} rejected attempts", flush=True)
+                        continue
+                    self._rejected[p] = n
+                self._pending[p] = c
+            self._inflight = 0
+            self._cond.notify_all()
+
+    def _run(self) -> None:
+        failures = 0
+        while True:
+            batch = self._take_batch()
+            try:
+                self._commit(batch)
+                failures = 0
+                with self._cond:
+                    for p in batch:
+                        if p not in self._pending:
+                            self._rejected.pop(p, None)
+                    self._inflight = 0
+                    self._cond.notify_all()
+            except Exception as e:
+                failures += 1
+                self.stats["failures"] += 1
+                self.stats["last_error"] = str(e)
+                self._head = None
+                self._requeue(batch, isinstance(e, GithubError) and e.status in (400, 422))
+                delay = min(BACKOFF_MAX, 2 ** min(failures, 10))
+                print(f"[github] mirror commit failed ({e}); retry in {delay:.0f}s", flush=True)
+                time.sleep(delay)
+
+    # ---------- git data api ----------
+    def _check(self, r, what: str):
+        if r.status_code >= 300:
+            raise GithubError(what, r.status_code, r.text)
+        return r.json() if r.content else {}
+
+    def _get_head(self) -> Tuple[str, str]:
+        if self._head:
+            return self._head
+        ref = self._check(_http.get(self._api(f"git/ref/heads/{self.branch}"), headers=self._headers()), "get ref")
+        commit_sha = ref["object"]["sha"]
+        commit = self._check(_http.get(self._api(f"git/commits/{commit_sha}"), headers=self._headers()), "get commit")
+        self._head = (commit_sha, commit["tree"]["sha"])
+        return self._head
+
+    def _remote_sha(self, path: str) -> Optional[str]:
+        r = _http.get(self._api(f"contents/{path}"), headers=self._headers(), params={"ref": self.branch})
+        if r.status_code == 404:
+            return None
+        data = self._check(r, "get contents")
+        return data.get("sha") if isinstance(data, dict) else None
+
+    def _commit(self, batch: Dict[str, Optional[bytes]]) -> None:
+        entries: List[Dict[str, Any]] = []
+        shas: Dict[str, Optional[str]] = {}
+        for path, content in sorted(batch.items()):
+            known = self.known_sha(path)
+            if content is None:
+                if known is None:
+                    known = self._remote_sha(path)  # manifest miss: ask once
+                if known is None:
+                    self.stats["skipped"] += 1      # not in the remote tree
+                    continue
+                entries.append({"path": path, "mode": "100644", "type": "blob", "sha": None})
+                shas[path] = None
+            else:
+                sha = blob_sha(content)
+                if sha == known:
+                    self.stats["skipped"] += 1      # identical to what GitHub already has
+                    continue
+                entries.append({"path": path, "mode": "100644", "type": "blob",
+                                "content": content.decode("utf-8", "replace")})
+                shas[path] = sha
+        if not entries:
+            return
+
+        if len(entries) == 1:
+            e = entries[0]
+            message = f"{'Delete' if e.get('sha', '') is None else 'Update'} {e['path']}"
+        else:
+            message = f"Sync {len(entries)} files\n\n" + "\n".join(e["path"] for e in entries)
+
+        for attempt in range(2):
+            head_sha, tree_sha = self._get_head()
+            tree = self._check(_http.post(self._api("git/trees"), headers=self._headers(),
+                                          json={"base_tree": tree_sha, "tree": entries}), "create tree")
+            commit = self._check(_http.post(self._api("git/commits"), headers=self._headers(),
+                                            json={"message": message, "tree": tree["sha"],
+                                                  "parents": [head_sha]}), "create commit")
+            r = _http.request("PATCH", self._api(f"git/refs/heads/{self.branch}"), headers=self._headers(),
+                              json={"sha": commit["sha"], "force": False})
+            if r.status_code == 422 and attempt == 0:
+                self._head = None                   # branch moved under us: rebase on new head
+                continue
+            self._check(r, "update ref")
+            self._head = (commit["sha"], tree["sha"])
+            break
+
+        self.set_known(shas)
+        self.stats["commits"] += 1
+        self.stats["files"] += len(entries)
+        self.stats["last_commit"] = self._head[0] if self._head else None
+
+    # ---------- sync down ----------
+    def _local_path(self, rel_path: str) -> str:
+        return os.path.join(self.base_dir, rel_path.replace("/", os.sep))
+
+    def _local_sha(self, rel_path: str) -> Optional[str]:
+        try:
+            with open(self._local_path(rel_path), "rb") as f:
+                return blob_sha(f.read())
+        except Exception:
+            return None
+
+    def _download(self, rel_path: str, sha: str) -> str:
+        data = self._check(_http.get(self._api(f"git/blobs/{sha}"), headers=self._headers()), "get blob")
+        raw = base64.b64decode(data.get("content") or "")
+        if blob_sha(raw) != sha:
+            raise RuntimeError(f"blob sha mismatch for {rel_path}")
+        path = self._local_path(rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".sync"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, path)
+        return rel_path
+
+    def sync_down(self, dirs: List[str], suffix: str = ".json") -> Dict[str, Any]:
+        """
+        Bring local <dirs> up to date with the branch head. Raises if the tree
+        can't be listed (caller may fall back); per-file failures are counted.
+        """
+        if not (self.owner and self.repo):
+            return {"skipped": "not configured"}
+        t0 = time.time()
+        self._head = None       # always list the current head
+        head_sha, tree_sha = self._get_head()
+        tree = self._check(_http.get(self._api(f"git/trees/{tree_sha}"), headers=self._headers(),
+                                     params={"recursive": "1"}), "get tree")
+        if tree.get("truncated"):
+            raise RuntimeError("recursive tree listing truncated")
+
+        wanted = {d.strip("/") for d in dirs}
+        with self._cond:
+            pending = set(self._pending)
+        todo: List[Tuple[str, str]] = []
+        listed = unchanged = 0
+        known: Dict[str, Optional[str]] = {}
+        for e in tree.get("tree") or []:
+            path, sha = e.get("path") or "", e.get("sha") or ""
+            # direct children of <dirs> only, like the old per-directory listing
+            if e.get("type") != "blob" or path.rpartition("/")[0] not in wanted \
+                    or not path.lower().endswith(suffix):
+                continue
+            listed += 1
+            if path in pending:
+                continue        # local edit not uploaded yet: keep it
+            if (self.known_sha(path) == sha and os.path.exists(self._local_path(path))) \
+                    or self._local_sha(path) == sha:
+                unchanged += 1
+                known[path] = sha
+                continue
+            todo.append((path, sha))
+
+        downloaded, failed = 0, []
+        if todo:
+            with ThreadPoolExecutor(max_workers=max(1, SYNC_WORKERS), thread_name_prefix="gh-sync") as ex:
+                futs = {ex.submit(self._download, p, sha): (p, sha) for p, sha in todo}
+                for fut, (p, sha) in futs.items():
+                    try:
+                        fut.result()
+                        known[p] = sha
+                        downloaded += 1
+                    except Exception as e:
+                        failed.append(f"{p}: {e}")
+        self.set_known(known)
+        out = {"head": head_sha, "listed": listed, "unchanged": unchanged,
+               "downloaded": downloaded, "failed": failed,
+               "elapsed_ms": round((time.time() - t0) * 1000, 1)}
+        print(f"[github] sync-down: {listed} files, {unchanged} unchanged, "
+              f"{downloaded} downloaded, {len(failed)} failed in {out['elapsed_ms']} ms", flush=True)
+        return out
+
+    # ---------- control ----------
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until the queue is drained (or timeout). True if drained."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._pending or self._inflight:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self._cond.wait(min(left, 0.25))
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+            inflight = self._inflight
+        return {"enabled": self.enabled, "pending": pending, "inflight": inflight, **self.stats}
@@ -0,0 +1,140 @@
+# Group_plans.py
+"""
+Compiled allocation plans for account groups (/place_orders with groupacc).
+
+A plan is the group file reduced to what order expansion needs: its key and
+display name, the integer multiplier, and one leg per member with the client
+already resolved through the client registry ({client_id, name, broker}).
+Members missing from the registry are kept as `missing` so they still show up
+as client_not_found skips.
+
+Plans are compiled when a group is saved (/add_group, /edit_group), dropped on
+/delete_group, and compiled lazily from disk the first time an unknown group
+is used. A plan remembers client_registry.version; if clients changed since,
+it is recompiled from the cached group document (no file read).
+"""
+import threading, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from Client_registry import client_registry
+
+
+def _member_id(m: Any) -> str:
+    if isinstance(m, dict):
+        return str(m.get("userid") or m.get("client_id") or m.get("id") or "").strip()
+    return str(m or "").strip()
+
+
+def _multiplier(doc: Dict[str, Any]) -> int:
+    try:
+        return int(float(doc.get("multiplier", 1) or 1))
+    except (TypeError, ValueError):
+        return 1
+
+
+class GroupPlan:
+    __slots__ = ("id", "name", "key", "multiplier", "legs", "missing", "version", "compile_us")
+
+    def __init__(self, doc: Dict[str, Any], fallback: str = ""):
+        t0 = time.perf_counter()
+        self.version = client_registry.version
+        self.name = str(doc.get("name") or doc.get("id") or fallback)
+        self.id = str(doc.get("id") or self.name)
+        self.key = self.id
+        self.multiplier = _multiplier(doc)
+
+        legs: List[Dict[str, str]] = []
+        missing: List[str] = []
+        seen = set()
+        for m in doc.get("members") or doc.get("clients") or []:
+            uid = _member_id(m)
+            if not uid or uid in seen:
+                continue
+            seen.add(uid)
+            hit = client_registry.by_userid(uid)
+            if not hit:
+                missing.append(uid)
+                continue
+            brk, cj = hit
+            legs.append({"client_id": uid,
+                         "name": cj.get("name") or cj.get("display_name") or uid,
+                         "broker": brk})
+        self.legs: Tuple[Dict[str, str], ...] = tuple(legs)
+        self.missing: Tuple[str, ...] = tuple(missing)
+        self.compile_us = round((time.perf_counter() - t0) * 1e6, 1)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "multiplier": self.multiplier,
+                "legs": len(self.legs), "missing": list(self.missing),
+                "registry_version": self.version, "compile_us": self.compile_us}
+
+
+class GroupPlans:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plans: Dict[str, GroupPlan] = {}          # id -> plan
+        self._docs: Dict[str, Dict[str, Any]] = {}      # id -> group document
+        self._alias: Dict[str, str] = {}                # lower(id | name | selector) -> id
+        self._hits = 0
+        self._compiles = 0
+
+    def _install(self, doc: Dict[str, Any], selector: str = "") -> GroupPlan:
+        plan = GroupPlan(doc, selector)
+        with self._lock:
+            old = self._plans.get(plan.id)
+            if old is not None:
+                self._alias = {k: v for k, v in self._alias.items() if v != plan.id}
+            self._plans[plan.id] = plan
+            self._docs[plan.id] = doc
+            for k in (plan.id, plan.name, selector):
+                if k:
+                    self._alias[k.strip().lower()] = plan.id
+            self._compiles += 1
+        return plan
+
+    def put(self, doc: Dict[str, Any]) -> GroupPlan:
+        """(Re)compile a group after it was saved."""
+        return self._install(dict(doc))
+
+    def drop(self, id_or_name: str) -> None:
+        k = str(id_or_name or "").strip().lower()
+        with self._lock:
+            gid = self._alias.get(k, k)
+            self._plans.pop(gid, None)
+            self._docs.pop(gid, None)
+            self._alias = {a: v for a, v in self._alias.items() if v != gid and a != k}
+
+    def clear(self) -> None:
+        """Forget everything (group files were replaced underneath us, e.g. a sync-down)."""
+        with self._lock:
+            self._plans.clear(); self._docs.clear(); self._alias.clear()
+
+    def get(self, selector: str,
+            load: Callable[[str], Optional[Dict[str, Any]]]) -> Optional[GroupPlan]:
+        """
+        Plan for a group id or name. load(selector) -> group doc | None is only
+        called when the group has not been seen yet.
+        """
+        k = str(selector or "").strip().lower()
+        with self._lock:
+            gid = self._alias.get(k)
+            plan = self._plans.get(gid) if gid else None
+            doc = self._docs.get(gid) if gid else None
+            if plan is not None and plan.version == client_registry.version:
+                self._hits += 1
+                return plan
+        if doc is None:
+            doc = load(selector)
+            if not doc:
+                return None
+        return self._install(doc, str(selector or ""))
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            plans = list(self._plans.values())
+            hits, compiles = self._hits, self._compiles
+        return {"registry_version": client_registry.version, "hits": hits,
+                "compiles": compiles, "plans": [p.summary() for p in plans]}
+
+
+group_plans = GroupPlans()
@@ -0,0 +1,187 @@
+# Http_pool.py
+"""
+Shared keep-alive HTTP clients.
+
+One PooledClient per upstream (e.g. "dhan"), each owning a requests.Session
+with a sized urllib3 pool so repeated calls to the same host reuse the TLS
+connection instead of handshaking every time.
+
+  - read/status retries with backoff apply to idempotent GETs only, so a
+    POST/PUT/DELETE (an order) is never re-sent once it reached the server;
+    only failed connects, where nothing was sent, are retried for all methods
+  - timeouts are resolved per endpoint name: explicit > table > default
+  - stats() reports requests, new connections (≈ TLS handshakes) and reuse ratio
+  - endpoints mapped in rate_classes go through Rate_limit (per account bucket,
+    429/Retry-After handling); "*" is the class for unmapped endpoints. The
+    account is the account= argument, else a digest of account_header's value
+"""
+import os, hashlib, threading
+from typing import Any, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Rate_limit import rate_limiter
+
+Timeout = Union[float, Tuple[float, float]]
+
+_clients: Dict[str, "PooledClient"] = {}
+_clients_lock = threading.Lock()
+
+
+def env_num(key: str, default: float) -> float:
+    try:
+        return float(os.getenv(key, default))
+    except Exception:
+        return default
+
+
+def env_timeout(key: str, default: Timeout) -> Timeout:
+    """'3.05,10' -> (3.05, 10.0); '10' -> 10.0; unset -> default."""
+    raw = (os.getenv(key) or "").strip()
+    if not raw:
+        return default
+    try:
+        parts = [float(x) for x in raw.split(",") if x.strip()]
+        return (parts[0], parts[1]) if len(parts) >= 2 else parts[0]
+    except Exception:
+        return default
+
+
+class PooledClient:
+    def __init__(self, name: str,
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 32,
+                 get_retries: int = 2,
+                 backoff: float = 0.25,
+                 default_timeout: Timeout = (3.05, 15),
+                 timeouts: Optional[Dict[str, Timeout]] = None,
+                 headers: Optional[Dict[str, str]] = None,
+                 rate_classes: Optional[Dict[str, str]] = None,
+                 account_header: Optional[str] = None):
+        self.name = name
+        self.rate_classes: Dict[str, str] = dict(rate_classes or {})
+        self.account_header = account_header
+        self.default_timeout = default_timeout
+        self.timeouts: Dict[str, Timeout] = dict(timeouts or {})
+        self.pool_maxsize = pool_maxsize
+
+        retry = Retry(
+            total=get_retries,
+            connect=get_retries,
+            read=get_retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize,
+                                   max_retries=retry,
+                                   pool_block=False)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+
+    def timeout_for(self, endpoint: Optional[str]) -> Timeout:
+        if endpoint and endpoint in self.timeouts:
+            return self.timeouts[endpoint]
+        return self.default_timeout
+
+    def rate_class_for(self, endpoint: Optional[str]) -> Optional[str]:
+        return self.rate_classes.get(endpoint or "", self.rate_classes.get("*"))
+
+    def request(self, method: str, url: str, endpoint: Optional[str] = None,
+                timeout: Optional[Timeout] = None, account: Optional[str] = None,
+                **kw: Any) -> requests.Response:
+        """<account> keys the rate-limit bucket (client id); ignored for unlimited clients."""
+        timeout = timeout if timeout is not None else self.timeout_for(endpoint)
+
+        def _send() -> requests.Response:
+            with self._lock:
+                self._requests += 1
+            try:
+                return self.session.request(method.upper(), url, timeout=timeout, **kw)
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                raise
+
+        cls = self.rate_class_for(endpoint)
+        if cls is None:
+            return _send()
+        if account is None and self.account_header:
+            val = str((kw.get("headers") or {}).get(self.account_header) or "")
+            account = hashlib.sha1(val.encode()).hexdigest()[:12] if val else None
+        return rate_limiter.call(self.name, cls, account, _send)
+
+    def get(self, url: str, **kw: Any) -> requests.Response:
+        return self.request("GET", url, **kw)
+
+    def post(self, url: str, **kw: Any) -> requests.Response:
+        return self.request("POST", url, **kw)
+
+    def put(self, url: str, **kw: Any) -> requests.Response:
+        return self.request("PUT", url, **kw)
+
+    def delete(self, url: str, **kw: Any) -> requests.Response:
+        return self.request("DELETE", url, **kw)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool statistics from urllib3's per-host pools."""
+        hosts = []
+        conns = sent = 0
+        try:
+            pools = self.adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                n_conn = int(getattr(pool, "num_connections", 0))
+                n_req  = int(getattr(pool, "num_requests", 0))
+                conns += n_conn
+                sent  += n_req
+                hosts.append({
+                    "host": getattr(pool, "host", ""),
+                    "connections": n_conn,
+                    "requests": n_req,
+                    "idle": sum(1 for c in list(getattr(pool.pool, "queue", [])) if c is not None),
+                })
+        except Exception:
+            pass
+        with self._lock:
+            calls, errors = self._requests, self._errors
+        return {
+            "name": self.name,
+            "pool_maxsize": self.pool_maxsize,
+            "calls": calls,
+            "errors": errors,
+            "requests": sent,
+            "handshakes": conns,
+            "reuse_ratio": round(1.0 - conns / sent, 4) if sent else None,
+            "hosts": hosts,
+        }
+
+
+def get_client(name: str, **cfg: Any) -> PooledClient:
+    """Process-wide client for <name>; cfg only applies on first creation."""
+    with _clients_lock:
+        cli = _clients.get(name)
+        if cli is None:
+            cli = PooledClient(name, **cfg)
+            _clients[name] = cli
+        return cli
+
+
+def all_stats() -> Dict[str, Any]:
+    with _clients_lock:
+        clients = list(_clients.values())
+    return {c.name: c.stats() for c in clients}
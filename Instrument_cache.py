@@ -0,0 +1,171 @@
+# Instrument_cache.py
+"""
+Process-wide instrument metadata, keyed by security id / symbol token.
+
+One Instrument per row of symbols.db: lot size (Min Qty), tick size, exchange,
+Dhan exchange segment and trading symbol. Loaded once from Symbol_db, rebuilt
+after /refresh_symbols and swapped in as a single reference, so lookups are
+plain dict gets with no lock and no DB access.
+
+Columns are matched loosely (like the old CSV probe): "Min Qty" / lot size /
+market lot, "Tick Size", "Segment" — missing ones fall back to lot 1,
+tick 0.05 and a segment derived from the exchange.
+"""
+import threading, time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from Symbol_db import SymbolDb, symbol_db, SYMBOL_TABLE
+
+DEFAULT_TICK = 0.05
+
+# UI exchange -> Dhan exchangeSegment (same table Broker_dhan.place_orders uses)
+EXCHANGE_SEGMENTS = {
+    "NSE": "NSE_EQ",
+    "BSE": "BSE_EQ",
+    "NFO": "NSE_FNO",
+    "NSEFO": "NSE_FNO",
+    "NSE_FO": "NSE_FNO",
+    "NSECD": "NSE_CURRENCY",
+    "CDS": "NSE_CURRENCY",
+    "MCX": "MCX_COMM",
+    "BFO": "BSE_FNO",
+    "BSEFO": "BSE_FNO",
+    "BSECD": "BSE_CURRENCY",
+    "NCDEX": "NCDEX",
+}
+
+_ALIASES = {
+    "security_id": ("securityid", "security_id", "symboltoken", "token", "id"),
+    "exchange":    ("exchange", "exch"),
+    "symbol":      ("stocksymbol", "tradingsymbol", "symbol", "symbolname"),
+    "lot_size":    ("minqty", "minquantity", "lotsize", "tradinglot", "marketlot", "minorderqty"),
+    "tick_size":   ("ticksize", "tick"),
+    "segment":     ("segment", "exchangesegment", "exchsegment"),
+}
+
+
+class Instrument(NamedTuple):
+    security_id: str
+    exchange: str
+    segment: str
+    symbol: str
+    lot_size: int
+    tick_size: float
+
+
+def _norm(name: str) -> str:
+    return "".join(ch for ch in str(name).lower() if ch.isalnum())
+
+
+def _sid(v: Any) -> str:
+    s = str(v if v is not None else "").strip()
+    if s.endswith(".0") and s[:-2].isdigit():
+        s = s[:-2]
+    return s
+
+
+def _int(v: Any, default: int) -> int:
+    try:
+        return max(1, int(float(str(v).strip())))
+    except Exception:
+        return default
+
+
+def _float(v: Any, default: float) -> float:
+    try:
+        f = float(str(v).strip())
+        return f if f > 0 else default
+    except Exception:
+        return default
+
+
+class InstrumentCache:
+    def __init__(self, db: SymbolDb):
+        self.db = db
+        # (by_id, by_exch_id, by_symbol) swapped as one tuple
+        self._maps: Optional[Tuple[Dict[str, Instrument],
+                                   Dict[Tuple[str, str], Instrument],
+                                   Dict[Tuple[str, str], Instrument]]] = None
+        self._load_lock = threading.Lock()
+        self.loaded_at = 0.0
+
+    def load(self) -> int:
+        """Rebuild from symbols.db and swap in. Returns number of instruments."""
+        with self._load_lock:
+            with self.db.connection() as conn:
+                cur = conn.execute(f"SELECT * FROM {SYMBOL_TABLE}")
+                cols = [_norm(d[0]) for d in cur.description]
+                rows = cur.fetchall()
+            pos: Dict[str, Optional[int]] = {}
+            for field, names in _ALIASES.items():
+                pos[field] = next((cols.index(n) for n in names if n in cols), None)
+
+            def col(r, field):
+                i = pos[field]
+                return r[i] if i is not None else None
+
+            by_id: Dict[str, Instrument] = {}
+            by_exch_id: Dict[Tuple[str, str], Instrument] = {}
+            by_symbol: Dict[Tuple[str, str], Instrument] = {}
+            for r in rows:
+                sid = _sid(col(r, "security_id"))
+                if not sid:
+                    continue
+                exch = str(col(r, "exchange") or "").strip().upper()
+                sym = str(col(r, "symbol") or "").strip()
+                inst = Instrument(
+                    security_id=sid,
+                    exchange=exch,
+                    segment=str(col(r, "segment") or "").strip() or EXCHANGE_SEGMENTS.get(exch, exch),
+                    symbol=sym,
+                    lot_size=_int(col(r, "lot_size"), 1),
+                    tick_size=_float(col(r, "tick_size"), DEFAULT_TICK),
+                )
+                by_id[sid] = inst
+                by_exch_id[(exch, sid)] = inst
+                if sym:
+                    by_symbol.setdefault((exch, sym.upper()), inst)
+            self._maps = (by_id, by_exch_id, by_symbol)
+            self.loaded_at = time.time()
+        print(f"[instruments] loaded {len(by_id)} instruments", flush=True)
+        return len(by_id)
+
+    def _get_maps(self):
+        maps = self._maps
+        if maps is None and self.db.exists():
+            try:
+                self.load()
+            except Exception as e:
+                print(f"[instruments] load failed: {e}", flush=True)
+            maps = self._maps
+        return maps
+
+    # ---------- lookups ----------
+    def get(self, security_id: Any, exchange: str = "") -> Optional[Instrument]:
+        maps = self._get_maps()
+        if not maps:
+            return None
+        sid = _sid(security_id)
+        exch = (exchange or "").strip().upper()
+        if exch:
+            inst = maps[1].get((exch, sid))
+            if inst is not None:
+                return inst
+        return maps[0].get(sid)
+
+    def by_symbol(self, exchange: str, symbol: str) -> Optional[Instrument]:
+        maps = self._get_maps()
+        if not maps:
+            return None
+        return maps[2].get(((exchange or "").strip().upper(), (symbol or "").strip().upper()))
+
+    def lot_size(self, security_id: Any, exchange: str = "", default: int = 1) -> int:
+        inst = self.get(security_id, exchange)
+        return inst.lot_size if inst is not None else default
+
+    def tick_size(self, security_id: Any, exchange: str = "", default: float = DEFAULT_TICK) -> float:
+        inst = self.get(security_id, exchange)
+        return inst.tick_size if inst is not None else default
+
+
+instrument_cache = InstrumentCache(symbol_db)
@@ -0,0 +1,202 @@
+# Live_stream.py
+"""
+Server-push streams for the Orders / Positions tabs (Server-Sent Events).
+
+One StreamHub per dataset owns a single refresher thread. Every refresh it
+reads all accounts once (through the router's fan-out + snapshot cache),
+diffs the result against the previous state and publishes the delta to every
+subscriber, so broker load no longer grows with the number of open tabs.
+
+Rows are keyed per bucket ("pending"/"traded"/... or "open"/"closed") by the
+hub's key function (order_id, or name|symbol). Accounts that timed out or
+failed in a refresh keep their previous rows instead of showing as removed.
+
+Wire format (text/event-stream):
+  event: snapshot   data: {"seq", "buckets": {bucket: [row, ...]}, "meta"}
+  event: diff       data: {"seq", "added": [{bucket, key, row}], "changed": [...],
+                           "removed": [{bucket, key}], "meta"}
+  ": ping" comment lines keep idle connections open.
+A subscriber that falls too far behind gets a fresh snapshot instead of the backlog.
+"""
+import asyncio, json, os, threading, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STREAM_REFRESH_S   = float(os.getenv("STREAM_REFRESH_S", "1.0"))
+STREAM_HEARTBEAT_S = float(os.getenv("STREAM_HEARTBEAT_S", "15"))
+STREAM_IDLE_STOP_S = float(os.getenv("STREAM_IDLE_STOP_S", "30"))
+STREAM_QUEUE_MAX   = 256
+
+State = Dict[str, Dict[str, Dict[str, Any]]]      # bucket -> key -> row
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(maxsize=STREAM_QUEUE_MAX)
+        self.resync = False
+
+    def push(self, msg: str) -> None:
+        """Called from the refresher thread."""
+        def _put():
+            if self.resync:
+                return
+            try:
+                self.queue.put_nowait(msg)
+            except asyncio.QueueFull:
+                self.resync = True          # consumer sends a snapshot and drops the backlog
+        try:
+            self.loop.call_soon_threadsafe(_put)
+        except RuntimeError:
+            pass                            # loop closed: client went away
+
+
+class StreamHub:
+    def __init__(self, name: str, buckets: Tuple[str, ...],
+                 fetch: Callable[[], Dict[str, Any]],
+                 key_fn: Callable[[Dict[str, Any]], str],
+                 interval_s: float = STREAM_REFRESH_S):
+        self.name = name
+        self.buckets = buckets
+        self.fetch = fetch              # -> {bucket: [rows], "meta": {...}} (a /get_* payload)
+        self.key_fn = key_fn
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._subs: List[_Subscriber] = []
+        self._state: State = {b: {} for b in buckets}
+        self._meta: Dict[str, Any] = {}
+        self._seq = 0
+        self._ready = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._idle_since: Optional[float] = None
+        self.stats = {"refreshes": 0, "errors": 0, "diffs": 0, "rows_sent": 0}
+
+    # ---------- refresher ----------
+    def _index(self, payload: Dict[str, Any]) -> State:
+        state: State = {b: {} for b in self.buckets}
+        for b in self.buckets:
+            for row in payload.get(b) or []:
+                if isinstance(row, dict):
+                    state[b][self.key_fn(row)] = row
+        # accounts that did not answer this round keep their last rows
+        stale = {c.get("name") for c in (payload.get("meta") or {}).get("clients", [])
+                 if c.get("status") != "ok"}
+        stale.discard(None)
+        if stale:
+            for b in self.buckets:
+                for k, row in self._state[b].items():
+                    if row.get("name") in stale:
+                        state[b].setdefault(k, row)
+        return state
+
+    def _diff(self, new: State) -> Dict[str, List[Dict[str, Any]]]:
+        added, changed, removed = [], [], []
+        for b in self.buckets:
+            old_b, new_b = self._state[b], new[b]
+            for k, row in new_b.items():
+                prev = old_b.get(k)
+                if prev is None:
+                    added.append({"bucket": b, "key": k, "row": row})
+                elif prev != row:
+                    changed.append({"bucket": b, "key": k, "row": row})
+            for k in old_b:
+                if k not in new_b:
+                    removed.append({"bucket": b, "key": k})
+        return {"added": added, "changed": changed, "removed": removed}
+
+    def refresh(self) -> None:
+        payload = self.fetch()
+        new = self._index(payload)
+        meta = dict(payload.get("meta") or {})
+        with self._lock:
+            diff = self._diff(new)
+            self._state, self._meta = new, meta
+            self._seq += 1
+            seq = self._seq
+            subs = list(self._subs)
+            self.stats["refreshes"] += 1
+        self._ready.set()
+        if not (diff["added"] or diff["changed"] or diff["removed"]):
+            return
+        n = len(diff["added"]) + len(diff["changed"]) + len(diff["removed"])
+        self.stats["diffs"] += 1
+        self.stats["rows_sent"] += n * len(subs)
+        msg = _sse("diff", {"seq": seq, **diff, "meta": meta})
+        for s in subs:
+            s.push(msg)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._subs:
+                    if self._idle_since is None:
+                        self._idle_since = time.monotonic()
+                    elif time.monotonic() - self._idle_since > STREAM_IDLE_STOP_S:
+                        self._thread = None
+                        self._ready.clear()
+                        print(f"[stream] {self.name} refresher stopped (no subscribers)", flush=True)
+                        return
+                else:
+                    self._idle_since = None
+            t0 = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[stream] {self.name} refresh failed: {e}", flush=True)
+            time.sleep(max(0.05, self.interval_s - (time.monotonic() - t0)))
+
+    def _ensure_running(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"stream-{self.name}", daemon=True)
+                self._thread.start()
+
+    # ---------- subscribers ----------
+    def snapshot(self) -> str:
+        with self._lock:
+            buckets = {b: list(rows.values()) for b, rows in self._state.items()}
+            return _sse("snapshot", {"seq": self._seq, "buckets": buckets, "meta": self._meta})
+
+    async def events(self):
+        """Async generator of SSE chunks for one client connection."""
+        loop = asyncio.get_running_loop()
+        sub = _Subscriber(loop)
+        with self._lock:
+            self._subs.append(sub)
+        self._ensure_running()
+        try:
+            # first snapshot once the refresher has data (don't block the loop)
+            await loop.run_in_executor(None, self._ready.wait, 10)
+            yield self.snapshot()
+            while True:
+                if sub.resync:
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    sub.resync = False
+                    yield self.snapshot()
+                try:
+                    msg = await asyncio.wait_for(sub.queue.get(), timeout=STREAM_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            with self._lock:
+                if sub in self._subs:
+                    self._subs.remove(sub)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": len(self._subs),
+                "running": bool(self._thread and self._thread.is_alive()),
+                "seq": self._seq,
+                "rows": {b: len(r) for b, r in self._state.items()},
+                **self.stats,
+            }
@@ -0,0 +1,121 @@
+# Ltp_service.py
+"""
+Shared last-traded-price cache for holdings valuation.
+
+Prices are keyed by (exchange, scripcode), e.g. ("NSE", "2885"); NSE cash
+tokens are the same for Motilal scripcodes and Dhan securityIds, so both
+brokers share entries.
+
+Two sources:
+  push()      ticks from a streaming feed (kept LTP_FEED_TTL_S)
+  get_many()  REST fallback for misses: each missing key is fetched once,
+              concurrently, and callers asking for the same key while that
+              fetch runs wait for it instead of sending their own
+              (kept LTP_TTL_S)
+So fifty clients holding the same thirty names cost thirty LTP calls per
+refresh window, not fifteen hundred.
+"""
+import os, time, threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+Key = Tuple[str, str]           # (exchange, scripcode)
+
+LTP_TTL_S         = float(os.getenv("LTP_TTL_S", "2"))
+LTP_FEED_TTL_S    = float(os.getenv("LTP_FEED_TTL_S", "30"))
+LTP_FETCH_WORKERS = int(os.getenv("LTP_FETCH_WORKERS", "8"))
+
+
+def ltp_key(exchange: Any, code: Any) -> Key:
+    ex = str(exchange or "NSE").strip().upper()
+    try:
+        return ex, str(int(float(code)))
+    except (TypeError, ValueError):
+        return ex, str(code or "").strip()
+
+
+class LtpService:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prices: Dict[Key, Tuple[float, float, str]] = {}     # key -> (monotonic ts, price, source)
+        self._inflight: Dict[Key, Future] = {}
+        self._pool = ThreadPoolExecutor(max_workers=LTP_FETCH_WORKERS, thread_name_prefix="ltp")
+        self.stats = {"hits": 0, "fetched": 0, "shared": 0, "pushed": 0, "failed": 0}
+
+    def _fresh(self, key: Key, now: float) -> Optional[float]:
+        hit = self._prices.get(key)
+        if hit is None:
+            return None
+        ts, price, source = hit
+        return price if now - ts <= (LTP_FEED_TTL_S if source == "feed" else LTP_TTL_S) else None
+
+    def push(self, exchange: Any, code: Any, price: float, source: str = "feed") -> None:
+        """Record a price from a live feed."""
+        if not price:
+            return
+        with self._lock:
+            self._prices[ltp_key(exchange, code)] = (time.monotonic(), float(price), source)
+            self.stats["pushed"] += 1
+
+    def peek(self, exchange: Any, code: Any) -> Optional[float]:
+        """A fresh cached price, or None. Never fetches."""
+        with self._lock:
+            return self._fresh(ltp_key(exchange, code), time.monotonic())
+
+    def get_many(self, keys: Iterable[Key],
+                 fetch: Callable[[str, str], Optional[float]]) -> Dict[Key, float]:
+        """
+        Prices for <keys>: cached ones as-is, the rest via fetch(exchange, code)
+        (one call per key across all concurrent callers). Failed keys are left out.
+        """
+        out: Dict[Key, float] = {}
+        waits: Dict[Key, Future] = {}
+        owned: Dict[Key, Future] = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in {ltp_key(*k) for k in keys}:
+                price = self._fresh(key, now)
+                if price is not None:
+                    out[key] = price
+                    self.stats["hits"] += 1
+                elif key in self._inflight:
+                    waits[key] = self._inflight[key]
+                    self.stats["shared"] += 1
+                else:
+                    owned[key] = self._inflight[key] = Future()
+
+        for key, fut in owned.items():
+            self._pool.submit(self._fetch_into, key, fut, fetch)
+        for key, fut in {**owned, **waits}.items():
+            try:
+                price = fut.result()
+            except Exception:
+                price = None
+            if price:
+                out[key] = price
+        return out
+
+    def _fetch_into(self, key: Key, fut: Future, fetch: Callable[[str, str], Optional[float]]) -> None:
+        try:
+            price = fetch(*key)
+        except Exception as e:
+            print(f"[ltp] fetch {key[0]}:{key[1]} failed: {e}", flush=True)
+            price = None
+        with self._lock:
+            self._inflight.pop(key, None)
+            if price:
+                self._prices[key] = (time.monotonic(), float(price), "rest")
+                self.stats["fetched"] += 1
+            else:
+                self.stats["failed"] += 1
+        fut.set_result(price)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            fresh = sum(1 for k in self._prices if self._fresh(k, now) is not None)
+            return {"ttl_s": LTP_TTL_S, "feed_ttl_s": LTP_FEED_TTL_S, "prices": len(self._prices),
+                    "fresh": fresh, "inflight": len(self._inflight), **self.stats}
+
+
+ltp_service = LtpService()
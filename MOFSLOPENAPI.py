@@ -22,10 +22,13 @@ from struct import *
 # import sys
 # import os
 import time
+import atexit
 # from datetime import datetime 
 import datetime as dt
 from queue import Queue
-from threading import Thread
+from threading import Thread, Lock
+from Http_pool import get_client, env_num, env_timeout
+from Rate_limit import ORDER, DATA, NONTRADING
 
 
 
@@ -33,6 +36,27 @@ from threading import Thread
 # Api-Version
 version = "V.1.1.0"
 
+# seconds to wait for checkip.dyndns.org
+PUBLIC_IP_TIMEOUT = float(os.getenv("MOFSL_PUBLIC_IP_TIMEOUT", "3"))
+
+# Shared keep-alive pool for the MOFSL REST host (all instances / API keys).
+# MOFSL_TIMEOUT = "connect,read" seconds
+MOFSL_TIMEOUT = env_timeout("MOFSL_TIMEOUT", (3.05, 20))
+# Rate_limit class by the last URL segment; buckets are per clientcode
+MOFSL_RATE_CLASSES = {
+    "placeorder":  ORDER,
+    "modifyorder": ORDER,
+    "cancelorder": ORDER,
+    "getltpdata":  DATA,
+    "*":           NONTRADING,
+}
+m_HttpClient = get_client(
+    "motilal",
+    pool_maxsize=int(env_num("MOFSL_HTTP_POOL_MAXSIZE", 32)),
+    default_timeout=MOFSL_TIMEOUT,
+    rate_classes=MOFSL_RATE_CLASSES,
+)
+
 # ErrorLogs
 try:
     os.mkdir('Logs')
@@ -41,58 +65,139 @@ except FileExistsError:
 
 try:   
     MainPath = os.getcwd()
-    os.chdir('Logs')
-    LogPath = os.getcwd()
-    os.chdir(MainPath)
+    LogPath = os.path.abspath('Logs')
 except:
     print('\nError in Assigning Path!!!')
     sys.exit()
 
+# Log lines are queued and written by one background thread that keeps a
+# long-lived handle per day-file (no os.chdir, no open/close per line).
+#   MOFSL_LOG_LEVEL     ALL (default) | FAILED (drop SUCCESS lines) | OFF
+#   MOFSL_LOG_MAX_BYTES rotate a day-file to .1, .2 ... past this size (0 = never)
+#   MOFSL_LOG_BACKUPS   rotated files kept per day-file
+LOG_LEVELS = ("ALL", "FAILED", "OFF")
+LOG_MAX_BYTES = int(os.getenv("MOFSL_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("MOFSL_LOG_BACKUPS", "5"))
+LOG_FLUSH_S = float(os.getenv("MOFSL_LOG_FLUSH_S", "1"))
+LOG_FILES = {
+    "library": "_OpenApiLibrary(python).Log",
+    "broadcast": "_OpenApiBroadcast(python).Log",
+    "tradestatus": "_OpenApiTradeStatus(python).Log",
+}
+m_LogLevel = (os.getenv("MOFSL_LOG_LEVEL", "ALL") or "ALL").upper()
+m_LogQueue = Queue(maxsize=int(os.getenv("MOFSL_LOG_QUEUE_MAX", "100000")))
+m_LogLock = Lock()
+m_LogState = {"thread": None, "dropped": 0}
+
+def SetLogLevel(f_level):
+    global m_LogLevel
+    l_level = str(f_level or "ALL").upper()
+    if l_level not in LOG_LEVELS:
+        raise ValueError("log level must be one of " + ", ".join(LOG_LEVELS))
+    m_LogLevel = l_level
+
+class _DayFileWriter(object):
+    # one open handle per log kind; reopened on date change or size rotation
+
+    def __init__(self, f_suffix):
+        self.m_suffix = f_suffix
+        self.m_date = None
+        self.m_path = None
+        self.m_file = None
+
+    def _rotate(self):
+        self.m_file.close()
+        self.m_file = None
+        for i in range(LOG_BACKUPS - 1, 0, -1):
+            l_src = self.m_path + "." + str(i)
+            if os.path.exists(l_src):
+                os.replace(l_src, self.m_path + "." + str(i + 1))
+        if LOG_BACKUPS > 0:
+            os.replace(self.m_path, self.m_path + ".1")
+        else:
+            os.remove(self.m_path)
+
+    def write(self, f_date, f_line):
+        if self.m_date != f_date:
+            self.close()
+            self.m_date = f_date
+            self.m_path = os.path.join(LogPath, f_date + self.m_suffix)
+        if self.m_file is not None and LOG_MAX_BYTES > 0 and self.m_file.tell() >= LOG_MAX_BYTES:
+            self._rotate()
+        if self.m_file is None:
+            self.m_file = open(self.m_path, "a+")
+        self.m_file.write(f_line)
+
+    def flush(self):
+        if self.m_file is not None:
+            self.m_file.flush()
+
+    def close(self):
+        if self.m_file is not None:
+            self.m_file.close()
+            self.m_file = None
+
+def _LogWriterLoop():
+    l_writers = {}
+    l_last_flush = time.time()
+    while True:
+        try:
+            l_item = m_LogQueue.get(timeout=LOG_FLUSH_S)
+        except Exception:
+            l_item = None
+        if l_item is not None:
+            l_kind, l_date, l_line = l_item
+            try:
+                l_writer = l_writers.get(l_kind)
+                if l_writer is None:
+                    l_writer = l_writers[l_kind] = _DayFileWriter(LOG_FILES[l_kind])
+                l_writer.write(l_date, l_line)
+            except Exception as e:
+                print('\nError in Writing Logs!!! ' + str(e))
+        # flush once the queue is drained (or at least every LOG_FLUSH_S)
+        if m_LogQueue.empty() or time.time() - l_last_flush >= LOG_FLUSH_S:
+            for l_writer in l_writers.values():
+                try:
+                    l_writer.flush()
+                except Exception:
+                    pass
+            l_last_flush = time.time()
+
+def _EnqueueLog(f_kind, f_status, f_filename, f_message):
+    if m_LogLevel == "OFF" or (m_LogLevel == "FAILED" and f_status == "SUCCESS"):
+        return
+    if m_LogState["thread"] is None:
+        with m_LogLock:
+            if m_LogState["thread"] is None:
+                l_thread = Thread(target=_LogWriterLoop, name="mofsl-log-writer", daemon=True)
+                l_thread.start()
+                m_LogState["thread"] = l_thread
+    strdate = datetime.now()
+    x = strdate.strftime("%Y-%m-%d %H:%M:%S")
+    logmessage = str(x) + ("             ") + str(f_status) + ("             ") + str(f_filename) + ("             ") + str(f_message) + "\n"
+    try:
+        m_LogQueue.put_nowait((f_kind, strdate.strftime("%d-%b-%Y"), logmessage))
+    except Exception:
+        m_LogState["dropped"] += 1
+
+def FlushLogs(f_timeout = 5.0):
+    # wait (bounded) for queued lines to reach the writer
+    l_deadline = time.time() + f_timeout
+    while not m_LogQueue.empty() and time.time() < l_deadline:
+        time.sleep(0.01)
+    time.sleep(min(LOG_FLUSH_S, 0.05))
+
+atexit.register(FlushLogs, 2.0)
+
 
 def WriteIntoLog(f_status, f_filename, f_message):
-    try:
-        dt = datetime.now()
-        x = dt.strftime("%Y-%m-%d %H:%M:%S")
-        logmessage = str(x) + ("             ") + f_status + ("             ") + f_filename + ("             ") + f_message + "\n"
-        os.chdir(LogPath)
-        strdate = datetime.now()
-        Logfile = open(str(strdate.strftime("%d-%b-%Y")) + "_OpenApiLibrary(python).Log","a+")
-        os.chdir(MainPath)
-        Logfile.write(logmessage)
-        Logfile.close()
-    except:
-        print('\nError in Writing Logs!!!')
-        sys.exit()
+    _EnqueueLog("library", f_status, f_filename, f_message)
 
 def WriteIntoLog_Broadcast(f_status, f_filename, f_message):
-    try:
-        dt = datetime.now()
-        x = dt.strftime("%Y-%m-%d %H:%M:%S")
-        logmessage = str(x) + ("             ") + f_status + ("             ") + f_filename + ("             ") + f_message + "\n"
-        os.chdir(LogPath)
-        strdate = datetime.now()
-        Logfile = open(str(strdate.strftime("%d-%b-%Y")) + "_OpenApiBroadcast(python).Log","a+")
-        os.chdir(MainPath)
-        Logfile.write(logmessage)
-        Logfile.close()
-    except:
-        print('\nError in Writing Logs!!!')
-        sys.exit()
+    _EnqueueLog("broadcast", f_status, f_filename, f_message)
 
 def WriteIntoLog_TradeStatus(f_status, f_filename, f_message):
-    try:
-        dt = datetime.now()
-        x = dt.strftime("%Y-%m-%d %H:%M:%S")
-        logmessage = str(x) + ("             ") + f_status + ("             ") + f_filename + ("             ") + f_message + "\n"
-        os.chdir(LogPath)
-        strdate = datetime.now()
-        Logfile = open(str(strdate.strftime("%d-%b-%Y")) + "_OpenApiTradeStatus(python).Log","a+")
-        os.chdir(MainPath)
-        Logfile.write(logmessage)
-        Logfile.close()
-    except:
-        print('\nError in Writing Logs!!!')
-        sys.exit()
+    _EnqueueLog("tradestatus", f_status, f_filename, f_message)
 
 
 # def WriteIntoLog(f_status, f_filename, f_message):
@@ -148,7 +253,7 @@ def GetLocalIPAddress():
 
 def GetPublicIPAddress():
     try:        
-        public_ip = get('http://checkip.dyndns.org/').text
+        public_ip = get('http://checkip.dyndns.org/', timeout=PUBLIC_IP_TIMEOUT).text
         ipaddress=str(re.findall(r'[0-9]+(?:\.[0-9]+){3}',public_ip))
 
         finalipppp=ipaddress.replace("'","")
@@ -265,6 +370,69 @@ def GetLatitudeLongitude():
         return lst_latlng
 
 
+# Device identity is the same for every instance in a process: probe it once,
+# cache it for MOFSL_IDENTITY_TTL seconds and refresh in the background after
+# that, so constructing MOFSLOPENAPI is an in-memory operation. Any field can
+# be pinned with env: MOFSL_MAC_ADDRESS, MOFSL_LOCAL_IP, MOFSL_PUBLIC_IP,
+# MOFSL_OS_NAME, MOFSL_OS_VERSION, MOFSL_INSTALLED_APP_ID, MOFSL_DEVICE_MODEL,
+# MOFSL_MANUFACTURER, MOFSL_PRODUCT_NAME, MOFSL_PRODUCT_VERSION,
+# MOFSL_LATITUDE / MOFSL_LONGITUDE.
+IDENTITY_TTL = float(os.getenv("MOFSL_IDENTITY_TTL", "21600"))
+m_IdentityCache = {"values": None, "ts": 0.0, "refreshing": False}
+m_IdentityLock = Lock()
+
+def ProbeDeviceIdentity():
+    def _env_or(f_key, f_probe):
+        l_val = os.getenv(f_key)
+        return l_val if l_val else f_probe()
+
+    l_latlng = GetLatitudeLongitude()
+    if os.getenv("MOFSL_LATITUDE") and os.getenv("MOFSL_LONGITUDE"):
+        l_latlng = [float(os.getenv("MOFSL_LATITUDE")), float(os.getenv("MOFSL_LONGITUDE"))]
+
+    return {
+        "macaddress": _env_or("MOFSL_MAC_ADDRESS", GetMacAddress),
+        "clientlocalip": _env_or("MOFSL_LOCAL_IP", GetLocalIPAddress),
+        "clientpublicip": _env_or("MOFSL_PUBLIC_IP", GetPublicIPAddress),
+        "osname": _env_or("MOFSL_OS_NAME", GetOsName),
+        "osversion": _env_or("MOFSL_OS_VERSION", GetOsVersion),
+        "installedappid": str(_env_or("MOFSL_INSTALLED_APP_ID", GetInstalledAppid)),
+        "devicemodel": _env_or("MOFSL_DEVICE_MODEL", GetDeviceModel),
+        "manufacturer": _env_or("MOFSL_MANUFACTURER", GetManufacturer),
+        "productname": _env_or("MOFSL_PRODUCT_NAME", GetProductName),
+        "productversion": _env_or("MOFSL_PRODUCT_VERSION", GetProductVersion),
+        "latlng": l_latlng,
+    }
+
+def _RefreshDeviceIdentity():
+    try:
+        l_values = ProbeDeviceIdentity()
+        with m_IdentityLock:
+            m_IdentityCache["values"] = l_values
+            m_IdentityCache["ts"] = time.time()
+    finally:
+        m_IdentityCache["refreshing"] = False
+
+def GetDeviceIdentity(f_refresh = False):
+    # first call probes inline (once per process); an expired entry is served
+    # as-is while one background thread refreshes it
+    with m_IdentityLock:
+        l_values = m_IdentityCache["values"]
+        if l_values is None or f_refresh:
+            l_values = ProbeDeviceIdentity()
+            m_IdentityCache["values"] = l_values
+            m_IdentityCache["ts"] = time.time()
+            return dict(l_values)
+        l_stale = (time.time() - m_IdentityCache["ts"]) > IDENTITY_TTL
+        if l_stale and not m_IdentityCache["refreshing"]:
+            m_IdentityCache["refreshing"] = True
+            Thread(target=_RefreshDeviceIdentity, name="mofsl-identity", daemon=True).start()
+        return dict(l_values)
+
+def WarmDeviceIdentity():
+    # probe in the background at startup so the first login doesn't pay for it
+    Thread(target=GetDeviceIdentity, name="mofsl-identity-warm", daemon=True).start()
+
 
 class MOFSLOPENAPI(object):
 
@@ -323,38 +491,86 @@ class MOFSLOPENAPI(object):
     BroadcastAutoRelogin_counter = 1
     TCPBroadcastAutoRelogin_counter = 1
     m_LastMsgTime = 0
+    m_headers = None
+    m_timeout = MOFSL_TIMEOUT
 
     def __init__(self, f_apikey, f_Base_Url, f_clientcode, f_strSourceID, f_browsername, f_browserversion):
         WriteIntoLog("SUCCESS", "MOFSLOPENAPI.py", "Initilize Constructor")
 
+        l_identity = GetDeviceIdentity()
+
         self.m_strApikey = f_apikey
-        self.m_strMACAddress = GetMacAddress()
-        self.m_strClientLocalIP = GetLocalIPAddress()
-        self.m_strClientPublicIP = GetPublicIPAddress()
+        self.m_strMACAddress = l_identity["macaddress"]
+        self.m_strClientLocalIP = l_identity["clientlocalip"]
+        self.m_strClientPublicIP = l_identity["clientpublicip"]
         self.m_strSourceID = f_strSourceID
         self.m_strApiSecretkey = self.m_strApiSecretkey
         self.m_Base_Url = f_Base_Url
         self.m_clientcodeDealer = f_clientcode
 
-        self.m_osname = GetOsName()
-        self.m_osversion = GetOsVersion()
-        self.m_installedappid = str(GetInstalledAppid())
-        self.m_devicemodel = GetDeviceModel()
-        self.m_manufacturer = GetManufacturer()
-        self.m_productname = GetProductName()
-        self.m_productversion = GetProductVersion()
+        self.m_osname = l_identity["osname"]
+        self.m_osversion = l_identity["osversion"]
+        self.m_installedappid = l_identity["installedappid"]
+        self.m_devicemodel = l_identity["devicemodel"]
+        self.m_manufacturer = l_identity["manufacturer"]
+        self.m_productname = l_identity["productname"]
+        self.m_productversion = l_identity["productversion"]
         self.m_browsername = f_browsername
         self.m_browserversion = f_browserversion
 
-        self.m_latitudelongitude = GetLatitudeLongitude()
+        self.m_latitudelongitude = l_identity["latlng"]
 
         # self.Websocket_URL = self.Websocket_URL
         # self.l_scrip_code = []
         # self.l_exchange_index = []
         self.Websocket_version = self.Websocket_version
 
+        # static identity headers, built once; validate() only sends them
+        try:
+            self.m_headers = MOFSLOPENAPI.BuildHeaders(self)
+        except Exception as e:
+            WriteIntoLog("FAILED", "MOFSLOPENAPI.py", ("BuildHeaders " + str(e)))
+
         WriteIntoLog("SUCCESS", "MOFSLOPENAPI.py", "Initilize Constructor Done")
 
+    def BuildHeaders(self):
+        m_headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization" : self.m_strMOFSLToken,
+            "User-Agent" : self.m_strUseragent,
+            "apikey": self.m_strApikey, 
+            "apisecretkey" : self.m_strApiSecretkey,
+            "macaddress": self.m_strMACAddress,
+            "clientlocalip": self.m_strClientLocalIP,
+            "sourceid": self.m_strSourceID,
+            "clientpublicip": self.m_strClientPublicIP,
+            "vendorinfo": self.m_vendorinfo,
+
+            "osname": self.m_osname, 
+            "osversion" : self.m_osversion,
+            "installedappid": self.m_installedappid,
+            "devicemodel": self.m_devicemodel,
+            "manufacturer": self.m_manufacturer,
+            "productname": self.m_productname,
+            "productversion": self.m_productversion,
+
+            "latitude": str("%.4f" % self.m_latitudelongitude[0]),
+            "longitude": str("%.4f" % self.m_latitudelongitude[1]),
+            "sdkversion":"Python 3.0"
+        }
+
+        if self.m_strSourceID.upper() == "WEB":
+            m_headers["browsername"] = self.m_browsername
+            m_headers["browserversion"] = self.m_browserversion
+
+        return m_headers
+
+    def SetAuthToken(self, f_token):
+        self.m_strMOFSLToken = f_token
+        if self.m_headers is not None:
+            self.m_headers["Authorization"] = f_token
+
     def GetUrl(self, f_ApiPath):
         base_Url= self.m_Base_Url
         # ver = "/rest/v1"
@@ -481,43 +697,13 @@ class MOFSLOPENAPI(object):
 
         try:
 
-            m_headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization" : self.m_strMOFSLToken,
-                "User-Agent" : self.m_strUseragent,
-                "apikey": self.m_strApikey, 
-                "apisecretkey" : self.m_strApiSecretkey,
-                "macaddress": self.m_strMACAddress,
-                "clientlocalip": self.m_strClientLocalIP,
-                "sourceid": self.m_strSourceID,
-                "clientpublicip": self.m_strClientPublicIP,
-                "vendorinfo": self.m_vendorinfo,
-
-                "osname": self.m_osname, 
-                "osversion" : self.m_osversion,
-                "installedappid": self.m_installedappid,
-                "devicemodel": self.m_devicemodel,
-                "manufacturer": self.m_manufacturer,
-                "productname": self.m_productname,
-                "productversion": self.m_productversion,
-
-                "latitude": str("%.4f" % self.m_latitudelongitude[0]),
-                "longitude": str("%.4f" % self.m_latitudelongitude[1]),
-                "sdkversion":"Python 3.0"
-
-                # "browsername": self.m_browsername,
-                # "browserversion": self.m_browserversion,
-                # "imeino": self.m_imeino
-
-            }
-
-            if self.m_strSourceID.upper() == "WEB":
-                m_headers["browsername"] = self.m_browsername
-                m_headers["browserversion"] = self.m_browserversion
+            if self.m_headers is None:
+                self.m_headers = MOFSLOPENAPI.BuildHeaders(self)
 
-            # print(m_headers)            
-            response = requests.post(f_URL, headers= m_headers, data = json.dumps(f_Data))
+            # print(self.m_headers)
+            l_account = (f_Data.get("clientcode") if isinstance(f_Data, dict) else None) or self.m_clientcode or self.m_clientcodeDealer
+            response = m_HttpClient.post(f_URL, headers= self.m_headers, data = json.dumps(f_Data), timeout = self.m_timeout,
+                                         endpoint = str(f_URL).rstrip("/").rsplit("/", 1)[-1].lower(), account = l_account)
             # print("JSON Response ", response.content)
             j_ResponseMessage = response.content.decode('utf-8')
 
@@ -641,6 +827,8 @@ class MOFSLOPENAPI(object):
             
             self.m_vendorinfo = f_vendorinfo
             self.m_clientcode = f_clientID
+            if self.m_headers is not None:
+                self.m_headers["vendorinfo"] = f_vendorinfo
 
             f_strallcombine = f_password + self.m_strApikey 
             h = hashlib.sha256(f_strallcombine.encode("utf-8"))
@@ -660,7 +848,7 @@ class MOFSLOPENAPI(object):
             if "POST ERROR " not in l_strJSON:
                 l_strDICT = json.loads(l_strJSON)
                 if l_strDICT["status"] == "SUCCESS" :
-                    self.m_strMOFSLToken = l_strDICT["AuthToken"]      
+                    MOFSLOPENAPI.SetAuthToken(self, l_strDICT["AuthToken"])
                     WriteIntoLog("SUCCESS", "MOFSLOPENAPI.py", "Login sucessfully")
 
                 else:
@@ -700,7 +888,7 @@ class MOFSLOPENAPI(object):
             if "POST ERROR " not in l_strJSON:
                 l_strDICT = json.loads(l_strJSON)
                 if l_strDICT["status"] == "SUCCESS" :
-                    self.m_strMOFSLToken = ""      
+                    MOFSLOPENAPI.SetAuthToken(self, "")
                     WriteIntoLog("SUCCESS", "MOFSLOPENAPI.py", "Logout sucessfully")  
                 else:
                     WriteIntoLog(l_strDICT["status"], "MOFSLOPENAPI.py", l_strDICT["message"])
@@ -2196,7 +2384,9 @@ class MOFSLOPENAPI(object):
 
     def Websocket2_connect(self):
 
-        if self.m_Base_Url == "https://openapi.motilaloswaluat.com":
+        if os.getenv("MO_TRADESTATUS_WS_URL"):
+            l_TradeStatus_connect_URL = os.getenv("MO_TRADESTATUS_WS_URL")
+        elif self.m_Base_Url == "https://openapi.motilaloswaluat.com":
             l_TradeStatus_connect_URL = "wss://openapi.motilaloswaluat.com/ws"
         elif self.m_Base_Url == "https://openapi.motilaloswal.com":
             l_TradeStatus_connect_URL = "wss://openapi.motilaloswal.com/ws"
@@ -2228,7 +2418,7 @@ class MOFSLOPENAPI(object):
         
 
     def TradeStatus_connect(self):
-        t2 = Thread(target=self.Websocket2_connect)
+        t2 = Thread(target=self.Websocket2_connect, daemon=True)
         # starting thread 2
         t2.start()
 
@@ -2312,12 +2502,16 @@ class MOFSLOPENAPI(object):
 
         if self.TradeStatusHeartbeat_flag:
             def background_task():
-                while not background_task.cancelled:
-                    self.TradeStatus_HeartBeat()
+                # one heartbeat per connection: stop once this socket is replaced or closed
+                while not background_task.cancelled and self.ws2 is ws2:
+                    try:
+                        self.TradeStatus_HeartBeat()
+                    except Exception:
+                        break
                     time.sleep(30)
 
             background_task.cancelled = False
-            t = Thread(target=background_task)
+            t = Thread(target=background_task, daemon=True)
             t.start()
         # if TradeStatusHeartbeat_flag:
         #     background_task.cancelled = False 
@@ -0,0 +1,335 @@
+# Market_data.py
+"""
+Process-wide market-data hub on MOFSLOPENAPI's broadcast feed.
+
+One feed connection per process, on a single designated Motilal session
+(MD_MOTILAL_USERID, else the first client with a live session). Instruments
+are (feed exchange, scripcode) pairs in the SDK's exchange names
+(NSE, BSE, NSEFO, BSEFO, MCX, NSECD, NCDEX).
+
+Subscriptions are reference-counted: subscribe()/unsubscribe() for long-lived
+readers (a /stream/ticks connection), lease() for one-shot readers (/ltp,
+holdings, positions) that keeps a scrip registered for MD_LEASE_S after its
+last use. The feed registers at most m_MaxBroadcastLimit scrips (SDK default
+200 when the broker reports none); ref-counted ones win over leases, newest
+leases over older ones.
+
+Every tick updates a latest-tick table, feeds LTPs into Ltp_service (so
+holdings valuation and position MTM pick them up) and wakes /stream/ticks
+watchers. MD_FEED_TRANSPORT=tcp uses the SDK's raw TCP feed instead of the
+WebSocket; MD_FEED=0 disables the hub.
+"""
+import asyncio, json, os, threading, time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from Ltp_service import ltp_service
+
+Inst = Tuple[str, str]          # (feed exchange, scripcode)
+
+MD_ENABLED      = os.getenv("MD_FEED", "1") == "1"
+MD_TRANSPORT    = os.getenv("MD_FEED_TRANSPORT", "ws").lower()
+MD_LEASE_S      = float(os.getenv("MD_LEASE_S", "120"))
+MD_TICK_TTL_S   = float(os.getenv("MD_TICK_TTL_S", "60"))
+MD_MAINTAIN_S   = float(os.getenv("MD_MAINTAIN_S", "5"))
+MD_CONNECT_WAIT_S = float(os.getenv("MD_CONNECT_WAIT_S", "30"))
+MD_STREAM_MIN_S = float(os.getenv("MD_STREAM_MIN_INTERVAL_S", "0.25"))
+MD_HEARTBEAT_S  = float(os.getenv("STREAM_HEARTBEAT_S", "15"))
+SDK_DEFAULT_LIMIT = 200
+
+# any exchange / segment spelling used in this repo -> SDK feed exchange
+_FEED_EXCHANGE = {
+    "NSE": "NSE", "NSE_EQ": "NSE",
+    "BSE": "BSE", "BSE_EQ": "BSE",
+    "NFO": "NSEFO", "NSEFO": "NSEFO", "NSE_FO": "NSEFO", "NSE_FNO": "NSEFO",
+    "BFO": "BSEFO", "BSEFO": "BSEFO", "BSE_FNO": "BSEFO",
+    "MCX": "MCX", "MCX_COMM": "MCX",
+    "NSECD": "NSECD", "CDS": "NSECD", "NSE_CURRENCY": "NSECD",
+    "NCDEX": "NCDEX",
+}
+_CASH = {"NSE", "BSE"}
+
+
+def inst(exchange: Any, code: Any) -> Inst:
+    ex = str(exchange or "NSE").strip().upper()
+    try:
+        cd = str(int(float(code)))
+    except (TypeError, ValueError):
+        cd = str(code or "").strip()
+    return _FEED_EXCHANGE.get(ex, ex), cd
+
+
+class _TickWatcher:
+    """One /stream/ticks connection: coalesces changed instruments until sent."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, insts: Set[Inst]):
+        self.loop = loop
+        self.insts = insts
+        self.dirty: Set[Inst] = set()
+        self.event = asyncio.Event()
+
+    def mark(self, key: Inst) -> None:
+        """Called from the feed thread."""
+        def _set():
+            self.dirty.add(key)
+            self.event.set()
+        try:
+            self.loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            pass                            # loop closed: client went away
+
+
+class MarketDataHub:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._io = threading.Lock()                     # serialises SDK register/unregister sends
+        self._session: Optional[Callable[[], Optional[Tuple[str, Any]]]] = None
+        self._sdk: Any = None
+        self._uid = ""
+        self._connected = False
+        self._connecting_at = 0.0
+        self._refs: Dict[Inst, int] = {}
+        self._leases: Dict[Inst, float] = {}            # inst -> expiry (monotonic)
+        self._registered: Set[Inst] = set()
+        self._ticks: Dict[Inst, Dict[str, Any]] = {}
+        self._watchers: List[_TickWatcher] = []
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"ticks": 0, "registers": 0, "unregisters": 0, "over_limit": 0, "reconnects": 0}
+
+    # ---------- lifecycle ----------
+    def start(self, session: Callable[[], Optional[Tuple[str, Any]]]) -> None:
+        """session() -> (userid, MOFSLOPENAPI) for the designated feed session, or None."""
+        if not MD_ENABLED:
+            return
+        self._session = session
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="market-data", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"[md] maintain error: {e}", flush=True)
+            time.sleep(MD_MAINTAIN_S)
+
+    def maintain(self) -> None:
+        """Connect if needed, expire leases, reconcile registrations."""
+        if self._sdk is None or not self._connected:
+            self._connect()
+        now = time.monotonic()
+        with self._lock:
+            for k in [k for k, exp in self._leases.items() if exp < now]:
+                del self._leases[k]
+        self._sync()
+
+    def _connect(self) -> None:
+        if self._session is None or time.monotonic() - self._connecting_at < MD_CONNECT_WAIT_S:
+            return                                  # no session source, or an attempt is still in flight
+        got = self._session()
+        if not got:
+            return
+        uid, sdk = got
+        if sdk is self._sdk and self._connected:
+            return
+        sdk._Broadcast_on_open = self._on_open
+        sdk._Broadcast_on_message = self._on_message
+        sdk._Broadcast_on_close = self._on_close
+        sdk.BroadcastAutoRelogin_flag = False       # reconnects are ours (maintain), not the SDK timer's
+        with self._lock:
+            if self._sdk is not None:
+                self.stats["reconnects"] += 1
+            self._sdk, self._uid = sdk, uid
+            self._registered.clear()                # a new connection starts with nothing registered
+        self._connecting_at = time.monotonic()
+        print(f"[md] connecting broadcast feed ({MD_TRANSPORT}) on {uid}", flush=True)
+        if MD_TRANSPORT == "tcp":
+            threading.Thread(target=sdk.TCPBroadcast_connect, name="md-tcp", daemon=True).start()
+            self._connected = True                  # TCP has no open callback
+        else:
+            sdk.Broadcast_connect()
+
+    def _on_open(self, ws1) -> None:
+        self._connected = True
+        with self._lock:
+            self._registered.clear()
+        print(f"[md] feed open on {self._uid}", flush=True)
+        threading.Thread(target=self._sync, name="md-sync", daemon=True).start()
+
+    def _on_close(self, ws1, *_a) -> None:
+        if ws1 is getattr(self._sdk, "ws1", None):
+            self._connected = False
+            self._connecting_at = 0.0               # next maintain() reconnects
+            print("[md] feed closed", flush=True)
+
+    # ---------- subscriptions ----------
+    def limit(self) -> int:
+        n = int(getattr(self._sdk, "m_MaxBroadcastLimit", 0) or 0)
+        return n if n > 0 else SDK_DEFAULT_LIMIT
+
+    def subscribe(self, insts: Iterable[Inst]) -> None:
+        with self._lock:
+            for k in insts:
+                self._refs[k] = self._refs.get(k, 0) + 1
+        self._sync()
+
+    def unsubscribe(self, insts: Iterable[Inst]) -> None:
+        with self._lock:
+            for k in insts:
+                n = self._refs.get(k, 0) - 1
+                if n > 0:
+                    self._refs[k] = n
+                else:
+                    self._refs.pop(k, None)
+        self._sync()
+
+    def lease(self, insts: Iterable[Inst], seconds: float = MD_LEASE_S) -> None:
+        """Keep <insts> registered for a while (one-shot readers)."""
+        if not MD_ENABLED:
+            return
+        exp = time.monotonic() + seconds
+        new = False
+        with self._lock:
+            for k in insts:
+                if k[1]:
+                    new = new or k not in self._leases and k not in self._refs
+                    self._leases[k] = exp
+        if new:
+            self._sync()
+
+    def _wanted(self) -> List[Inst]:
+        with self._lock:
+            held = sorted(self._refs)
+            leased = sorted((k for k in self._leases if k not in self._refs),
+                            key=lambda k: self._leases[k], reverse=True)
+        return held + leased
+
+    def _sync(self) -> None:
+        """Register/unregister so the feed carries the wanted set, up to the limit."""
+        sdk = self._sdk
+        if sdk is None or not self._connected:
+            return
+        with self._io:
+            wanted = self._wanted()
+            limit = self.limit()
+            keep = set(wanted[:limit])
+            with self._lock:
+                self.stats["over_limit"] = max(0, len(wanted) - limit)
+                drop = self._registered - keep
+                add = [k for k in wanted[:limit] if k not in self._registered]
+            for ex, code in drop:
+                try:
+                    (sdk.TCPUnRegister if MD_TRANSPORT == "tcp" else sdk.UnRegister)(
+                        ex, "CASH" if ex in _CASH else "DERIVATIVES", int(code))
+                except Exception as e:
+                    print(f"[md] unregister {ex}:{code} failed: {e}", flush=True)
+                with self._lock:
+                    self._registered.discard((ex, code))
+                    self.stats["unregisters"] += 1
+            for ex, code in add:
+                try:
+                    (sdk.TCPRegister if MD_TRANSPORT == "tcp" else sdk.Register)(
+                        ex, "CASH" if ex in _CASH else "DERIVATIVES", int(code))
+                except Exception as e:
+                    print(f"[md] register {ex}:{code} failed: {e}", flush=True)
+                    continue
+                with self._lock:
+                    self._registered.add((ex, code))
+                    self.stats["registers"] += 1
+
+    # ---------- ticks ----------
+    def _on_message(self, ws1, message_type: str, data: Any) -> None:
+        if message_type not in ("LTP", "DayOHLC", "OpenInterest", "MarketDepth", "Index") or not isinstance(data, dict):
+            return
+        key = inst(data.get("Exchange"), data.get("Scrip Code"))
+        with self._lock:
+            tick = self._ticks.setdefault(key, {"exchange": key[0], "code": key[1]})
+            tick[message_type] = data
+            tick["time"] = data.get("Time")
+            tick["at"] = time.time()
+            if message_type == "LTP":
+                tick["ltp"] = data.get("LTP_Rate")
+            elif message_type == "Index":
+                tick["ltp"] = data.get("Rate")
+            watchers = [w for w in self._watchers if key in w.insts]
+            self.stats["ticks"] += 1
+        if message_type in ("LTP", "Index") and tick.get("ltp"):
+            ltp_service.push(key[0], key[1], tick["ltp"])
+        for w in watchers:
+            w.mark(key)
+
+    def tick(self, key: Inst) -> Optional[Dict[str, Any]]:
+        """Latest tick for <key> if it is recent enough to trust."""
+        with self._lock:
+            t = self._ticks.get(key)
+            if t is None or time.time() - t.get("at", 0) > MD_TICK_TTL_S:
+                return None
+            return dict(t)
+
+    def ltp(self, insts: Iterable[Inst],
+            fetch: Optional[Callable[[str, str], Optional[float]]] = None) -> Dict[Inst, Dict[str, Any]]:
+        """
+        Batch LTP: feed ticks first, then the shared LTP cache / REST fetch for
+        the rest. Every instrument asked for is leased onto the feed.
+        """
+        insts = list(dict.fromkeys(insts))
+        self.lease(insts)
+        out: Dict[Inst, Dict[str, Any]] = {}
+        missing: List[Inst] = []
+        for k in insts:
+            t = self.tick(k)
+            if t and t.get("ltp"):
+                out[k] = {"ltp": t["ltp"], "source": "feed", "time": t.get("time")}
+            else:
+                missing.append(k)
+        if missing and fetch is not None:
+            for k, price in ltp_service.get_many(missing, fetch).items():
+                out[inst(*k)] = {"ltp": price, "source": "rest", "time": None}
+        return out
+
+    # ---------- /stream/ticks ----------
+    async def events(self, insts: List[Inst]):
+        """Async generator of SSE chunks: a snapshot, then coalesced tick batches."""
+        loop = asyncio.get_running_loop()
+        w = _TickWatcher(loop, set(insts))
+        with self._lock:
+            self._watchers.append(w)
+        await loop.run_in_executor(None, self.subscribe, insts)
+        try:
+            snap = [t for t in (self.tick(k) for k in insts) if t]
+            yield _sse("snapshot", {"ticks": snap})
+            while True:
+                try:
+                    await asyncio.wait_for(w.event.wait(), timeout=MD_HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                await asyncio.sleep(MD_STREAM_MIN_S)        # coalesce bursts
+                w.event.clear()
+                keys, w.dirty = w.dirty, set()
+                ticks = [t for t in (self.tick(k) for k in keys) if t]
+                if ticks:
+                    yield _sse("ticks", {"ticks": ticks})
+        finally:
+            with self._lock:
+                if w in self._watchers:
+                    self._watchers.remove(w)
+            threading.Thread(target=self.unsubscribe, args=(insts,), daemon=True).start()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": MD_ENABLED, "transport": MD_TRANSPORT, "session": self._uid,
+                "connected": self._connected, "limit": self.limit() if self._sdk is not None else None,
+                "registered": len(self._registered), "subscribed": len(self._refs),
+                "leased": len(self._leases), "ticks_held": len(self._ticks),
+                "watchers": len(self._watchers), **self.stats,
+            }
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str, separators=(',', ':'))}\n\n"
+
+
+market_data = MarketDataHub()
@@ -0,0 +1,273 @@
+# Motilal_order_feed.py
+"""
+Motilal order / trade events from the SDK's TradeStatus WebSocket.
+
+Every logged-in MOFSLOPENAPI session gets one TradeStatus connection
+(Tradelogin + OrderSubscribe + TradeSubscribe) whose messages feed the shared
+MotilalOrderStore, keyed by uniqueorderid in GetOrderBook field names
+(orderstatus, orderqty, symboltoken, lastmodifiedtime ...). Trade events are
+kept per order for fill confirmations.
+
+As with the Dhan feed, a client is "live" once its connection is open and the
+store has been seeded by one GetOrderBook read after that; Broker_motilal
+then reads the book and modify snapshots from the store and only goes back to
+REST to reconcile after a disconnect. add_listener(fn) calls fn(client id,
+order) after every applied order event (not trades); listeners must not block.
+
+MO_TRADE_FEED=0 disables it; MO_TRADESTATUS_WS_URL overrides the socket URL
+(see MOFSLOPENAPI.Websocket2_connect).
+"""
+import json, os, threading, time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+FEED_ENABLED    = os.getenv("MO_TRADE_FEED", "1") == "1"
+RECONNECT_MAX_S = float(os.getenv("MO_TRADE_FEED_RECONNECT_MAX_S", "60"))
+
+_TRADE_KEYS = ("tradeno", "tradeid", "tradenumber", "tradeprice", "tradetime")
+
+
+def _mod_time(o: Dict[str, Any]) -> datetime:
+    """lastmodifiedtime ("16-Oct-2026 09:15:02"); unknown sorts first."""
+    raw = str(o.get("lastmodifiedtime") or o.get("recordinserttime") or "").strip()
+    for fmt in ("%d-%b-%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d-%m-%Y %H:%M:%S"):
+        try:
+            return datetime.strptime(raw, fmt)
+        except ValueError:
+            pass
+    return datetime.min
+
+
+def _records(message: Any) -> List[Dict[str, Any]]:
+    """TradeStatus frames: a bare record, or {"data": record | [records]}."""
+    try:
+        msg = json.loads(message) if isinstance(message, (str, bytes)) else message
+    except Exception:
+        return []
+    if isinstance(msg, dict) and "data" in msg:
+        msg = msg.get("data")
+    if isinstance(msg, dict):
+        msg = [msg]
+    return [r for r in msg or [] if isinstance(r, dict) and r.get("uniqueorderid")] if isinstance(msg, list) else []
+
+
+class MotilalOrderStore:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._orders: Dict[str, Dict[str, Any]] = {}          # uniqueorderid -> order
+        self._trades: Dict[str, Dict[str, Dict[str, Any]]] = {}   # uniqueorderid -> trade no -> trade
+        self._by_client: Dict[str, Set[str]] = {}
+        self._pushed: Dict[str, float] = {}
+        self._connected: Set[str] = set()
+        self._seeded: Set[str] = set()
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.stats = {"orders": 0, "trades": 0, "stale": 0, "seeds": 0}
+
+    def add_listener(self, fn: Callable[[str, Dict[str, Any]], None]) -> None:
+        self._listeners.append(fn)
+
+    def _put(self, uid: str, order: Dict[str, Any]) -> bool:
+        oid = str(order.get("uniqueorderid") or "")
+        if not oid:
+            return False
+        cur = self._orders.get(oid)
+        if cur is not None and _mod_time(cur) > _mod_time(order):
+            self.stats["stale"] += 1
+            return False
+        merged = dict(cur or {})
+        merged.update({k: v for k, v in order.items() if v not in (None, "")})
+        merged["clientid"] = uid
+        self._orders[oid] = merged
+        self._by_client.setdefault(uid, set()).add(oid)
+        return True
+
+    # ---------- writers ----------
+    def apply_message(self, uid: str, message: Any) -> int:
+        """One TradeStatus frame. Returns how many records were applied."""
+        n = 0
+        applied: List[Tuple[str, Dict[str, Any]]] = []
+        with self._cond:
+            for rec in _records(message):
+                oid = str(rec["uniqueorderid"])
+                owner = str(rec.get("clientid") or rec.get("clientcode") or uid)
+                if any(k in rec for k in _TRADE_KEYS):
+                    tno = next((str(rec[k]) for k in ("tradeno", "tradeid", "tradenumber") if rec.get(k)),
+                               str(len(self._trades.get(oid, {}))))
+                    self._trades.setdefault(oid, {})[tno] = dict(rec)
+                    self._by_client.setdefault(owner, set()).add(oid)
+                    self.stats["trades"] += 1
+                    n += 1
+                elif self._put(owner, rec):
+                    self._pushed[oid] = time.monotonic()
+                    self.stats["orders"] += 1
+                    n += 1
+                    if self._listeners:
+                        applied.append((owner, dict(self._orders[oid])))
+            if n:
+                self._cond.notify_all()
+        for owner, order in applied:
+            for fn in list(self._listeners):
+                try:
+                    fn(owner, order)
+                except Exception as e:
+                    print(f"[mo-feed] listener error: {e}", flush=True)
+        return n
+
+    def apply_rest(self, uid: str, orders: Iterable[Dict[str, Any]]) -> None:
+        """Seed/reconcile from GetOrderBook; drops the client's orders the book no longer has."""
+        uid = str(uid)
+        with self._cond:
+            seen = set()
+            for o in orders or []:
+                if isinstance(o, dict) and o.get("uniqueorderid"):
+                    self._put(uid, dict(o))
+                    seen.add(str(o["uniqueorderid"]))
+            recent = time.monotonic() - 5.0
+            for oid in list(self._by_client.get(uid, ())):
+                if oid not in seen and self._pushed.get(oid, 0.0) < recent:
+                    self._by_client[uid].discard(oid)
+                    self._orders.pop(oid, None)
+                    self._trades.pop(oid, None)
+                    self._pushed.pop(oid, None)
+            if uid in self._connected:
+                self._seeded.add(uid)
+            self.stats["seeds"] += 1
+            self._cond.notify_all()
+
+    def set_connected(self, uid: str, up: bool) -> None:
+        with self._cond:
+            if up:
+                self._connected.add(uid)
+            else:
+                self._connected.discard(uid)
+                self._seeded.discard(uid)      # events may be missed: reconcile over REST
+
+    # ---------- readers ----------
+    def live(self, uid: str) -> bool:
+        uid = str(uid)
+        return uid in self._connected and uid in self._seeded
+
+    def orders(self, uid: str) -> List[Dict[str, Any]]:
+        """The client's orders, latest modification first."""
+        with self._cond:
+            rows = [dict(self._orders[o]) for o in self._by_client.get(str(uid), ()) if o in self._orders]
+        rows.sort(key=_mod_time, reverse=True)
+        return rows
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            o = self._orders.get(str(order_id))
+            return dict(o) if o is not None else None
+
+    def trades(self, order_id: str) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [dict(t) for t in self._trades.get(str(order_id), {}).values()]
+
+    def wait_for(self, order_id: str, done: Callable[[str], bool], timeout: float) -> Optional[str]:
+        """
+        Block until done(lower-cased orderstatus) holds; returns that status, or
+        None on timeout. A trade event on an order with no final status counts as "traded".
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                oid = str(order_id)
+                st = str((self._orders.get(oid) or {}).get("orderstatus") or "").lower()
+                if not done(st) and self._trades.get(oid) and done("traded"):
+                    st = "traded"
+                if st and done(st):
+                    return st
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                self._cond.wait(left)
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"orders_held": len(self._orders), "clients": len(self._by_client),
+                    "connected": sorted(self._connected),
+                    "live": sorted(self._connected & self._seeded), **self.stats}
+
+
+order_store = MotilalOrderStore()
+
+
+class MotilalTradeFeed:
+    """Hooks TradeStatus callbacks on each MOFSLOPENAPI session and connects it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Any] = {}             # userid -> sdk with a feed
+        self._backoff: Dict[str, float] = {}
+
+    def attach(self, uid: str, sdk: Any) -> None:
+        if not FEED_ENABLED or not uid or sdk is None:
+            return
+        with self._lock:
+            if self._sessions.get(uid) is sdk:
+                return
+            self._sessions[uid] = sdk
+
+        up = {"ws": None}       # connection whose login the server has answered
+
+        def _on_open(ws2):
+            try:
+                sdk.Tradelogin()
+                sdk.OrderSubscribe()
+                sdk.TradeSubscribe()
+                print(f"[mo-feed] {uid} subscribed, waiting for the server", flush=True)
+            except Exception as e:
+                print(f"[mo-feed] {uid} subscribe failed: {e}", flush=True)
+
+        def _on_message(ws2, _message_type, message):
+            # first frame after Tradelogin = login acknowledged: only now is the feed usable
+            if up["ws"] is not ws2 and self._sessions.get(uid) is sdk:
+                up["ws"] = ws2
+                order_store.set_connected(uid, True)
+                self._backoff[uid] = 1.0
+                print(f"[mo-feed] {uid} live", flush=True)
+            try:
+                order_store.apply_message(uid, message)
+            except Exception as e:
+                print(f"[mo-feed] {uid} bad message: {e}", flush=True)
+
+        def _on_close(ws2, *_a):
+            up["ws"] = None
+            if self._sessions.get(uid) is sdk:       # a replaced session must not mark its successor down
+                order_store.set_connected(uid, False)
+            sdk.TradeStatusHeartbeat_flag = True        # SDK clears it on close; the next connection needs it
+            delay = self._backoff.get(uid, 1.0)
+            self._backoff[uid] = min(RECONNECT_MAX_S, delay * 2)
+            print(f"[mo-feed] {uid} disconnected, reconnect in {delay:.0f}s", flush=True)
+
+            def _reconnect():
+                # skip if detached/re-logged in, or the SDK already reconnected after an error
+                if self._sessions.get(uid) is sdk and sdk.ws2 is ws2:
+                    sdk.TradeStatus_connect()
+            t = threading.Timer(delay, _reconnect)
+            t.daemon = True
+            t.start()
+
+        # the SDK calls these per-instance hooks from its WebSocket thread
+        sdk._TradeStatus_on_open = _on_open
+        sdk._TradeStatus_on_message = _on_message
+        sdk._TradeStatus_on_close = _on_close
+        sdk.TradeStatus_connect()
+
+    def detach(self, uid: str) -> None:
+        with self._lock:
+            sdk = self._sessions.pop(uid, None)
+        order_store.set_connected(uid, False)     # before close: the reconnect timer sees it detached
+        try:
+            if sdk is not None and sdk.ws2 is not None:
+                sdk.ws2.close()
+        except Exception:
+            pass
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = sorted(self._sessions)
+        return {"enabled": FEED_ENABLED, "sessions": sessions, "store": order_store.status()}
+
+
+trade_feed = MotilalTradeFeed()
@@ -1,14 +1,35 @@
 # MultiBroker_Router.py
-import os, json, importlib, base64
-from typing import Any, Dict, List,Optional
+import os, json, base64, asyncio, functools
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import FastAPI, Body, BackgroundTasks, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from collections import OrderedDict
-import importlib, os, time
+import os, time
 import threading
-import os, sqlite3, threading, requests
+import os, threading, requests
 from fastapi import Query
 import pandas as pd
+from Broker_fanout import fan_out_async, run_blocking, bind_loop, run_sync, client_id_of
+from Client_registry import client_registry
+from Broker_registry import broker_registry
+from Http_pool import all_stats as http_pool_stats
+from Async_http import all_stats as async_http_stats, close_all as close_async_http
+from Order_dispatch import all_status as dispatch_status
+from Rate_limit import rate_limiter
+from Snapshot_cache import snapshot_cache
+from Ltp_service import ltp_service
+from Market_data import market_data, inst as md_inst
+import Symbol_search
+from Symbol_db import symbol_db
+from Instrument_cache import instrument_cache
+from Github_mirror import GithubMirror
+from Live_stream import StreamHub
+from Dhan_order_feed import order_feed as dhan_order_feed, order_store as dhan_order_store
+from Motilal_order_feed import trade_feed as motilal_trade_feed
+from Flatten import flattener
+from Group_plans import group_plans
+from Copy_trading import copy_engine
 
 
 STAT_KEYS = ["pending", "traded", "rejected", "cancelled", "others"]
@@ -16,7 +37,7 @@ summary_data_global: Dict[str, Dict[str, Any]] = {}
 SYMBOL_DB_PATH = os.path.join(os.path.abspath(os.environ.get("DATA_DIR", "./data")), "symbols.db")
 SYMBOL_TABLE   = "symbols"
 SYMBOL_CSV_URL = "https://raw.githubusercontent.com/Pramod541988/Stock_List/refs/heads/main/security_id.csv"
-_symbol_db_lock = threading.Lock()
+_symbol_db_lock = threading.Lock()   # serialises refreshes; readers use symbol_db's pool
 
 
 # --- GitHub global config (single source of truth) ---
@@ -41,6 +62,9 @@ def GH_CONTENTS_URL(rel_path: str) -> str:
 
 # -------- Option B storage --------
 BASE_DIR = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
+
+# background, coalescing replication of data/ to GitHub (see Github_mirror.py)
+github_mirror = GithubMirror(GITHUB_OWNER, GITHUB_REPO, GITHUB_BRANCH, GITHUB_TOKEN, BASE_DIR)
 CLIENTS_ROOT = os.path.join(BASE_DIR, "clients")
 DHAN_DIR     = os.path.join(CLIENTS_ROOT, "dhan")
 MO_DIR       = os.path.join(CLIENTS_ROOT, "motilal")
@@ -169,80 +193,46 @@ def _github_sync_dir(rel_dir: str):
             pass
 
 
+SYNC_DIRS = ("clients/dhan", "clients/motilal", "groups", "copy_setups")
+_sync_state: Dict[str, Any] = {"ready": False, "started": None, "finished": None, "result": None}
+
 def _github_sync_down_all():
-    for rel in ("clients/dhan", "clients/motilal", "groups", "copy_setups"):
-        _github_sync_dir(rel)
+    """One recursive tree listing + concurrent download of changed blobs;
+    falls back to the per-directory contents listing if that fails."""
+    _sync_state["started"] = time.time()
+    try:
+        _sync_state["result"] = github_mirror.sync_down(list(SYNC_DIRS))
+    except Exception as e:
+        print(f"[github] tree sync failed ({e}); falling back to per-directory sync", flush=True)
+        for rel in SYNC_DIRS:
+            try:
+                _github_sync_dir(rel)
+            except Exception as e2:
+                print(f"[github] sync {rel} failed: {e2}", flush=True)
+        _sync_state["result"] = {"fallback": True, "error": str(e)}
+    finally:
+        _sync_state["finished"] = time.time()
+        _sync_state["ready"] = True
 
 
 # === GitHub persistence helpers ===
 def _github_file_write(rel_path: str, content: str) -> None:
     """
-    Create or update a file in GitHub at <rel_path> on GITHUB_BRANCH.
-    Uses global config (GITHUB_*). No-op if config incomplete.
+    Queue <content> for <rel_path> on GITHUB_BRANCH. Returns immediately;
+    github_mirror coalesces and commits in the background.
     """
     if not (GITHUB_OWNER and GITHUB_REPO and rel_path):
         return  # missing config or bad path
-
-    url = GH_CONTENTS_URL(rel_path)
-
-    # Try to get current sha (use ?ref=branch for correct head)
-    sha = None
-    try:
-        resp = requests.get(f"{url}?ref={GITHUB_BRANCH}", headers=GH_HEADERS(), timeout=15)
-        if resp.status_code == 200:
-            sha = (resp.json() or {}).get("sha")
-    except Exception:
-        pass
-
-    try:
-        b64 = base64.b64encode((content or "").encode("utf-8")).decode("utf-8")
-    except Exception:
-        return
-
-    payload = {
-        "message": f"Update {rel_path}",
-        "content": b64,
-        "branch": GITHUB_BRANCH,
-    }
-    if sha:
-        payload["sha"] = sha
-
-    try:
-        requests.put(url, headers=GH_HEADERS(), json=payload, timeout=20)
-    except Exception:
-        pass
+    github_mirror.write(rel_path, content)
 
 
 def _github_file_delete(rel_path: str) -> None:
     """
-    Delete a file in GitHub at <rel_path> on GITHUB_BRANCH.
-    Uses global config (GITHUB_*). No-op if config incomplete or file missing.
+    Queue deletion of <rel_path> on GITHUB_BRANCH (background, batched).
     """
     if not (GITHUB_OWNER and GITHUB_REPO and rel_path):
         return
-
-    url = GH_CONTENTS_URL(rel_path)
-
-    # Need current sha for delete
-    sha = None
-    try:
-        r = requests.get(f"{url}?ref={GITHUB_BRANCH}", headers=GH_HEADERS(), timeout=15)
-        if r.status_code == 200:
-            sha = (r.json() or {}).get("sha")
-    except Exception:
-        pass
-    if not sha:
-        return
-
-    payload = {
-        "message": f"Delete {rel_path}",
-        "sha": sha,
-        "branch": GITHUB_BRANCH,
-    }
-    try:
-        requests.delete(url, headers=GH_HEADERS(), json=payload, timeout=20)
-    except Exception:
-        pass
+    github_mirror.delete(rel_path)
 
 from datetime import datetime, timezone
 
@@ -261,8 +251,8 @@ def _is_token_expired(client: dict) -> bool:
 
 def refresh_symbol_db_from_github() -> str:
     """
-    Download CSV and rebuild SQLite table 'symbols'.
-    Creates helpful indexes for fast LIKE queries.
+    Download CSV and rebuild SQLite table 'symbols' (+ FTS5 trigram table)
+    into a fresh file that atomically replaces symbols.db.
     """
     _ensure_dirs()
     # Download -> dataframe
@@ -274,25 +264,8 @@ def refresh_symbol_db_from_github() -> str:
     df = pd.read_csv(csv_path)
 
     with _symbol_db_lock:
-        conn = sqlite3.connect(SYMBOL_DB_PATH)
-        try:
-            df.to_sql(SYMBOL_TABLE, conn, index=False, if_exists="replace")
-            # indexes (ignore failures if columns already indexed / absent)
-            try:
-                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_sym_symbol ON {SYMBOL_TABLE} ("Stock Symbol");')
-            except Exception:
-                pass
-            try:
-                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_sym_exchange ON {SYMBOL_TABLE} (Exchange);')
-            except Exception:
-                pass
-            try:
-                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_sym_secid ON {SYMBOL_TABLE} ("Security ID");')
-            except Exception:
-                pass
-            conn.commit()
-        finally:
-            conn.close()
+        symbol_db.rebuild(df)
+    _load_symbol_index()
     return "success"
 
 def _symbol_db_exists() -> bool:
@@ -306,6 +279,19 @@ def _lazy_init_symbol_db():
         except Exception as e:
             print("❌ Symbol DB init failed:", e)
 
+def _load_symbol_index():
+    """(Re)build the in-memory typeahead index and instrument cache from symbols.db."""
+    if not _symbol_db_exists():
+        return
+    try:
+        Symbol_search.load_rows(symbol_db.rows('Exchange, [Stock Symbol], [Security ID]'))
+    except Exception as e:
+        print("❌ Symbol index build failed:", e)
+    try:
+        instrument_cache.load()
+    except Exception as e:
+        print("❌ Instrument cache load failed:", e)
+
 
 @app.post("/refresh_symbols")
 def router_refresh_symbols():
@@ -323,53 +309,18 @@ def router_search_symbols(q: str = Query(""), exchange: str = Query("")):
       0 = exact match on whole query
       1 = symbol startswith whole query
       2 = symbol contains whole query (anywhere)
+    Served from the in-memory Symbol_search index (no DB / lock per keystroke).
     """
-    _lazy_init_symbol_db()
-    raw = (q or "").strip().lower()
-    exch = (exchange or "").strip().upper()
-    if not raw:
-        return {"results": []}
-
-    # split into words for WHERE (AND-of-words)
-    words = [w for w in raw.split() if w]
-    if not words:
-        return {"results": []}
-
-    where_sql, where_params = [], []
-    for w in words:
-        where_sql.append('LOWER([Stock Symbol]) LIKE ?')
-        where_params.append(f"%{w}%")
-    if exch:
-        where_sql.append('UPPER(Exchange) = ?')
-        where_params.append(exch)
-
-    # ranking based on full raw query (not just first word)
-    rank_params = [raw, f"{raw}%", f"%{raw}%"]
-
-    sql = f"""
-        SELECT
-            Exchange,
-            [Stock Symbol],
-            [Security ID],
-            CASE
-                WHEN LOWER([Stock Symbol]) = ?     THEN 0
-                WHEN LOWER([Stock Symbol]) LIKE ?  THEN 1
-                WHEN LOWER([Stock Symbol]) LIKE ?  THEN 2
-                ELSE 3
-            END AS rank_score
-        FROM {SYMBOL_TABLE}
-        WHERE {' AND '.join(where_sql)}
-        ORDER BY rank_score, [Stock Symbol]
-        LIMIT 200
-    """
-
-    with _symbol_db_lock:
-        conn = sqlite3.connect(SYMBOL_DB_PATH)
-        try:
-            cur = conn.execute(sql, rank_params + where_params)
-            rows = cur.fetchall()
-        finally:
-            conn.close()
+    if Symbol_search.current() is None:
+        _lazy_init_symbol_db()
+        _load_symbol_index()
+    if Symbol_search.current() is not None:
+        rows = Symbol_search.search(q, exchange, limit=200)
+    elif symbol_db.exists():
+        # index not built (yet): FTS5-backed query on the read-only pool
+        rows = symbol_db.search(q, exchange, limit=200)
+    else:
+        rows = []
 
     results = [
         {"id": f"{r[0]}|{r[1]}|{r[2]}", "text": f"{r[0]} | {r[1]}"}
@@ -409,7 +360,11 @@ def _save(path: str, data: Dict[str, Any]):
     # write to local file
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=4)
-    # replicate to GitHub
+        f.flush()
+        os.fsync(f.fileno())
+    # keep the in-memory client index coherent (no-op for non-client paths)
+    client_registry.upsert_path(path, data)
+    # replicate to GitHub (queued; does not block the request)
     try:
         rel_path = os.path.relpath(path, BASE_DIR)
         # Normalise path separators for GitHub
@@ -532,6 +487,9 @@ def _update_minimal(broker: str, payload: Dict[str, Any]) -> str:
         try:
             if os.path.exists(old_path):
                 os.remove(old_path)
+            client_registry.forget_path(old_path)
+            _forget_session(os.path.basename(os.path.dirname(old_path)),
+                            os.path.splitext(os.path.basename(old_path))[0])
         except Exception:
             pass
 
@@ -564,13 +522,12 @@ def _dispatch_login(broker: str, path: str):
             print(f"[router] skip login ({broker}/{client.get('userid')}): missing required fields")
             return
 
-        # Load broker module
-        mod_name = "Broker_dhan" if broker == "dhan" else "Broker_motilal"
-        mod = importlib.import_module(mod_name)
-        login_fn = getattr(mod, "login", None)
+        # Broker adapter (loaded once at startup)
+        adapter = broker_registry.get(broker)
+        login_fn = adapter.fn("login")
 
         if not callable(login_fn):
-            print(f"[router] {mod_name}.login() not found")
+            print(f"[router] {adapter.module.__name__}.login() not found")
             return
 
         # -------------------------
@@ -615,6 +572,16 @@ def _dispatch_login(broker: str, path: str):
 
 
 
+def _forget_session(broker: str, userid: str) -> None:
+    """Drop a removed client's live session/feeds, if the broker keeps any (logout hook)."""
+    try:
+        fn = broker_registry.get(broker).fn("logout")
+        if fn:
+            fn(userid)
+    except Exception as e:
+        print(f"[router] logout {broker}/{userid} failed: {e}")
+
+
 def _delete_client_file(broker: str, userid: str) -> bool:
     """Remove a single client's JSON file. Returns True if deleted, False if it didn't exist."""
     broker = (broker or "").lower()
@@ -623,6 +590,8 @@ def _delete_client_file(broker: str, userid: str) -> bool:
     path = _path_for(broker, userid)
     try:
         os.remove(path)
+        client_registry.forget_path(path)
+        _forget_session(broker, userid)
         # Remove from GitHub as well
         try:
             rel_path = os.path.relpath(path, BASE_DIR).replace("\\", "/")
@@ -679,6 +648,17 @@ def _find_group_path(id_or_name: str) -> str | None:
         return None
     return None
 
+def _load_group_doc(id_or_name: str) -> Optional[Dict[str, Any]]:
+    """Group document by id or name (file lookup), for compiling its plan."""
+    path = _find_group_path(id_or_name)
+    if not path:
+        return None
+    doc = _read_json(path)
+    if not isinstance(doc, dict) or not doc:
+        return None
+    doc["id"] = doc.get("id") or os.path.splitext(os.path.basename(path))[0]
+    return doc
+
 def _find_copy_path(id_or_name: str) -> str | None:
     """Find a copy-trading setup by id (filename) or by name (case-insensitive)."""
     key = _safe(id_or_name or "")
@@ -726,6 +706,7 @@ def _set_copy_enabled(payload: Dict[str, Any], value: bool):
         # ensure id field is present/stable
         doc["id"] = doc.get("id") or os.path.splitext(os.path.basename(p))[0]
         _save(p, doc)
+        copy_engine.put(doc)
         changed.append(doc["id"])
 
     return {"success": True, "changed": changed, "enabled": value}
@@ -775,20 +756,80 @@ def _build_multipliers(children: list[str], rawm) -> dict[str, float]:
 
 @app.on_event("startup")
 def _symbols_startup():
+    broker_registry.load()
     _lazy_init_symbol_db()
-    _github_sync_down_all()  # <- add this line
+    _load_symbol_index()
+    if os.getenv("GITHUB_SYNC_IN_BACKGROUND", "0") == "1":
+        # serve from local state now; /health reports ready once the sync lands
+        client_registry.reload()
+        threading.Thread(target=_background_sync_down, name="github-sync-down", daemon=True).start()
+    else:
+        _github_sync_down_all()
+        client_registry.reload()
+    client_registry.start_watcher()
+    dhan_order_feed.start(lambda: client_registry.clients("dhan"),
+                          lambda c: broker_registry.get("dhan").fn("reseed_orders")(c))
+    market_data.start(_md_session)
+    copy_engine.start(list_copytrading_setups()["setups"])
+
+def _background_sync_down():
+    _github_sync_down_all()
+    client_registry.sync_from_disk()
+    group_plans.clear()       # group files may have been replaced
+    copy_engine.load(list_copytrading_setups()["setups"])
+
+@app.on_event("startup")
+async def _bind_event_loop():
+    bind_loop(asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def _async_http_shutdown():
+    await close_async_http()
+
+@app.on_event("shutdown")
+def _mirror_shutdown():
+    # give queued GitHub writes a chance to land before the process exits
+    github_mirror.flush(timeout=float(os.getenv("GITHUB_MIRROR_SHUTDOWN_FLUSH_S", "10")))
 
 @app.get("/health")
 def health():
-    status = {}
-    for key, mod_name in (("dhan","Broker_dhan"), ("motilal","Broker_motilal")):
-        try:
-            importlib.import_module(mod_name)
-            status[key] = "ready"
-        except ModuleNotFoundError:
-            status[key] = "missing"
-        except Exception as e:
-            status[key] = f"error: {e}"
+    broker_registry.load()
+    return {
+        "ok": True,
+        "ready": _sync_state["ready"],
+        "brokers": broker_registry.status(),
+        "github_sync": _sync_state,
+        "github_mirror": github_mirror.status(),
+    }
+
+@app.get("/admin/http_stats")
+def admin_http_stats():
+    """Keep-alive pool statistics per upstream (requests, handshakes, reuse ratio)."""
+    broker_registry.load()
+    return {"ok": True, "pools": http_pool_stats(), "async_pools": async_http_stats()}
+
+@app.get("/admin/dispatch_stats")
+def admin_dispatch_stats():
+    """Order dispatcher per broker: workers, rate, active lanes, queue depth, throttle time."""
+    return {"ok": True, "dispatchers": dispatch_status()}
+
+@app.get("/admin/rate_limits")
+def admin_rate_limits():
+    """Configured limits plus per broker/class counters (calls, delayed, throttled 429s, retries)."""
+    return {"ok": True, **rate_limiter.status()}
+
+@app.get("/admin/snapshot_cache")
+def admin_snapshot_cache():
+    """Read-snapshot cache: TTL, entries, hits / misses / shared fetches / invalidations."""
+    return {"ok": True, **snapshot_cache.status()}
+
+@app.post("/admin/reload_brokers")
+def admin_reload_brokers(broker: Optional[str] = Query(None)):
+    """Explicit hot reload of broker modules (all, or ?broker=dhan|motilal)."""
+    try:
+        status = broker_registry.reload((broker or "").lower() or None)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown broker '{broker}'")
     return {"ok": True, "brokers": status}
 
 @app.post("/add_client")
@@ -820,21 +861,17 @@ def edit_client(background_tasks: BackgroundTasks, payload: Dict[str, Any] = Bod
 @app.get("/clients")
 def clients_rows():
     rows: List[Dict[str, Any]] = []
-    for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-        for fn in os.listdir(folder):
-            if not fn.endswith(".json"): continue
-            try:
-                with open(os.path.join(folder, fn), "r") as f: d = json.load(f)
-                rows.append({
-                    "name": d.get("name",""),
-                    "display_name": d.get("name",""),
-                    "client_id": d.get("userid",""),
-                    "capital": d.get("capital",""),
-                    "status": "logged_in" if d.get("session_active") else "logged_out",
-                    "session_active": bool(d.get("session_active", False)),
-                    "broker": brk
-                })
-            except: pass
+    for brk in ("dhan", "motilal"):
+        for d in client_registry.clients(brk):
+            rows.append({
+                "name": d.get("name",""),
+                "display_name": d.get("name",""),
+                "client_id": d.get("userid",""),
+                "capital": d.get("capital",""),
+                "status": "logged_in" if d.get("session_active") else "logged_out",
+                "session_active": bool(d.get("session_active", False)),
+                "broker": brk
+            })
     return rows
 
 @app.get("/get_clients")
@@ -943,6 +980,7 @@ def add_group(payload: Dict[str, Any] = Body(...)):
 
     path = _group_path(doc["id"])
     _save(path, doc)
+    group_plans.put(doc)
     return {"success": True, "group": doc}
 
 @app.get("/groups")
@@ -1016,6 +1054,7 @@ def edit_group(payload: Dict[str, Any] = Body(...)):
     doc["id"] = doc.get("id") or os.path.splitext(os.path.basename(path))[0]
 
     _save(path, doc)
+    group_plans.put(doc)
     return {"success": True, "group": doc}
 
 @app.post("/delete_group")
@@ -1032,6 +1071,7 @@ def delete_group(payload: Dict[str, Any] = Body(...)):
 
     deleted: List[str] = []
     for t in targets:
+        group_plans.drop(t)
         p = _find_group_path(t)
         if p and os.path.exists(p):
             try:
@@ -1042,7 +1082,9 @@ def delete_group(payload: Dict[str, Any] = Body(...)):
                     _github_file_delete(rel_path)
                 except Exception:
                     pass
-                deleted.append(os.path.splitext(os.path.basename(p))[0])
+                gid = os.path.splitext(os.path.basename(p))[0]
+                group_plans.drop(gid)
+                deleted.append(gid)
             except Exception:
                 # skip failures silently
                 pass
@@ -1152,6 +1194,7 @@ def save_copytrading_setup(payload: Dict[str, Any] = Body(...)):
         path = _copy_path(setup_id)
 
     _save(path, doc)
+    copy_engine.put(doc)
     return {"success": True, "mode": mode, "setup": doc}
 
 @app.post("/delete_copy_setup")
@@ -1184,6 +1227,8 @@ def delete_copy_setup(payload: Dict[str, Any] = Body(...)):
             except Exception:
                 pass
 
+    for sid in deleted:
+        copy_engine.drop(sid)
     return {"success": True, "deleted": deleted}
 
 # Optional compatibility alias if your UI ever calls this older name
@@ -1211,39 +1256,62 @@ def _guess_broker_from_order(order: Dict[str, Any]) -> str | None:
 def _broker_by_client_name(name: str) -> str | None:
     if not name:
         return None
-    needle = str(name).strip().lower()
-    for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-        try:
-            for fn in os.listdir(folder):
-                if not fn.endswith('.json'):
-                    continue
-                try:
-                    with open(os.path.join(folder, fn), 'r', encoding='utf-8') as f:
-                        d = json.load(f)
-                    nm = (d.get('name') or d.get('display_name') or '').strip().lower()
-                    if nm == needle:
-                        return brk
-                except Exception:
-                    continue
-        except FileNotFoundError:
-            pass
-    return None
+    return client_registry.broker_of_name(name)
 
-@app.get('/get_orders')
-def route_get_orders():
-    from collections import OrderedDict
-    buckets = OrderedDict({k: [] for k in STAT_KEYS})
-    for brk in ('dhan','motilal'):
+async def _fan_out_read(fn_name: str, deadline_ms: Optional[int] = None, fresh: bool = False):
+    """
+    Run <fn_name>(client) for every client of every broker concurrently on the
+    event loop, using the adapter's <fn_name>_async when it has one.
+    Reads go through snapshot_cache (short TTL, single-flight) unless <fresh>.
+    Returns (results, meta) from Broker_fanout.fan_out_async; meta.clients rows
+    carry age_ms / cached and meta.snapshot_age_ms is the oldest snapshot served.
+    """
+    dataset = fn_name.replace("get_", "").replace("_for_client", "")   # orders / positions / holdings
+    ages: Dict[Tuple[str, str], Tuple[float, bool]] = {}
+
+    def _cached(brk: str, fn):
+        async def _read(c: Dict[str, Any]):
+            cid = client_id_of(c)
+            if fresh or not cid:
+                return await fn(c)
+            value, age, hit = await snapshot_cache.get_or_fetch_async((brk, cid, dataset), lambda: fn(c))
+            ages[(brk, cid)] = (age, hit)
+            return value
+        return _read
+
+    tasks = []
+    for brk, adapter in broker_registry.items():
         try:
-            mod = importlib.import_module('Broker_dhan' if brk=='dhan' else 'Broker_motilal')
-            fn = getattr(mod, 'get_orders', None)
+            fn = adapter.fn(f"{fn_name}_async")
+            if fn is None and callable(adapter.fn(fn_name)):
+                fn = functools.partial(run_blocking, brk, adapter.fn(fn_name))
             if callable(fn):
-                data = fn()
-                if isinstance(data, dict):
-                    for k in STAT_KEYS:
-                        buckets[k].extend(data.get(k, []) or [])
+                read = _cached(brk, fn)
+                for c in adapter.list_clients():
+                    tasks.append((brk, c, read))
         except Exception as e:
-            print(f"[router] get_orders error for {brk}: {e}")
+            print(f"[router] {fn_name} setup error for {brk}: {e}")
+    deadline_s = (deadline_ms / 1000.0) if deadline_ms else None
+    results, meta = await fan_out_async(tasks, deadline_s)
+    oldest = 0.0
+    for row in meta["clients"]:
+        age, hit = ages.get((row["broker"], row["client_id"]), (0.0, False))
+        row["age_ms"] = round(age * 1000, 1)
+        row["cached"] = hit
+        if row["status"] == "ok":
+            oldest = max(oldest, age)
+    meta["snapshot_age_ms"] = round(oldest * 1000, 1)
+    return results, meta
+
+@app.get('/get_orders')
+async def route_get_orders(deadline_ms: Optional[int] = Query(None), fresh: bool = Query(False)):
+    buckets = OrderedDict({k: [] for k in STAT_KEYS})
+    results, meta = await _fan_out_read("get_orders_for_client", deadline_ms, fresh)
+    for _brk, _c, data in results:
+        if isinstance(data, dict):
+            for k in STAT_KEYS:
+                buckets[k].extend(data.get(k, []) or [])
+    buckets["meta"] = meta
     return buckets
 
 
@@ -1267,91 +1335,19 @@ def route_cancel_order(payload: Dict[str, Any] = Body(...)):
 
     messages: List[str] = []
 
-    # -------------------------
-    # D H A N
-    # -------------------------
-    if by_broker["dhan"]:
-        try:
-            dh = importlib.import_module("Broker_dhan")
-
-            # Prefer a batch API if the module provides one
-            if hasattr(dh, "cancel_orders") and callable(getattr(dh, "cancel_orders")):
-                res = dh.cancel_orders(by_broker["dhan"])
-                if isinstance(res, list):
-                    messages.extend([str(x) for x in res])
-                elif isinstance(res, dict) and isinstance(res.get("message"), list):
-                    messages.extend([str(x) for x in res["message"]])
-                else:
-                    messages.append(str(res))
-            else:
-                # Fallback: call single-order helper cancel_order_dhan(...)
-                def _load_dhan_json(name: str) -> Optional[Dict[str, Any]]:
-                    needle = (name or "").strip().lower()
-                    try:
-                        for fn in os.listdir(DHAN_DIR):
-                            if not fn.endswith(".json"):
-                                continue
-                            path = os.path.join(DHAN_DIR, fn)
-                            with open(path, "r", encoding="utf-8") as f:
-                                cj = json.load(f)
-                            nm = (cj.get("name") or cj.get("display_name") or "").strip().lower()
-                            if nm == needle:
-                                return cj
-                    except FileNotFoundError:
-                        pass
-                    return None
-
-                for od in by_broker["dhan"]:
-                    name = od.get("name", "")
-                    oid  = od.get("order_id", "")
-                    cj   = _load_dhan_json(name)
-                    if not cj or not oid:
-                        messages.append(f"❌ Missing client JSON or order_id for {name}")
-                        continue
-                    try:
-                        resp = dh.cancel_order_dhan(cj, oid)
-                        ok = isinstance(resp, dict) and str(resp.get("status", "")).lower() == "success"
-                        if ok:
-                            messages.append(f"✅ Cancelled Order {oid} for {name}")
-                        else:
-                            err = (resp.get("message") if isinstance(resp, dict) else resp)
-                            messages.append(f"❌ Failed to cancel Order {oid} for {name}: {err}")
-                    except Exception as e:
-                        messages.append(f"❌ dhan cancel failed for {name}: {e}")
-
-        except Exception as e:
-            messages.append(f"❌ dhan cancel failed: {e}")
-
-    # -------------------------
-    # M O T I L A L
-    # -------------------------
-    if by_broker["motilal"]:
+    for brk in ("dhan", "motilal"):
+        if not by_broker[brk]:
+            continue
         try:
-            mo = importlib.import_module("Broker_motilal")
-            if hasattr(mo, "cancel_orders") and callable(getattr(mo, "cancel_orders")):
-                res = mo.cancel_orders(by_broker["motilal"])
-                if isinstance(res, list):
-                    messages.extend([str(x) for x in res])
-                elif isinstance(res, dict) and isinstance(res.get("message"), list):
-                    messages.extend([str(x) for x in res["message"]])
-                else:
-                    messages.append(str(res))
+            res = broker_registry.get(brk).cancel_orders(by_broker[brk])
+            if isinstance(res, list):
+                messages.extend([str(x) for x in res])
+            elif isinstance(res, dict) and isinstance(res.get("message"), list):
+                messages.extend([str(x) for x in res["message"]])
             else:
-                # Very defensive fallback: try a per-order function if it exists
-                for od in by_broker["motilal"]:
-                    try:
-                        if hasattr(mo, "cancel_order"):
-                            r = mo.cancel_order({"orders": [od]})
-                            if isinstance(r, dict) and isinstance(r.get("message"), list):
-                                messages.extend([str(x) for x in r["message"]])
-                            else:
-                                messages.append(str(r))
-                        else:
-                            messages.append("❌ motilal cancel: no suitable function exported")
-                    except Exception as e:
-                        messages.append(f"❌ motilal cancel failed: {e}")
+                messages.append(str(res))
         except Exception as e:
-            messages.append(f"❌ motilal cancel failed: {e}")
+            messages.append(f"❌ {brk} cancel failed: {e}")
 
     # If nothing matched, keep the UI behaviour you expect
     if not by_broker["dhan"] and not by_broker["motilal"]:
@@ -1367,96 +1363,261 @@ def route_cancel_order(payload: Dict[str, Any] = Body(...)):
 
 
 @app.get("/get_positions")
-def route_get_positions():
+async def route_get_positions(deadline_ms: Optional[int] = Query(None), fresh: bool = Query(False)):
     """Merge positions from both brokers into {open:[...], closed:[...]}"""
     buckets = {"open": [], "closed": []}
-    for brk in ("dhan", "motilal"):
-        try:
-            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
-            fn  = getattr(mod, "get_positions", None)
-            if callable(fn):
-                res = fn()
-                if isinstance(res, dict):
-                    buckets["open"].extend(res.get("open", []) or [])
-                    buckets["closed"].extend(res.get("closed", []) or [])
-        except Exception as e:
-            print(f"[router] get_positions error for {brk}: {e}")
+    results, meta = await _fan_out_read("get_positions_for_client", deadline_ms, fresh)
+    for _brk, _c, res in results:
+        if isinstance(res, dict):
+            buckets["open"].extend(res.get("open", []) or [])
+            buckets["closed"].extend(res.get("closed", []) or [])
+    buckets["meta"] = meta
     return buckets
 
 @app.post("/close_positions")
-def route_close_positions(payload: Dict[str, Any] = Body(...)):
-    """payload: { positions: [{ name, symbol }, ...] }"""
+async def route_close_positions(payload: Dict[str, Any] = Body(...)):
+    """
+    payload: { positions: [{ name, symbol }, ...] }
+    Both brokers square off at the same time; "timings" has each broker's
+    per-stage milliseconds (see Square_off).
+    """
     items = payload.get("positions")
     if not isinstance(items, list):
         raise HTTPException(status_code=400, detail="'positions' must be a list")
 
-    # bucket by broker using name
-    def _which_broker(name: str) -> str | None:
-        if not name:
-            return None
-        needle = str(name).strip().lower()
-        for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-            try:
-                for fn in os.listdir(folder):
-                    if not fn.endswith(".json"): continue
-                    with open(os.path.join(folder, fn), "r", encoding="utf-8") as f:
-                        d = json.load(f)
-                    if (d.get("name") or d.get("display_name") or "").strip().lower() == needle:
-                        return brk
-            except FileNotFoundError:
-                pass
-        return None
-
+    t0 = time.perf_counter()
     buckets = {"dhan": [], "motilal": []}
     for it in items:
-        brk = _which_broker((it or {}).get("name"))
+        brk = _broker_by_client_name((it or {}).get("name"))
         if brk in buckets:
             buckets[brk].append(it)
 
-    messages: List[str] = []
-    for brk, rows in buckets.items():
-        if not rows: continue
+    async def _close(brk: str, rows: List[Dict[str, Any]]):
         try:
-            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
-            fn  = getattr(mod, "close_positions", None)
-            res = fn(rows) if callable(fn) else None
-            if isinstance(res, list):
-                messages.extend([str(x) for x in res])
-            elif isinstance(res, dict):
-                msgs = res.get("message") or res.get("messages") or []
-                if isinstance(msgs, list): messages.extend([str(x) for x in msgs])
+            return await asyncio.to_thread(broker_registry.get(brk).close_positions, rows)
         except Exception as e:
-            messages.append(f"❌ {brk} close_positions error: {e}")
+            return [f"❌ {brk} close_positions error: {e}"]
 
-    return {"message": messages}
+    todo = [(brk, rows) for brk, rows in buckets.items() if rows]
+    outs = await asyncio.gather(*(_close(brk, rows) for brk, rows in todo))
+
+    messages: List[str] = []
+    timings: Dict[str, Any] = {}
+    for (brk, _rows), res in zip(todo, outs):
+        if isinstance(res, list):
+            messages.extend([str(x) for x in res])
+        elif isinstance(res, dict):
+            msgs = res.get("message") or res.get("messages") or []
+            if isinstance(msgs, list): messages.extend([str(x) for x in msgs])
+            if isinstance(res.get("timings"), dict):
+                timings[brk] = res["timings"]
+    timings["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+
+    return {"message": messages, "timings": timings}
 @app.get("/get_holdings")
-def route_get_holdings():
+async def route_get_holdings(deadline_ms: Optional[int] = Query(None), fresh: bool = Query(False)):
     buckets = {"holdings": [], "summary": []}
-    for brk in ("dhan", "motilal"):
-        try:
-            mod = importlib.import_module("Broker_dhan" if brk == "dhan" else "Broker_motilal")
-            fn  = getattr(mod, "get_holdings", None)
-            if callable(fn):
-                res = fn()
-                if isinstance(res, dict):
-                    buckets["holdings"].extend(res.get("holdings", []) or [])
-                    buckets["summary"].extend(res.get("summary", []) or [])
-        except Exception as e:
-            print(f"[router] get_holdings error for {brk}: {e}")
+    results, meta = await _fan_out_read("get_holdings_for_client", deadline_ms, fresh)
+    for _brk, _c, res in results:
+        if isinstance(res, dict):
+            buckets["holdings"].extend(res.get("holdings", []) or [])
+            buckets["summary"].extend(res.get("summary", []) or [])
 
     # <-- keep your existing return, but also cache for /get_summary
     global summary_data_global
     # key by client name so get_summary can do .values()
-    summary_data_global = { (s.get("name") or f"client_{i}"): s
-                            for i, s in enumerate(buckets["summary"])
-                            if isinstance(s, dict) }
-
+    summaries = { (s.get("name") or f"client_{i}"): s
+                  for i, s in enumerate(buckets["summary"])
+                  if isinstance(s, dict) }
+    # slow/failed accounts keep their last known summary row
+    for row in meta["clients"]:
+        if row["status"] != "ok" and row["name"] in summary_data_global:
+            summaries.setdefault(row["name"], summary_data_global[row["name"]])
+    summary_data_global = summaries
+
+    buckets["meta"] = meta
     return buckets
 
 @app.get("/get_summary")
 def get_summary():
     return {"summary": list(summary_data_global.values())}
 
+# ---- live streams (SSE): one refresher per dataset, diffs pushed to every tab
+# (refreshers are threads: they run the async reads on the server loop)
+_order_stream = StreamHub(
+    "orders", tuple(STAT_KEYS),
+    fetch=lambda: run_sync(route_get_orders(None, False)),
+    key_fn=lambda r: str(r.get("order_id") or f"{r.get('name', '')}|{r.get('symbol', '')}|{r.get('status', '')}"),
+)
+_position_stream = StreamHub(
+    "positions", ("open", "closed"),
+    fetch=lambda: run_sync(route_get_positions(None, False)),
+    key_fn=lambda r: f"{r.get('name', '')}|{r.get('symbol', '')}",
+)
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.get("/stream/orders")
+async def stream_orders():
+    """SSE: 'snapshot' (same buckets as /get_orders) then 'diff' events keyed by order_id."""
+    return StreamingResponse(_order_stream.events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+@app.get("/stream/positions")
+async def stream_positions():
+    """SSE: 'snapshot' ({open, closed}) then 'diff' events keyed by name|symbol."""
+    return StreamingResponse(_position_stream.events(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+# ---------- market data (/ltp, /stream/ticks) ----------
+_LTP_EXCHANGES = ("NSE", "BSE", "NFO", "BFO", "MCX", "CDS")
+
+def _md_session():
+    """Designated Motilal session for the broadcast feed (resolved per call: survives broker reloads)."""
+    try:
+        return broker_registry.get("motilal").module.market_data_session()
+    except Exception as e:
+        print(f"[md] no motilal session: {e}", flush=True)
+        return None
+
+def _md_fetch_ltp(exchange: str, code: str) -> Optional[float]:
+    return broker_registry.get("motilal").module.fetch_ltp(exchange, code)
+
+def _resolve_instrument(spec: str, exchange: str = "") -> Optional[Tuple[str, str]]:
+    """'NSE:INFY', 'INFY', 'NSE:2885' or '2885' -> (feed exchange, scripcode)."""
+    ex, _, sym = (spec or "").strip().rpartition(":")
+    ex, sym = (ex or exchange or "").strip().upper(), sym.strip().upper()
+    if not sym:
+        return None
+    if sym.isdigit():
+        return md_inst(ex or "NSE", sym)
+    names = [sym] + [sym[:-len(sfx)] for sfx in ("-EQ", " EQ", "-BE") if sym.endswith(sfx)]
+    for e in ([ex] if ex else _LTP_EXCHANGES):
+        for n in names:
+            hit = instrument_cache.by_symbol(e, n)
+            if hit:
+                return md_inst(hit.exchange or e, hit.security_id)
+    return None
+
+@app.get("/ltp")
+def route_ltp(symbol: str = Query(""), symbols: str = Query(""), exchange: str = Query("")):
+    """
+    LTPs from the market-data hub (REST GetLtp for scrips not on the feed yet).
+      ?symbol=INFY                 -> {"ok", "symbol", "ltp", "source", "exchange", "code"}
+      ?symbols=NSE:INFY,NSE:2885   -> {"ok", "prices": {spec: {...} | null}}
+    """
+    specs = [x.strip() for x in ([symbol] if symbol else []) + symbols.split(",") if x.strip()]
+    if not specs:
+        raise HTTPException(status_code=400, detail="symbol or symbols required")
+    resolved = {x: _resolve_instrument(x, exchange) for x in specs}
+    got = market_data.ltp([k for k in resolved.values() if k], _md_fetch_ltp)
+    prices = {x: ({"exchange": k[0], "code": k[1], **got[k]} if k and k in got else None)
+              for x, k in resolved.items()}
+    if symbol and not symbols:
+        if not prices.get(symbol.strip()):
+            raise HTTPException(status_code=404, detail=f"no LTP for {symbol}")
+        return {"ok": True, "symbol": symbol, **prices[symbol.strip()]}
+    return {"ok": True, "prices": prices}
+
+@app.get("/stream/ticks")
+async def stream_ticks(symbols: str = Query(...), exchange: str = Query("")):
+    """SSE: 'snapshot' then coalesced 'ticks' events for the given symbols while connected."""
+    insts = list(dict.fromkeys(k for k in (_resolve_instrument(x, exchange) for x in symbols.split(",")) if k))
+    if not insts:
+        raise HTTPException(status_code=400, detail="no known symbols")
+    return StreamingResponse(market_data.events(insts), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+@app.get("/admin/market_data")
+def admin_market_data():
+    return {"ok": True, **market_data.status()}
+
+@app.get("/admin/streams")
+def admin_streams():
+    return {"ok": True, "orders": _order_stream.status(), "positions": _position_stream.status()}
+
+@app.get("/admin/dhan_order_feed")
+def admin_dhan_order_feed():
+    return {"ok": True, **dhan_order_feed.status()}
+
+@app.get("/admin/ltp_cache")
+def admin_ltp_cache():
+    return {"ok": True, **ltp_service.status()}
+
+@app.get("/admin/motilal_order_feed")
+def admin_motilal_order_feed():
+    return {"ok": True, **motilal_trade_feed.status()}
+
+# ---------- emergency flatten (kill switch) ----------
+def _flatten_accounts(scope: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """(broker, client json) for a flatten scope: all | group | broker, narrowed by each other."""
+    brokers = [scope["broker"]] if scope.get("broker") else list(broker_registry.modules)
+    if scope.get("group"):
+        path = _find_group_path(scope["group"])
+        if not path:
+            raise HTTPException(status_code=404, detail="group not found")
+        out, seen = [], set()
+        for m in _read_json(path).get("members") or []:
+            brk = str((m or {}).get("broker") or "").lower()
+            uid = str((m or {}).get("userid") or (m or {}).get("client_id") or "").strip()
+            cj = client_registry.get(brk, uid) if brk in brokers and uid else None
+            if cj and (brk, uid) not in seen:
+                seen.add((brk, uid))
+                out.append((brk, cj))
+        return out
+    return [(brk, cj) for brk in brokers for cj in client_registry.clients(brk)]
+
+@app.post("/flatten")
+async def route_flatten(payload: Dict[str, Any] = Body(...), wait: bool = Query(False)):
+    """
+    Kill switch: cancel working orders and square off open positions, all
+    matching accounts in parallel on the priority lane (see Flatten.py).
+      payload: { all?: true, group?: str, broker?: "dhan"|"motilal", symbol?: str }
+    At least one key is required. Returns the run id and its progress stream
+    (/stream/flatten/<id>); with ?wait=true, the final report instead.
+    """
+    scope = {
+        "all": bool(payload.get("all")),
+        "group": _pick(payload.get("group")) or None,
+        "broker": (_pick(payload.get("broker")) or "").lower() or None,
+        "symbol": _pick(payload.get("symbol")) or None,
+    }
+    if not any(scope.values()):
+        raise HTTPException(status_code=400, detail="scope required: all, group, broker and/or symbol")
+    if scope["broker"] and scope["broker"] not in broker_registry.modules:
+        raise HTTPException(status_code=400, detail=f"unknown broker '{scope['broker']}'")
+
+    accounts = _flatten_accounts(scope)
+    run = flattener.start(scope, accounts, lambda brk: broker_registry.get(brk).fn("flatten_account"))
+    if wait:
+        await asyncio.to_thread(run.wait)
+        return run.report()
+    return {"ok": True, "run_id": run.id, "accounts": len(accounts), "stream": f"/stream/flatten/{run.id}"}
+
+@app.get("/flatten/{run_id}")
+def flatten_report(run_id: str):
+    run = flattener.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="unknown flatten run")
+    return run.report()
+
+@app.get("/stream/flatten/{run_id}")
+async def stream_flatten(run_id: str):
+    """SSE: start / progress / account / done events of one flatten run (replayed from the start)."""
+    run = flattener.get(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="unknown flatten run")
+    return StreamingResponse(run.stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+@app.get("/admin/flatten")
+def admin_flatten():
+    return {"ok": True, **flattener.status()}
+
+@app.get("/admin/group_plans")
+def admin_group_plans():
+    return {"ok": True, **group_plans.status()}
+
+@app.get("/admin/copy_trading")
+def admin_copy_trading():
+    """Copy-trading engine: per-setup counters and master-to-child latency."""
+    return {"ok": True, **copy_engine.status()}
+
 def _safe_int(val, default=0):
     try:
         if val is None: 
@@ -1492,7 +1653,7 @@ def _pick_qty_for_client(ci: dict, per_client_qty: dict, default_qty: int) -> in
 
 @app.post("/place_orders")
 def route_place_orders(payload: Dict[str, Any] = Body(...)):
-    import importlib, os, json, csv
+    import json
     from typing import Optional, Dict, Any, List
 
     data = payload or {}
@@ -1560,181 +1721,75 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(status_code=400, detail="Trigger price is required for SL/SL-M orders.")
 
     # ------------------- client index (userid -> broker/name/json) -------------------
-    BASE_DIR   = os.path.abspath(os.environ.get("DATA_DIR", "./data"))
-    DHAN_DIR   = os.path.join(BASE_DIR, "clients", "dhan")
-    MO_DIR     = os.path.join(BASE_DIR, "clients", "motilal")
-    GROUPS_DIR = os.path.join(BASE_DIR, "groups")
-
-    def _index_clients() -> Dict[str, Dict[str, Any]]:
-        idx: Dict[str, Dict[str, Any]] = {}
-        for brk, folder in (("dhan", DHAN_DIR), ("motilal", MO_DIR)):
-            try:
-                for fn in os.listdir(folder):
-                    if not fn.endswith(".json"):
-                        continue
-                    with open(os.path.join(folder, fn), "r", encoding="utf-8") as f:
-                        cj = json.load(f)
-                    uid = str(cj.get("userid") or cj.get("client_id") or "").strip()
-                    if uid:
-                        idx[uid] = {
-                            "broker": brk,
-                            "json": cj,
-                            "name": cj.get("name") or cj.get("display_name") or uid,
-                        }
-            except FileNotFoundError:
-                continue
-        return idx
-
-    client_index = _index_clients()
+    def _client_info(uid: str) -> Optional[Dict[str, Any]]:
+        hit = client_registry.by_userid(uid)
+        if not hit:
+            return None
+        brk, cj = hit
+        return {"broker": brk, "json": cj, "name": cj.get("name") or cj.get("display_name") or uid}
 
     # ------------------- qty calc helper -------------------
     def _auto_qty_fallback(_client_id: str, _price: float) -> int:
         return quantityinlot
 
-    # ------------------- min-qty lookup helpers (CSV + optional globals) -------------------
-    def _normalize_col(name: str) -> str:
-        # "Security ID" -> "securityid", "Min qty" -> "minqty"
-        return "".join(ch for ch in str(name).lower() if ch.isalnum())
-
-    def _get_min_qty_map() -> Dict[str, int]:
-        """Cache CSV -> {security_id: min_qty} on first call. Robust to header variants."""
-        if hasattr(_get_min_qty_map, "_cache"):
-            return _get_min_qty_map._cache  # type: ignore[attr-defined]
-
-        cache: Dict[str, int] = {}
-
-        masters  = os.path.join(BASE_DIR, "masters")
-        candidates = [
-            os.environ.get("SECURITY_MIN_QTY_CSV"),
-            os.path.join(masters, "security_id_min_qty.csv"),
-            os.path.join(masters, "security_id.csv"),
-            os.path.join(BASE_DIR, "security_id_min_qty.csv"),
-            os.path.join(BASE_DIR, "security_id.csv"),
-            os.path.join(BASE_DIR, "security_master.csv"),
-            os.path.join(BASE_DIR, "security_ids.csv"),
-        ]
-        candidates = [p for p in candidates if p]
-
-        for path in candidates:
-            try:
-                if not os.path.exists(path):
-                    continue
-                with open(path, "r", encoding="utf-8") as f:
-                    rdr = csv.DictReader(f)
-                    for row in rdr:
-                        nrow = { _normalize_col(k): v for k, v in row.items() }
-                        sid = (
-                            nrow.get("securityid") or nrow.get("security_id")
-                            or nrow.get("id") or nrow.get("token")
-                            or nrow.get("symboltoken") or ""
-                        )
-                        sid = str(sid).strip()
-                        if not sid:
-                            continue
-                        raw_mq = (
-                            nrow.get("minqty") or nrow.get("minquantity")
-                            or nrow.get("lotsize") or nrow.get("tradinglot")
-                            or nrow.get("marketlot") or nrow.get("minorderqty")
-                            or "1"
-                        )
-                        try:
-                            cache[sid] = max(1, int(float(str(raw_mq).strip())))
-                        except Exception:
-                            cache[sid] = 1
-                break
-            except Exception:
-                continue
-
-        _get_min_qty_map._cache = cache  # type: ignore[attr-defined]
-        return cache
-
-    def _min_qty_for(security_id_val: str) -> int:
-        """Try user-provided helpers first, then CSV map, default=1."""
+    # ------------------- min-qty lookup (shared instrument cache) -------------------
+    def _min_qty_for(security_id_val: str, exchange: str = "") -> int:
+        """Lot size from the instrument cache, default=1."""
         if not security_id_val:
             return 1
-        for fname in ("_lookup_min_qty_sqlite", "_lookup_min_qty", "_lookup_min_qty_csv"):
-            fn = globals().get(fname)
-            if callable(fn):
-                try:
-                    v = fn(str(security_id_val))
-                    if v:
-                        return max(1, int(v))
-                except Exception:
-                    pass
-        return int(_get_min_qty_map().get(str(security_id_val), 1))
+        return instrument_cache.lot_size(security_id_val, exchange)
 
     # ------------------- make one order row -------------------
+    # everything except client/qty/tag is the same for every row of this request
+    order_fields = {
+        "action": action,
+        "ordertype": ordertype,
+        "producttype": producttype,
+        "orderduration": orderduration,
+        "exchange": exchange_val,
+        "price": price,
+        "triggerprice": triggerprice,
+        "disclosedquantity": disclosedqty,
+        "amoorder": amoorder,
+        "correlation_id": correlation_id,
+        "symbol": raw_symbol,
+        "security_id": str(security_id or ""),   # Dhan
+        "symboltoken": str(symboltoken or ""),   # Motilal
+        "stock_symbol": stock_symbol,
+    }
+
     def _build_order(client_id: str, qty: int, tag: Optional[str]) -> Dict[str, Any]:
-        ci = client_index.get(str(client_id))
+        ci = _client_info(str(client_id))
         if not ci:
             return {"_skip": True, "reason": "client_not_found", "client_id": client_id}
-        return {
-            "client_id": str(client_id),
-            "name": ci["name"],
-            "broker": ci["broker"],
-            "action": action,
-            "ordertype": ordertype,
-            "producttype": producttype,
-            "orderduration": orderduration,
-            "exchange": exchange_val,
-            "price": price,
-            "triggerprice": triggerprice,
-            "disclosedquantity": disclosedqty,
-            "amoorder": amoorder,
-            "qty": int(qty),  # front-end qty
-            "tag": tag or "",
-            "correlation_id": correlation_id,
-            "symbol": raw_symbol,
-            "security_id": str(security_id or ""),   # Dhan
-            "symboltoken": str(symboltoken or ""),   # Motilal
-            "stock_symbol": stock_symbol,
-        }
+        return {"client_id": str(client_id), "name": ci["name"], "broker": ci["broker"],
+                **order_fields, "qty": int(qty), "tag": tag or ""}   # qty: front-end qty
 
     # ------------------- expand to per-client orders -------------------
     per_client_orders: List[Dict[str, Any]] = []
 
     if groupacc:
-        def _member_ids(doc: Dict[str, Any]) -> List[str]:
-            out: List[str] = []
-            raw = (doc.get("members") or doc.get("clients") or [])
-            for m in raw:
-                if isinstance(m, dict):
-                    uid = (m.get("userid") or m.get("client_id") or m.get("id") or "").strip()
-                else:
-                    uid = str(m).strip()
-                if uid and uid not in out:
-                    out.append(uid)
-            return out
-
+        # compiled plans: members already resolved to {client_id, name, broker}
         for gsel in groups:
-            gp = (globals().get("_find_group_path")(gsel)
-                  or os.path.join(GROUPS_DIR, f"{str(gsel).replace(' ', '_')}.json"))
-            if not gp or not os.path.exists(gp):
+            plan = group_plans.get(str(gsel), _load_group_doc)
+            if plan is None:
                 per_client_orders.append({"_skip": True, "reason": f"group_file_missing:{gsel}"})
                 continue
 
-            try:
-                with open(gp, "r", encoding="utf-8") as f:
-                    gdoc = json.load(f) or {}
-            except Exception:
-                per_client_orders.append({"_skip": True, "reason": f"group_file_bad:{gsel}"})
-                continue
+            if qtySelection == "auto":
+                q = _auto_qty_fallback("", price)
+            elif diffQty:
+                q = int((perGroupQty.get(plan.key) or perGroupQty.get(plan.name) or 0) or 0)
+            elif multiplier_flag:
+                q = quantityinlot * plan.multiplier
+            else:
+                q = quantityinlot
+            q = int(q)
 
-            gname = gdoc.get("name") or gdoc.get("id") or str(gsel)
-            gkey  = gdoc.get("id") or gname
-            members = _member_ids(gdoc)
-            group_multiplier = int(gdoc.get("multiplier", 1) or 1)
-
-            for client_id in members:
-                if qtySelection == "auto":
-                    q = _auto_qty_fallback(str(client_id), price)
-                elif diffQty:
-                    q = int((perGroupQty.get(gkey) or perGroupQty.get(gname) or 0) or 0)
-                elif multiplier_flag:
-                    q = quantityinlot * group_multiplier
-                else:
-                    q = quantityinlot
-                per_client_orders.append(_build_order(str(client_id), q, gname))
+            per_client_orders.extend({**leg, **order_fields, "qty": q, "tag": plan.name}
+                                     for leg in plan.legs)
+            per_client_orders.extend({"_skip": True, "reason": "client_not_found", "client_id": uid}
+                                     for uid in plan.missing)
     else:
         for client_id in clients:
             if qtySelection == "auto":
@@ -1757,17 +1812,16 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
             by_broker[brk].append(od)
 
     # ------------------- DHAN: multiply qty by min_qty -------------------
+    # one instrument per request, so one lot-size lookup
     if by_broker.get("dhan"):
+        sid = order_fields["security_id"]
+        try:
+            minq = max(1, int(_min_qty_for(sid, exchange_val) if sid else 1))
+        except Exception:
+            minq = 1
         for od in by_broker["dhan"]:
-            try:
-                sid = od.get("security_id") or ""
-                minq = _min_qty_for(sid) if sid else 1
-                old_q = int(od.get("qty", 0))
-                new_q = old_q * max(1, int(minq))
-                od["qty"] = new_q
-                print(f"[router] DHAN lot-size applied: sid={sid} min_qty={minq} qty:{old_q} -> {new_q}")
-            except Exception:
-                od["qty"] = int(od.get("qty", 0))
+            od["qty"] = int(od.get("qty", 0)) * minq
+        print(f"[router] DHAN lot-size applied: sid={sid} min_qty={minq} to {len(by_broker['dhan'])} order(s)")
 
     # ------------------- print & dispatch -------------------
     try:
@@ -1787,14 +1841,7 @@ def route_place_orders(payload: Dict[str, Any] = Body(...)):
             continue
         try:
             print(f"[router] dispatching {len(lst)} orders to {brk}...")
-            modname = "Broker_dhan" if brk == "dhan" else "Broker_motilal"
-            mod = importlib.import_module(modname)
-            try:
-                mod = importlib.reload(mod)
-            except Exception:
-                pass
-            fn = getattr(mod, "place_orders", None)
-            res = fn(lst) if callable(fn) else {"status": "error", "message": "place_orders not implemented"}
+            res = broker_registry.get(brk).place_orders(lst)
         except Exception as e:
             res = {"status": "error", "message": str(e)}
         results[brk] = res
@@ -1819,7 +1866,7 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
       - Fills missing quantity from current pending order snapshot.
       - Sends Dhan orderType as proper enum.
     """
-    import importlib, json, os
+    import json
 
     # ---------- tiny utils ----------
     def _to_int_or_none(x):
@@ -1869,12 +1916,12 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
 
     # ----- try to fetch current order snapshot from broker (for quantity/defaults)
     def _fetch_dhan_order_snapshot(order_id: str) -> dict | None:
+        # live order-update store first: no order-book fetch per modify
+        hit = dhan_order_store.get(order_id)
+        if hit and dhan_order_store.live(hit.get("dhanClientId") or ""):
+            return hit
         try:
-            dh = importlib.import_module("Broker_dhan")
-            fn = getattr(dh, "get_orders", None)
-            if not callable(fn):
-                return None
-            data = fn() or {}
+            data = broker_registry.get("dhan").get_orders() or {}
             for key in ("pending", "traded", "rejected", "cancelled", "others"):
                 for row in (data.get(key) or []):
                     if str(row.get("order_id") or row.get("orderId") or "") == str(order_id):
@@ -1983,24 +2030,8 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
             }
             # attach client json
             # local file scan (same as in your previous version)
-            def _load_client_json_dhan(name_: str) -> Dict[str, Any] | None:
-                needle = (name_ or "").strip().lower()
-                try:
-                    for fn in os.listdir(DHAN_DIR):
-                        if not fn.endswith(".json"): continue
-                        pth = os.path.join(DHAN_DIR, fn)
-                        with open(pth, "r", encoding="utf-8") as f:
-                            cj = json.load(f)
-                        nm = (cj.get("name") or cj.get("display_name") or "").strip().lower()
-                        if nm == needle:
-                            return cj
-                except FileNotFoundError:
-                    return None
-                except Exception:
-                    return None
-                return None
-
-            row_dhan["_client_json"] = _load_client_json_dhan(name) or {}
+            hit = client_registry.by_name(name, "dhan")
+            row_dhan["_client_json"] = hit[1] if hit else {}
             # If quantity is STILL None, use 0 (better than ""), Dhan ignores unchanged fields server-side.
             if row_dhan["quantity"] is None:
                 row_dhan["quantity"] = 0
@@ -2032,14 +2063,7 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
     # Dhan
     if by_broker["dhan"]:
         try:
-            dh = importlib.import_module("Broker_dhan")
-            res = None
-            if hasattr(dh, "modify_orders") and callable(getattr(dh, "modify_orders")):
-                res = dh.modify_orders(by_broker["dhan"])
-            elif hasattr(dh, "Broker_dhan"):
-                res = getattr(dh, "Broker_dhan")().modify_orders(by_broker["dhan"])
-            else:
-                messages.append("❌ Broker_dhan.modify_orders not implemented")
+            res = broker_registry.get("dhan").modify_orders(by_broker["dhan"])
 
             try:
                 print("\n[/modify_order] DHAN RESP =>")
@@ -2057,20 +2081,16 @@ def route_modify_order(payload: Dict[str, Any] = Body(...)):
     # Motilal
     if by_broker["motilal"]:
         try:
-            mo = importlib.import_module("Broker_motilal")
-            if hasattr(mo, "modify_orders") and callable(getattr(mo, "modify_orders")):
-                res = mo.modify_orders(by_broker["motilal"])
-                try:
-                    print("\n[/modify_order] MOTILAL RESP =>")
-                    print(json.dumps(res, indent=2, default=str))
-                except Exception:
-                    pass
-                if isinstance(res, dict) and isinstance(res.get("message"), list):
-                    messages.extend([str(x) for x in res["message"]])
-                else:
-                    messages.append(str(res))
+            res = broker_registry.get("motilal").modify_orders(by_broker["motilal"])
+            try:
+                print("\n[/modify_order] MOTILAL RESP =>")
+                print(json.dumps(res, indent=2, default=str))
+            except Exception:
+                pass
+            if isinstance(res, dict) and isinstance(res.get("message"), list):
+                messages.extend([str(x) for x in res["message"]])
             else:
-                messages.append("❌ Broker_motilal.modify_orders not implemented")
+                messages.append(str(res))
         except Exception as e:
             messages.append(f"❌ motilal modify failed: {e}")
 
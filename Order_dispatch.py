@@ -0,0 +1,121 @@
+# Order_dispatch.py
+"""
+Long-lived, bounded order dispatch per broker (place / cancel / modify / square-off).
+
+  - one worker pool per broker caps in-flight order requests
+  - jobs for the same client run in submission order on a single "lane", so
+    legs for one account go out one after another, never concurrently
+  - pacing to the broker's order-rate limit (and 429 handling) happens below,
+    in Rate_limit, for every HTTP call the job makes
+
+Lanes hold a worker only while they have queued jobs; an idle account costs
+nothing. Results come back in the order the items were given.
+"""
+import os, threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+# max concurrent lanes per broker (DISPATCH_<BROKER>_WORKERS)
+DISPATCH_WORKERS: Dict[str, int] = {"dhan": 32, "motilal": 16}
+
+
+def _workers(broker: str) -> int:
+    try:
+        return int(os.getenv(f"DISPATCH_{broker.upper()}_WORKERS", DISPATCH_WORKERS.get(broker, 8)))
+    except ValueError:
+        return DISPATCH_WORKERS.get(broker, 8)
+
+
+Job = Tuple[Future, Callable[..., Any], tuple]
+
+
+class OrderDispatcher:
+    def __init__(self, broker: str, workers: int):
+        self.broker = broker
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)),
+                                        thread_name_prefix=f"orders-{broker}")
+        self._lock = threading.Lock()
+        self._lanes: Dict[str, Deque[Job]] = {}       # client key -> queued jobs (lane is active while present)
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0}
+
+    def submit(self, client_key: str, fn: Callable[..., Any], *args: Any) -> Future:
+        """Queue fn(*args) on the client's lane."""
+        key = str(client_key or "").strip() or "_"
+        fut: Future = Future()
+        with self._lock:
+            self.stats["submitted"] += 1
+            lane = self._lanes.get(key)
+            if lane is not None:
+                lane.append((fut, fn, args))
+                return fut
+            self._lanes[key] = deque([(fut, fn, args)])
+        self._pool.submit(self._drain, key)
+        return fut
+
+    def _drain(self, key: str) -> None:
+        while True:
+            with self._lock:
+                lane = self._lanes[key]
+                if not lane:
+                    del self._lanes[key]
+                    return
+                fut, fn, args = lane.popleft()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                res = fn(*args)
+            except BaseException as e:
+                with self._lock:
+                    self.stats["failed"] += 1
+                fut.set_exception(e)
+                continue
+            with self._lock:
+                self.stats["completed"] += 1
+            fut.set_result(res)
+
+    def run_all(self, items: List[Any], key_fn: Callable[[Any], str],
+                fn: Callable[[Any], Any]) -> List[Any]:
+        """
+        Dispatch fn(item) for every item (lane = key_fn(item)) and wait.
+        Results are in input order; a job that raised yields None (and is logged).
+        """
+        futs = [self.submit(key_fn(it), fn, it) for it in items]
+        out: List[Any] = []
+        for it, fut in zip(items, futs):
+            try:
+                out.append(fut.result())
+            except Exception as e:
+                print(f"[dispatch] {self.broker} job failed for {key_fn(it)}: {e}", flush=True)
+                out.append(None)
+        return out
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self._pool._max_workers,
+                "active_lanes": len(self._lanes),
+                "queued": sum(len(l) for l in self._lanes.values()),
+                **self.stats,
+            }
+
+
+_dispatchers: Dict[str, OrderDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def order_dispatcher(broker: str) -> OrderDispatcher:
+    """Process-wide dispatcher for <broker>, created on first use."""
+    broker = (broker or "").lower()
+    with _dispatchers_lock:
+        d = _dispatchers.get(broker)
+        if d is None:
+            d = OrderDispatcher(broker, _workers(broker))
+            _dispatchers[broker] = d
+        return d
+
+
+def all_status() -> Dict[str, Any]:
+    with _dispatchers_lock:
+        items = list(_dispatchers.items())
+    return {brk: d.status() for brk, d in items}
@@ -0,0 +1,289 @@
+# Rate_limit.py
+"""
+Outbound rate limiting for broker APIs.
+
+Buckets are keyed by (broker, endpoint class, account):
+  order       place / modify / cancel
+  data        market data (LTP, quotes)
+  nontrading  order book, positions, holdings, funds, profile, auth
+
+Each broker has its own limits per class (RATE_LIMITS, env override
+RATELIMIT_<BROKER>_<CLASS>="rate,burst"). Order traffic has priority: while
+order calls are pending for a broker, reads for it hold back (up to
+READ_YIELD_MAX_S) before taking their own token.
+
+call() also handles HTTP 429: it honours Retry-After (seconds or HTTP date),
+blocks that bucket until then and retries a few times. A 429 means the
+request was refused, so re-sending an order is safe. call_async() is the
+same for httpx-style async clients (Async_http), sharing the buckets.
+
+priority_lane() marks the calling thread's calls (e.g. an emergency flatten)
+as priority: they neither yield to pending orders nor wait for a token. They
+still debit the bucket (it may go negative, so ordinary traffic pays the
+debt afterwards) and still respect a server-imposed Retry-After block.
+"""
+import asyncio, os, time, threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+ORDER, DATA, NONTRADING = "order", "data", "nontrading"
+
+# (tokens per second, burst) per account
+RATE_LIMITS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    # Dhan v2 published limits: orders 10/s, data 5/s, non-trading 20/s
+    "dhan":    {ORDER: (10, 10), DATA: (5, 5), NONTRADING: (20, 20)},
+    "motilal": {ORDER: (10, 10), DATA: (5, 5), NONTRADING: (10, 10)},
+}
+DEFAULT_LIMIT = (5.0, 5.0)
+
+RETRY_429        = int(os.getenv("RATELIMIT_429_RETRIES", "2"))
+RETRY_AFTER_MAX  = float(os.getenv("RATELIMIT_RETRY_AFTER_MAX_S", "10"))
+READ_YIELD_MAX_S = float(os.getenv("RATELIMIT_READ_YIELD_MAX_S", "0.5"))
+
+
+def _limit_for(broker: str, cls: str) -> Tuple[float, float]:
+    raw = (os.getenv(f"RATELIMIT_{broker.upper()}_{cls.upper()}") or "").strip()
+    if raw:
+        try:
+            parts = [float(x) for x in raw.split(",") if x.strip()]
+            return parts[0], (parts[1] if len(parts) > 1 else parts[0])
+        except ValueError:
+            pass
+    return RATE_LIMITS.get(broker, {}).get(cls, DEFAULT_LIMIT)
+
+
+def retry_after_s(resp: Any, attempt: int) -> float:
+    """Seconds to wait after a 429: Retry-After header, else 1, 2, 4 ..."""
+    raw = ""
+    try:
+        raw = (resp.headers.get("Retry-After") or "").strip()
+    except Exception:
+        pass
+    if raw:
+        try:
+            return max(0.0, float(raw))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(raw).timestamp() - time.time())
+            except Exception:
+                pass
+    return float(2 ** attempt)
+
+
+class TokenBucket:
+    """Blocking token bucket: <rate> tokens/s, at most <burst> banked."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = max(0.001, float(rate))
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def block_for(self, seconds: float) -> None:
+        """Server told us to back off: no tokens until then, bucket drained."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._stamp = self._blocked_until      # refill starts when the block ends
+
+    def _take(self, n: float) -> float:
+        """Take <n> tokens if available (returns 0), else the seconds to wait first."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            if self._tokens >= n:
+                self._tokens -= n
+                return 0.0
+            return (n - self._tokens) / self.rate
+
+    def acquire(self, n: float = 1.0) -> float:
+        """Take <n> tokens, sleeping as needed. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            delay = self._take(n)
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def take_now(self, n: float = 1.0) -> float:
+        """Debit <n> tokens without waiting for them (down to -burst); sleeps only through a block."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._blocked_until:
+                    self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                    self._stamp = now
+                    self._tokens = max(-self.burst, self._tokens - n)
+                    return waited
+                delay = self._blocked_until - now
+            time.sleep(delay)
+            waited += delay
+
+    async def acquire_async(self, n: float = 1.0) -> float:
+        """acquire() for event-loop callers: awaits instead of blocking the thread."""
+        waited = 0.0
+        while True:
+            delay = self._take(n)
+            if delay <= 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+
+_priority = threading.local()
+
+
+class RateLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        self._orders_pending: Dict[str, int] = {}
+        self._counters: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def _bucket(self, broker: str, cls: str, account: str) -> TokenBucket:
+        key = (broker, cls, account)
+        b = self._buckets.get(key)
+        if b is None:
+            with self._lock:
+                b = self._buckets.get(key)
+                if b is None:
+                    b = self._buckets[key] = TokenBucket(*_limit_for(broker, cls))
+        return b
+
+    def _count(self, broker: str, cls: str, **inc: float) -> None:
+        with self._lock:
+            c = self._counters.setdefault((broker, cls), {
+                "calls": 0, "delayed": 0, "delayed_s": 0.0, "yielded": 0,
+                "throttled": 0, "retried": 0, "gave_up": 0, "priority": 0})
+            for k, v in inc.items():
+                c[k] += v
+
+    def _yield_to_orders(self, broker: str) -> bool:
+        deadline = time.monotonic() + READ_YIELD_MAX_S
+        yielded = False
+        while self._orders_pending.get(broker, 0) > 0 and time.monotonic() < deadline:
+            yielded = True
+            time.sleep(0.02)
+        return yielded
+
+    @contextmanager
+    def priority_lane(self):
+        """Calls from this thread inside the block skip the read yield and the token wait."""
+        prev = getattr(_priority, "on", False)
+        _priority.on = True
+        try:
+            yield
+        finally:
+            _priority.on = prev
+
+    def acquire(self, broker: str, cls: str, account: Optional[str] = None) -> float:
+        """Wait for a token on (broker, cls, account). Returns seconds delayed."""
+        t0 = time.monotonic()
+        if getattr(_priority, "on", False):
+            waited = self._bucket(broker, cls, account or "_").take_now()
+            self._count(broker, cls, calls=1, priority=1, delayed=int(waited > 0.001), delayed_s=waited)
+            return waited
+        yielded = cls != ORDER and self._yield_to_orders(broker)
+        self._bucket(broker, cls, account or "_").acquire()
+        waited = time.monotonic() - t0
+        self._count(broker, cls, calls=1, yielded=int(yielded),
+                    delayed=int(waited > 0.001), delayed_s=waited)
+        return waited
+
+    async def _yield_to_orders_async(self, broker: str) -> bool:
+        deadline = time.monotonic() + READ_YIELD_MAX_S
+        yielded = False
+        while self._orders_pending.get(broker, 0) > 0 and time.monotonic() < deadline:
+            yielded = True
+            await asyncio.sleep(0.02)
+        return yielded
+
+    async def acquire_async(self, broker: str, cls: str, account: Optional[str] = None) -> float:
+        """acquire() without blocking the event loop."""
+        t0 = time.monotonic()
+        yielded = cls != ORDER and await self._yield_to_orders_async(broker)
+        await self._bucket(broker, cls, account or "_").acquire_async()
+        waited = time.monotonic() - t0
+        self._count(broker, cls, calls=1, yielded=int(yielded),
+                    delayed=int(waited > 0.001), delayed_s=waited)
+        return waited
+
+    def _throttled(self, broker: str, cls: str, account: str, resp: Any, attempt: int) -> bool:
+        """Book a 429 (block the bucket). True if the caller should retry."""
+        wait = retry_after_s(resp, attempt)
+        self._count(broker, cls, throttled=1)
+        self._bucket(broker, cls, account).block_for(min(wait, RETRY_AFTER_MAX))
+        if attempt >= RETRY_429 or wait > RETRY_AFTER_MAX:
+            self._count(broker, cls, gave_up=1)
+            print(f"[ratelimit] {broker}/{cls} {account}: 429, giving up after "
+                  f"{attempt + 1} attempt(s)", flush=True)
+            return False
+        self._count(broker, cls, retried=1)
+        return True
+
+    def _order_pending(self, broker: str, cls: str, inc: int) -> None:
+        if cls == ORDER:
+            with self._lock:
+                self._orders_pending[broker] = self._orders_pending.get(broker, 0) + inc
+
+    def call(self, broker: str, cls: str, account: Optional[str], send: Callable[[], Any]) -> Any:
+        """
+        acquire() + send(), retrying on HTTP 429 per Retry-After.
+        Returns the last response (a 429 if every retry was refused).
+        """
+        account = account or "_"
+        self._order_pending(broker, cls, 1)
+        try:
+            attempt = 0
+            while True:
+                self.acquire(broker, cls, account)
+                resp = send()
+                if getattr(resp, "status_code", None) != 429:
+                    return resp
+                if not self._throttled(broker, cls, account, resp, attempt):
+                    return resp
+                attempt += 1
+        finally:
+            self._order_pending(broker, cls, -1)
+
+    async def call_async(self, broker: str, cls: str, account: Optional[str],
+                         send: Callable[[], Awaitable[Any]]) -> Any:
+        """call() for async clients: same buckets and 429 handling, awaited."""
+        account = account or "_"
+        self._order_pending(broker, cls, 1)
+        try:
+            attempt = 0
+            while True:
+                await self.acquire_async(broker, cls, account)
+                resp = await send()
+                if getattr(resp, "status_code", None) != 429:
+                    return resp
+                if not self._throttled(broker, cls, account, resp, attempt):
+                    return resp
+                attempt += 1
+        finally:
+            self._order_pending(broker, cls, -1)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {f"{b}/{c}": {k: (round(v, 3) if isinstance(v, float) else v) for k, v in cnt.items()}
+                        for (b, c), cnt in self._counters.items()}
+            accounts: Dict[str, int] = {}
+            for (b, c, _a) in self._buckets:
+                accounts[f"{b}/{c}"] = accounts.get(f"{b}/{c}", 0) + 1
+            pending = dict(self._orders_pending)
+        limits = {b: {c: {"rate": r, "burst": bu} for c, (r, bu) in
+                      ((c, _limit_for(b, c)) for c in (ORDER, DATA, NONTRADING))}
+                  for b in RATE_LIMITS}
+        return {"limits": limits, "counters": counters, "accounts": accounts, "orders_pending": pending}
+
+
+rate_limiter = RateLimiter()
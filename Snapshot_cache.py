@@ -0,0 +1,131 @@
+# Snapshot_cache.py
+"""
+Short-TTL cache for per-client broker reads (orders, positions, holdings).
+
+Entries are keyed by (broker, client id, dataset). Within the TTL every
+caller gets the same snapshot; when it expires, concurrent callers share one
+upstream fetch (single-flight) instead of each hitting the broker.
+
+Writes (place / cancel / modify / close) invalidate the client's entries.
+Invalidation also bumps the client's generation, so a fetch that was already
+in flight when the write happened is handed to its waiters but not stored.
+
+TTL: SNAPSHOT_TTL_S (default 1.5 s), per dataset SNAPSHOT_TTL_<DATASET>_S.
+"""
+import asyncio, os, time, threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+Key = Tuple[str, str, str]   # (broker, client id, dataset)
+
+DEFAULT_TTL_S = float(os.getenv("SNAPSHOT_TTL_S", "1.5"))
+
+
+def ttl_for(dataset: str) -> float:
+    try:
+        return float(os.getenv(f"SNAPSHOT_TTL_{dataset.upper()}_S", DEFAULT_TTL_S))
+    except ValueError:
+        return DEFAULT_TTL_S
+
+
+class SnapshotCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Key, Tuple[float, Any]] = {}        # key -> (fetched at, value)
+        self._inflight: Dict[Key, Future] = {}
+        self._gen: Dict[Tuple[str, str], int] = {}              # (broker, client) -> generation
+        self.stats = {"hits": 0, "misses": 0, "shared": 0, "invalidations": 0}
+
+    def _claim(self, key: Key, ttl: float):
+        """("hit", (value, age)) | ("wait", future) | ("own", (future, generation))."""
+        now = time.time()
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is not None and now - hit[0] <= ttl:
+                self.stats["hits"] += 1
+                return "hit", (hit[1], now - hit[0])
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.stats["shared"] += 1
+                return "wait", fut
+            fut = self._inflight[key] = Future()
+            self.stats["misses"] += 1
+            return "own", (fut, self._gen.get(key[:2], 0))
+
+    def _fail(self, key: Key, fut: Future, e: BaseException) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+        fut.set_exception(e)
+
+    def _store(self, key: Key, fut: Future, gen: int, value: Any) -> None:
+        fetched_at = time.time()
+        with self._lock:
+            self._inflight.pop(key, None)
+            if self._gen.get(key[:2], 0) == gen:
+                self._entries[key] = (fetched_at, value)
+        fut.set_result((value, fetched_at))
+
+    def get_or_fetch(self, key: Key, fetch: Callable[[], Any],
+                     ttl_s: Optional[float] = None) -> Tuple[Any, float, bool]:
+        """
+        (value, age_s, from_cache). Fetch errors propagate to every waiter
+        and are never cached.
+        """
+        kind, got = self._claim(key, ttl_for(key[2]) if ttl_s is None else ttl_s)
+        if kind == "hit":
+            return got[0], got[1], True
+        if kind == "wait":
+            value, fetched_at = got.result()
+            return value, time.time() - fetched_at, True
+
+        fut, gen = got
+        try:
+            value = fetch()
+        except BaseException as e:
+            self._fail(key, fut, e)
+            raise
+        self._store(key, fut, gen, value)
+        return value, 0.0, False
+
+    async def get_or_fetch_async(self, key: Key, fetch: Callable[[], Awaitable[Any]],
+                                 ttl_s: Optional[float] = None) -> Tuple[Any, float, bool]:
+        """get_or_fetch() for coroutine fetchers; shares entries and in-flight fetches with it."""
+        kind, got = self._claim(key, ttl_for(key[2]) if ttl_s is None else ttl_s)
+        if kind == "hit":
+            return got[0], got[1], True
+        if kind == "wait":
+            value, fetched_at = await asyncio.wrap_future(got)
+            return value, time.time() - fetched_at, True
+
+        fut, gen = got
+        try:
+            value = await fetch()
+        except BaseException as e:
+            self._fail(key, fut, e)
+            raise
+        self._store(key, fut, gen, value)
+        return value, 0.0, False
+
+    def invalidate(self, broker: str, client_ids: Iterable[str]) -> None:
+        """Drop every dataset of these clients (call after a write)."""
+        ids = {str(c).strip() for c in client_ids if str(c or "").strip()}
+        if not ids:
+            return
+        with self._lock:
+            for cid in ids:
+                self._gen[(broker, cid)] = self._gen.get((broker, cid), 0) + 1
+            for key in [k for k in self._entries if k[0] == broker and k[1] in ids]:
+                del self._entries[key]
+            self.stats["invalidations"] += len(ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"ttl_s": DEFAULT_TTL_S, "entries": len(self._entries),
+                    "inflight": len(self._inflight), **self.stats}
+
+
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,165 @@
+# Square_off.py
+"""
+Batched square-off planner shared by the broker close_positions().
+
+A request is a list of {name, symbol} rows. Instead of one positions fetch per
+row, the planner works in stages:
+
+  resolve   group rows by account (client registry lookup once per name)
+  fetch     one positions read per account, all accounts concurrently on the
+            broker's fan-out pool (SQUAREOFF_FETCH_DEADLINE_S)
+  plan      build every closing order from those rows (broker callback; lot
+            conversion via the instrument cache happens there)
+  dispatch  send all legs through the broker's order dispatcher (accounts in
+            parallel, one lane per account)
+  confirm   optional broker callback run once after every leg is out (e.g.
+            wait for fills on one shared deadline), never inside a send
+
+run() returns {"message": [...one per input row, in order...], "timings": {...}}
+where timings has per-stage milliseconds, so slow exits can be traced to the
+stage that cost the time.
+
+send_burst() is the kill-switch dispatch (Flatten): one account's legs all at
+once as priority calls instead of one after another on its dispatcher lane.
+"""
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from Broker_fanout import fan_out, client_id_of
+from Order_dispatch import order_dispatcher
+from Rate_limit import rate_limiter
+
+SQUAREOFF_FETCH_DEADLINE_S = float(os.getenv("SQUAREOFF_FETCH_DEADLINE_S", "5"))
+SQUAREOFF_BURST_WORKERS = int(os.getenv("SQUAREOFF_BURST_WORKERS", "32"))
+
+_burst_pool = ThreadPoolExecutor(max_workers=SQUAREOFF_BURST_WORKERS, thread_name_prefix="squareoff-burst")
+
+Confirm = Callable[[List[Dict[str, Any]], List[Optional[str]]], List[Optional[str]]]
+
+# plan callback result: (leg to send, None) or (None, message for the row)
+Planned = Tuple[Optional[Dict[str, Any]], Optional[str]]
+
+
+def _ms(t0: float, t1: float) -> float:
+    return round((t1 - t0) * 1000, 1)
+
+
+def run(broker: str, rows: List[Dict[str, Any]],
+        resolve: Callable[[str], Optional[Dict[str, Any]]],
+        fetch_positions: Callable[[Dict[str, Any]], List[Dict[str, Any]]],
+        plan: Callable[[Dict[str, Any], List[Dict[str, Any]], Dict[str, Any]], Planned],
+        send: Callable[[Dict[str, Any]], str],
+        lane_key: Callable[[Dict[str, Any]], str],
+        confirm: Optional[Confirm] = None) -> Dict[str, Any]:
+    """
+    resolve(name) -> client json | None
+    fetch_positions(client) -> raw position rows (raises on failure)
+    plan(client, positions, req) -> (leg, None) | (None, message)
+    send(leg) -> message; lane_key(client) -> dispatcher lane
+    confirm(legs, messages) -> messages, after all sends returned
+    Legs get the client json as leg["_client_json"] before send().
+    """
+    rows = [r if isinstance(r, dict) else {} for r in rows or []]
+    messages: List[Optional[str]] = [None] * len(rows)
+    t0 = time.perf_counter()
+
+    # ---- resolve: one lookup per account
+    clients: Dict[str, Dict[str, Any]] = {}          # name -> client json
+    wanted: Dict[str, List[int]] = {}                # name -> row indexes
+    for i, req in enumerate(rows):
+        name, symbol = req.get("name") or "", req.get("symbol") or ""
+        if not name or not symbol:
+            messages[i] = f"❌ Missing name/symbol in request: {req}"
+            continue
+        if name not in clients:
+            cj = resolve(name)
+            if not cj:
+                messages[i] = f"❌ Client not found for: {name}"
+                continue
+            clients[name] = cj
+        wanted.setdefault(name, []).append(i)
+    t_resolve = time.perf_counter()
+
+    # ---- fetch: positions once per account, accounts concurrently
+    tasks = [(broker, clients[n], fetch_positions) for n in wanted]
+    results, meta = fan_out(tasks, SQUAREOFF_FETCH_DEADLINE_S)
+    by_uid = {client_id_of(c): pos for _b, c, pos in results}
+    failed = {r["client_id"]: r["error"] for r in meta["clients"] if r["status"] != "ok"}
+    t_fetch = time.perf_counter()
+
+    # ---- plan: every closing leg from the fetched rows
+    legs: List[Tuple[int, Dict[str, Any]]] = []
+    for name, idxs in wanted.items():
+        cj = clients[name]
+        uid = client_id_of(cj)
+        if uid in failed or uid not in by_uid:
+            for i in idxs:
+                messages[i] = f"❌ Fetch positions failed for {name}: {failed.get(uid) or 'no data'}"
+            continue
+        for i in idxs:
+            try:
+                leg, msg = plan(cj, by_uid[uid] or [], rows[i])
+            except Exception as e:
+                leg, msg = None, f"❌ {name} - close {rows[i].get('symbol')}: {e}"
+            if leg is None:
+                messages[i] = msg
+            else:
+                leg.setdefault("_client_json", cj)
+                legs.append((i, leg))
+    t_plan = time.perf_counter()
+
+    # ---- dispatch: all legs, accounts in parallel
+    if legs:
+        sent = order_dispatcher(broker).run_all(
+            [leg for _i, leg in legs], lambda leg: lane_key(leg["_client_json"]), send)
+        t_sent = time.perf_counter()
+        if confirm is not None:
+            sent = confirm([leg for _i, leg in legs], sent)
+        for (i, _leg), msg in zip(legs, sent):
+            messages[i] = msg
+    else:
+        t_sent = time.perf_counter()
+    t_done = time.perf_counter()
+
+    for i, req in enumerate(rows):
+        if not messages[i]:
+            messages[i] = f"❌ {req.get('name') or ''} - close {req.get('symbol') or ''}: failed"
+
+    timings = {
+        "accounts": len(wanted),
+        "rows": len(rows),
+        "orders": len(legs),
+        "resolve_ms": _ms(t0, t_resolve),
+        "fetch_ms": _ms(t_resolve, t_fetch),
+        "plan_ms": _ms(t_fetch, t_plan),
+        "dispatch_ms": _ms(t_plan, t_sent),
+        "confirm_ms": _ms(t_sent, t_done),
+        "total_ms": _ms(t0, t_done),
+        "fetch_partial": meta["partial"],
+    }
+    print(f"[squareoff] {broker}: {len(legs)} order(s) / {len(wanted)} account(s) in "
+          f"{timings['total_ms']} ms (fetch {timings['fetch_ms']}, dispatch {timings['dispatch_ms']})", flush=True)
+    return {"message": messages, "timings": timings}
+
+
+def _priority_send(send: Callable[[Dict[str, Any]], str], leg: Dict[str, Any]) -> str:
+    with rate_limiter.priority_lane():
+        return send(leg)
+
+
+def send_burst(legs: List[Dict[str, Any]], send: Callable[[Dict[str, Any]], str],
+               confirm: Optional[Confirm] = None) -> List[Optional[str]]:
+    """
+    Send every leg at once (priority calls), then confirm(legs, messages) once
+    all are out. Messages are in leg order; a send that raised yields None.
+    """
+    futs = [_burst_pool.submit(_priority_send, send, leg) for leg in legs]
+    sent: List[Optional[str]] = []
+    for leg, fut in zip(legs, futs):
+        try:
+            sent.append(fut.result())
+        except Exception as e:
+            print(f"[squareoff] burst send failed for {leg.get('_name')}: {e}", flush=True)
+            sent.append(None)
+    return confirm(legs, sent) if confirm is not None else sent
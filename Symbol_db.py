@@ -0,0 +1,192 @@
+# Symbol_db.py
+"""
+Storage layer for the symbol master (data/symbols.db).
+
+Build:  rebuild() writes a complete new database next to the live one
+        (WAL journal while building, FTS5 trigram shadow table
+        'symbols_fts' over "Stock Symbol"), switches it back to a plain
+        rollback journal and os.replace()s it over symbols.db. Readers
+        holding the old file keep reading it until they are recycled.
+
+Read:   a small pool of read-only connections (mode=ro, immutable — the
+        live file is never written in place) shared by /search_symbols and
+        the broker adapters. Readers never take the build lock.
+"""
+import os, queue, sqlite3, threading
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Tuple
+
+SYMBOL_TABLE = "symbols"
+FTS_TABLE    = "symbols_fts"
+POOL_SIZE    = int(os.getenv("SYMBOL_DB_POOL_SIZE", "8"))
+
+
+def _fts5_trigram_available() -> bool:
+    try:
+        conn = sqlite3.connect(":memory:")
+        try:
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(x, tokenize='trigram')")
+            return True
+        finally:
+            conn.close()
+    except Exception:
+        return False
+
+
+class SymbolDb:
+    def __init__(self, path: str, pool_size: int = POOL_SIZE):
+        self.path = os.path.abspath(path)
+        self.pool_size = max(1, pool_size)
+        self._pool: "queue.LifoQueue[Tuple[int, sqlite3.Connection]]" = queue.LifoQueue()
+        self._gen = 0
+        self._build_lock = threading.Lock()
+        self.has_fts: Optional[bool] = None
+
+    # ---------- build ----------
+    def rebuild(self, df) -> None:
+        """Write <df> (pandas DataFrame of the master CSV) as the new symbols.db."""
+        with self._build_lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".building"
+            for p in (tmp, tmp + "-wal", tmp + "-shm"):
+                if os.path.exists(p):
+                    os.remove(p)
+            conn = sqlite3.connect(tmp)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                df.to_sql(SYMBOL_TABLE, conn, index=False, if_exists="replace")
+                for name, col in (("idx_sym_symbol", '"Stock Symbol"'),
+                                  ("idx_sym_exchange", "Exchange"),
+                                  ("idx_sym_secid", '"Security ID"')):
+                    try:
+                        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {SYMBOL_TABLE} ({col})")
+                    except Exception:
+                        pass
+                if _fts5_trigram_available():
+                    try:
+                        conn.execute(
+                            f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+                            f'"Stock Symbol", content=\'{SYMBOL_TABLE}\', content_rowid=\'rowid\', '
+                            f"tokenize='trigram')"
+                        )
+                        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+                    except Exception as e:
+                        print(f"[symbols] FTS5 build skipped: {e}", flush=True)
+                conn.commit()
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                # published file is read in place by immutable readers: no WAL
+                conn.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                conn.close()
+            os.replace(tmp, self.path)
+            self.invalidate()
+
+    # ---------- read pool ----------
+    def invalidate(self) -> None:
+        """Drop pooled connections; the next acquire opens the current file."""
+        self._gen += 1
+        self.has_fts = None
+        while True:
+            try:
+                _gen, conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _open(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True,
+                               check_same_thread=False)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        gen = self._gen
+        conn = None
+        while conn is None:
+            try:
+                g, c = self._pool.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+                break
+            if g == gen:
+                conn = c
+            else:
+                c.close()
+        try:
+            yield conn
+        finally:
+            if gen == self._gen and self._pool.qsize() < self.pool_size:
+                self._pool.put((gen, conn))
+            else:
+                conn.close()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def fts_ready(self) -> bool:
+        if self.has_fts is None:
+            try:
+                with self.connection() as conn:
+                    self.has_fts = conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE name = ?", (FTS_TABLE,)
+                    ).fetchone() is not None
+            except Exception:
+                return False
+        return bool(self.has_fts)
+
+    # ---------- queries ----------
+    def search(self, q: str, exchange: str = "", limit: int = 200) -> List[Tuple[Any, Any, Any]]:
+        """
+        Ranked typeahead straight from SQLite (0 exact, 1 prefix, 2 contains).
+        Words of 3+ chars are matched through the FTS5 trigram table.
+        """
+        raw = (q or "").strip().lower()
+        exch = (exchange or "").strip().upper()
+        words = [w for w in raw.split() if w]
+        if not words:
+            return []
+
+        where_sql, where_params = [], []
+        fts_words = [w for w in words if len(w) >= 3] if self.fts_ready() else []
+        if fts_words:
+            match = " AND ".join('"' + w.replace('"', '""') + '"' for w in fts_words)
+            where_sql.append(f"rowid IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH ?)")
+            where_params.append(match)
+        for w in words:
+            where_sql.append('LOWER([Stock Symbol]) LIKE ?')
+            where_params.append(f"%{w}%")
+        if exch:
+            where_sql.append('UPPER(Exchange) = ?')
+            where_params.append(exch)
+
+        sql = f"""
+            SELECT
+                Exchange,
+                [Stock Symbol],
+                [Security ID],
+                CASE
+                    WHEN LOWER([Stock Symbol]) = ?     THEN 0
+                    WHEN LOWER([Stock Symbol]) LIKE ?  THEN 1
+                    WHEN LOWER([Stock Symbol]) LIKE ?  THEN 2
+                    ELSE 3
+                END AS rank_score
+            FROM {SYMBOL_TABLE}
+            WHERE {' AND '.join(where_sql)}
+            ORDER BY rank_score, [Stock Symbol]
+            LIMIT {int(limit)}
+        """
+        with self.connection() as conn:
+            rows = conn.execute(sql, [raw, f"{raw}%", f"%{raw}%"] + where_params).fetchall()
+        return [(r[0], r[1], r[2]) for r in rows]
+
+    def rows(self, columns: str) -> List[Tuple[Any, ...]]:
+        with self.connection() as conn:
+            return conn.execute(f"SELECT {columns} FROM {SYMBOL_TABLE}").fetchall()
+
+
+symbol_db = SymbolDb(os.path.join(os.path.abspath(os.environ.get("DATA_DIR", "./data")), "symbols.db"))
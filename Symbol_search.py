@@ -0,0 +1,175 @@
+# Symbol_search.py
+"""
+In-memory typeahead index over the symbol master (symbols.db, via Symbol_db).
+
+Rows are partitioned by exchange. Each partition keeps its rows sorted by
+lower-cased symbol, which gives:
+  - prefix lookups as one bisect + contiguous slice (ranks 0 and 1)
+  - a 1/2/3-gram inverted index (row-id arrays) for substring terms (ranks 2/3)
+
+Ranking matches the old SQL:
+  0 = exact match on whole query
+  1 = symbol startswith whole query
+  2 = symbol contains whole query (anywhere)
+  3 = every query word appears somewhere in the symbol
+
+The active index is a single module reference, so readers never lock;
+rebuilds construct a fresh index and swap it in atomically.
+"""
+import threading, time
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+Row = Tuple[Any, Any, Any]   # (Exchange, Stock Symbol, Security ID)
+
+NGRAM_SIZES = (1, 2, 3)
+
+
+def _ngrams(s: str, n: int) -> Iterable[str]:
+    return (s[i:i + n] for i in range(len(s) - n + 1))
+
+
+def _has(postings: array, rid: int) -> bool:
+    i = bisect_left(postings, rid)
+    return i < len(postings) and postings[i] == rid
+
+
+class _Partition:
+    """Rows of one exchange, sorted by (lower symbol, symbol)."""
+
+    def __init__(self, rows: List[Row]):
+        rows = sorted(rows, key=lambda r: (str(r[1]).lower(), str(r[1])))
+        self.rows = rows
+        self.keys = [str(r[1]).lower() for r in rows]
+        postings: Dict[str, array] = {}
+        for rid, key in enumerate(self.keys):
+            grams = set()
+            for n in NGRAM_SIZES:
+                grams.update(_ngrams(key, n))
+            for g in grams:
+                lst = postings.get(g)
+                if lst is None:
+                    lst = postings[g] = array("i")
+                lst.append(rid)
+        self.postings = postings
+
+    def _prefix_range(self, raw: str) -> Tuple[int, int]:
+        lo = bisect_left(self.keys, raw)
+        hi = bisect_left(self.keys, raw + "\U0010ffff", lo)
+        return lo, hi
+
+    def _candidates(self, words: List[str]) -> Iterable[int]:
+        """Row ids that may match every word, in row order (verify with `in`)."""
+        lists: List[array] = []
+        for w in words:
+            n = min(len(w), NGRAM_SIZES[-1])
+            for g in set(_ngrams(w, n)):
+                lst = self.postings.get(g)
+                if lst is None:
+                    return ()
+                lists.append(lst)
+        if not lists:
+            return range(len(self.keys))
+        lists.sort(key=len)
+        if len(lists) == 1:
+            return lists[0]          # already in row order; caller can stop early
+        if len(lists[0]) * 8 < len(lists[1]):
+            first, rest = lists[0], lists[1:]
+            return [rid for rid in first if all(_has(lst, rid) for lst in rest)]
+        return sorted(set(lists[0]).intersection(*lists[1:]))
+
+    def search(self, raw: str, words: List[str], limit: int) -> List[Tuple[int, str, Row]]:
+        """Top <limit> as (rank, sort key, row), already in rank order."""
+        keys, rows = self.keys, self.rows
+        out: List[Tuple[int, str, Row]] = []
+
+        # ranks 0/1: contiguous slice; the exact match sorts first
+        lo, hi = self._prefix_range(raw)
+        for rid in range(lo, min(hi, lo + limit)):
+            out.append((0 if keys[rid] == raw else 1, keys[rid], rows[rid]))
+        need = limit - len(out)
+        if need <= 0:
+            return out
+
+        # rank 2: n-grams of the whole query (spaces included) narrow it down
+        contains: List[Tuple[int, str, Row]] = []
+        for rid in self._candidates([raw]):
+            if lo <= rid < hi:
+                continue
+            if raw in keys[rid]:
+                contains.append((2, keys[rid], rows[rid]))
+                if len(contains) >= need:
+                    break
+        out.extend(contains)
+        need -= len(contains)
+        if need <= 0 or len(words) == 1:
+            return out
+
+        # rank 3: every word somewhere, but not the whole query
+        for rid in self._candidates(words):
+            if lo <= rid < hi:
+                continue
+            key = keys[rid]
+            if raw not in key and all(w in key for w in words):
+                out.append((3, key, rows[rid]))
+                need -= 1
+                if need <= 0:
+                    break
+        return out
+
+
+class SymbolIndex:
+    def __init__(self, rows: Iterable[Row]):
+        by_exch: Dict[str, List[Row]] = {}
+        count = 0
+        for r in rows:
+            if r[1] is None:
+                continue
+            by_exch.setdefault(str(r[0] or "").upper(), []).append(r)
+            count += 1
+        self.partitions = {ex: _Partition(rs) for ex, rs in by_exch.items()}
+        self.count = count
+        self.built_at = time.time()
+
+    def search(self, q: str, exchange: str = "", limit: int = 200) -> List[Row]:
+        raw = (q or "").strip().lower()
+        words = [w for w in raw.split() if w]
+        if not words:
+            return []
+        exch = (exchange or "").strip().upper()
+        if exch:
+            part = self.partitions.get(exch)
+            parts = [part] if part else []
+        else:
+            parts = list(self.partitions.values())
+        hits: List[Tuple[int, str, Row]] = []
+        for part in parts:
+            hits.extend(part.search(raw, words, limit))
+        if len(parts) > 1:
+            hits.sort(key=lambda h: (h[0], h[1]))
+        return [h[2] for h in hits[:limit]]
+
+
+_index: Optional[SymbolIndex] = None
+_build_lock = threading.Lock()   # serialises rebuilds only; readers never take it
+
+
+def load_rows(rows: Iterable[Row]) -> SymbolIndex:
+    """Build a fresh index from (Exchange, Stock Symbol, Security ID) rows and swap it in."""
+    global _index
+    with _build_lock:
+        idx = SymbolIndex(rows)
+        _index = idx
+    print(f"[symbols] search index built: {idx.count} rows, "
+          f"{len(idx.partitions)} exchanges", flush=True)
+    return idx
+
+
+def current() -> Optional[SymbolIndex]:
+    return _index
+
+
+def search(q: str, exchange: str = "", limit: int = 200) -> List[Row]:
+    idx = _index
+    return idx.search(q, exchange, limit) if idx is not None else []
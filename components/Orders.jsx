@@ -3,6 +3,7 @@
 import { useEffect, useMemo, useRef, useState } from 'react';
 import { Button, Card, Table, Tabs, Tab, Badge, Modal, Form, Spinner, InputGroup } from 'react-bootstrap';
 import api from './api';
+import { subscribeStream, subscribeTicks } from './liveStream';
 
 /* == tiny inline icons (no extra deps) == */
 const SearchIcon = (props) => (
@@ -147,10 +148,23 @@ export default function Orders() {
     }
   };
 
+  // live diffs over SSE; fall back to 3 s polling if the stream isn't available
   useEffect(() => {
-    fetchAll().catch(() => {});
-    timerRef.current = setInterval(() => { fetchAll().catch(() => {}); }, AUTO_REFRESH_MS);
+    const startPolling = () => {
+      if (timerRef.current) return;
+      fetchAll().catch(() => {});
+      timerRef.current = setInterval(() => { fetchAll().catch(() => {}); }, AUTO_REFRESH_MS);
+    };
+    const close = subscribeStream('/stream/orders', ['pending', 'traded', 'rejected', 'cancelled', 'others'], {
+      onData: (next) => {
+        snapRef.current = JSON.stringify(next);
+        setOrders(next);
+        setLastUpdated(new Date());
+      },
+      onError: startPolling,
+    });
     return () => {
+      close();
       if (timerRef.current) clearInterval(timerRef.current);
       if (abortRef.current) abortRef.current.abort();
     };
@@ -220,6 +234,17 @@ export default function Orders() {
     } catch { /* ignore 404 etc. */ }
   };
 
+  // keep the modify dialog's LTP ticking while it is open
+  useEffect(() => {
+    if (!showModify || !modifyTarget?.symbol) return undefined;
+    return subscribeTicks([modifyTarget.symbol], {
+      onTick: (t) => {
+        const v = Number(t?.ltp);
+        if (!Number.isNaN(v) && v > 0) setModLTP(v.toFixed(2));
+      },
+    });
+  }, [showModify, modifyTarget]);
+
   const openModify = () => {
     const chosen = getSelectedPending();
     if (chosen.length === 0) { alert('Select at least one order in Pending to modify.'); return; }
@@ -509,7 +534,7 @@ export default function Orders() {
         </div>
 
         <Badge bg="secondary" className="ms-2">
-          Auto-refresh: {Math.round(AUTO_REFRESH_MS / 1000)}s {lastUpdated ? `· Updated ${lastUpdated.toLocaleTimeString()}` : ''}
+          {timerRef.current ? `Auto-refresh: ${Math.round(AUTO_REFRESH_MS / 1000)}s` : 'Live'} {lastUpdated ? `· Updated ${lastUpdated.toLocaleTimeString()}` : ''}
         </Badge>
       </div>
 
@@ -2,6 +2,7 @@
 import { useEffect, useRef, useState } from 'react';
 import { Button, Card, Table, Tabs, Tab, Badge } from 'react-bootstrap';
 import api from './api';
+import { subscribeStream } from './liveStream';
 
 const AUTO_REFRESH_MS = 3000;
 
@@ -44,10 +45,24 @@ export default function Positions() {
     }
   };
 
+  // live diffs over SSE; fall back to 3 s polling if the stream isn't available
   useEffect(() => {
-    fetchAll().catch(()=>{});
-    timerRef.current = setInterval(() => { fetchAll().catch(()=>{}); }, AUTO_REFRESH_MS);
+    const startPolling = () => {
+      if (timerRef.current) return;
+      fetchAll().catch(()=>{});
+      timerRef.current = setInterval(() => { fetchAll().catch(()=>{}); }, AUTO_REFRESH_MS);
+    };
+    const close = subscribeStream('/stream/positions', ['open', 'closed'], {
+      onData: (next) => {
+        snapRef.current = JSON.stringify({ nextOpen: next.open, nextClosed: next.closed });
+        setOpenRows(next.open);
+        setClosedRows(next.closed);
+        setLastUpdated(new Date());
+      },
+      onError: startPolling,
+    });
     return () => {
+      close();
       if (timerRef.current) clearInterval(timerRef.current);
       if (abortRef.current) abortRef.current.abort();
     };
@@ -119,7 +134,7 @@ export default function Positions() {
         <Button onClick={()=>fetchAll()}>Refresh Positions</Button>
         <Button variant="danger" onClick={closeSelected}>Close Position</Button>
         <Badge bg="secondary" className="ms-auto">
-          Auto-refresh: 3s {lastUpdated ? `· Updated ${lastUpdated.toLocaleTimeString()}` : ''}
+          {timerRef.current ? 'Auto-refresh: 3s' : 'Live'} {lastUpdated ? `· Updated ${lastUpdated.toLocaleTimeString()}` : ''}
         </Badge>
       </div>
       <Tabs defaultActiveKey="open" className="mb-3">
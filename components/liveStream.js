@@ -0,0 +1,90 @@
+// components/liveStream.js
+import API_BASE from '../src/lib/apiBase.js';
+
+/*
+ * Subscribe to a router SSE stream (/stream/orders, /stream/positions).
+ * Keeps bucket -> key -> row maps, applies 'diff' events on top of the last
+ * 'snapshot' and calls onData({ bucket: [rows] }) after each change.
+ * Returns a close() function. onError fires if the stream can't be used,
+ * so the caller can fall back to polling.
+ */
+export function subscribeStream(path, buckets, { onData, onError } = {}) {
+  if (typeof window === 'undefined' || typeof window.EventSource === 'undefined') {
+    onError && onError(new Error('EventSource not supported'));
+    return () => {};
+  }
+
+  let state = {};
+  let opened = false;
+  const es = new EventSource(`${API_BASE}${path}`);
+
+  const emit = () => {
+    const out = {};
+    buckets.forEach((b) => { out[b] = Array.from((state[b] || new Map()).values()); });
+    onData && onData(out);
+  };
+
+  es.addEventListener('snapshot', (ev) => {
+    opened = true;
+    const data = JSON.parse(ev.data || '{}');
+    state = {};
+    buckets.forEach((b) => {
+      state[b] = new Map((data.buckets?.[b] || []).map((row) => [rowKeyOf(path, row), row]));
+    });
+    emit();
+  });
+
+  es.addEventListener('diff', (ev) => {
+    const d = JSON.parse(ev.data || '{}');
+    (d.removed || []).forEach(({ bucket, key }) => state[bucket]?.delete(key));
+    [...(d.added || []), ...(d.changed || [])].forEach(({ bucket, key, row }) => {
+      if (!state[bucket]) state[bucket] = new Map();
+      state[bucket].set(key, row);
+    });
+    emit();
+  });
+
+  es.onerror = () => {
+    // before the first snapshot: give up and let the caller poll;
+    // afterwards EventSource reconnects by itself and resends a snapshot
+    if (!opened) {
+      es.close();
+      onError && onError(new Error(`stream ${path} unavailable`));
+    }
+  };
+
+  return () => es.close();
+}
+
+/*
+ * Live ticks for some symbols ("INFY", "NSE:INFY" or "NSE:2885") from
+ * /stream/ticks. onTick(tick) fires for the snapshot and every update;
+ * tick = { exchange, code, ltp, time, LTP: {...}, ... }. Returns close().
+ */
+export function subscribeTicks(symbols, { onTick, onError } = {}) {
+  if (typeof window === 'undefined' || typeof window.EventSource === 'undefined' || !symbols.length) {
+    onError && onError(new Error('tick stream unavailable'));
+    return () => {};
+  }
+  let opened = false;
+  const es = new EventSource(`${API_BASE}/stream/ticks?symbols=${encodeURIComponent(symbols.join(','))}`);
+  const handle = (ev) => {
+    opened = true;
+    (JSON.parse(ev.data || '{}').ticks || []).forEach((t) => onTick && onTick(t));
+  };
+  es.addEventListener('snapshot', handle);
+  es.addEventListener('ticks', handle);
+  es.onerror = () => {
+    if (!opened) {
+      es.close();
+      onError && onError(new Error('tick stream unavailable'));
+    }
+  };
+  return () => es.close();
+}
+
+// must match the server's key functions (MultiBroker_Router._order_stream / _position_stream)
+function rowKeyOf(path, row) {
+  if (path.includes('positions')) return `${row.name ?? ''}|${row.symbol ?? ''}`;
+  return String(row.order_id || `${row.name ?? ''}|${row.symbol ?? ''}|${row.status ?? ''}`);
+}
@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault("COPY_TRADING", "0")
+os.environ.setdefault("DHAN_ORDER_FEED", "0")
+os.environ.setdefault("MO_TRADE_FEED", "0")
+
+import Copy_trading as CT
+
+
+def _engine(book):
+    e = CT.CopyEngine()
+    placed = []
+    e._place = lambda setups, o, mirror, t0, via: placed.append(o["order_id"])
+    e._master_orders = lambda uid: list(book)
+    e._by_master = {"M0": {"s": object()}}
+    return e, placed
+
+
+def test_poll_past_history_limit_places_each_order_once(monkeypatch):
+    monkeypatch.setattr(CT, "COPY_HISTORY", 3)
+    book = []
+    e, placed = _engine(book)
+    e._poll("M0")                                       # empty book is the baseline
+    book.extend({"order_id": f"O{i}", "status": "open"} for i in range(5))
+    counts = []
+    for _ in range(3):
+        e._poll("M0")
+        counts.append(len(placed))
+    assert counts == [5, 5, 5]
+    assert sorted(placed) == [f"O{i}" for i in range(5)]
+
+
+def test_push_before_baseline_is_dropped(monkeypatch):
+    book = [{"order_id": "OLD", "status": "open"}]
+    e, placed = _engine(book)
+
+    class _Adapter:
+        def fn(self, name):
+            return (lambda raw: dict(raw)) if name == "copy_order" else None
+
+    monkeypatch.setattr(CT.broker_registry, "get", lambda broker: _Adapter())
+    e._on_push("dhan", "M0", {"order_id": "OLD", "status": "filled"}, 0.0)   # update of a book order
+    assert placed == [] and "M0" not in e._baseline
+    e._poll("M0")                                       # the poll takes the baseline
+    e._on_push("dhan", "M0", {"order_id": "OLD", "status": "filled"}, 0.0)
+    e._on_push("dhan", "M0", {"order_id": "NEW", "status": "open"}, 0.0)
+    assert placed == ["NEW"]